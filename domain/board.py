@@ -46,6 +46,7 @@ Computer plays with B (black piece) and human with W (white piece)
 
 from tabulate import tabulate
 from domain.color import Color
+from domain.tables import POINT_INDEX
 
 
 class Board:
@@ -55,8 +56,20 @@ class Board:
         for i in range(8):
             self._data.append([0] * 8)
 
+        # one bitmask per player (index 0 unused), kept in sync with _data
+        self._masks = [0, 0, 0]
+
+    @property
+    def masks(self):
+        return self._masks
+
     def update(self, row, col, player):
         self._data[row][col] = player
+        bit = 1 << POINT_INDEX[(row, col)]
+        self._masks[1] &= ~bit
+        self._masks[2] &= ~bit
+        if player:
+            self._masks[player] |= bit
 
     def __str__(self):
         headers = ["/", "A", "B", "C", "D", "E", "F", "G"]
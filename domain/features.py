@@ -0,0 +1,83 @@
+"""
+Evaluation features
+
+A position keeps running counts of the features the AI evaluates, per color:
+
+- MILLS:    closed mills
+- TWOS:     lines with two own pieces and an empty third point
+- BLOCKED:  pieces without an empty adjacent point
+- MOBILITY: (piece, empty adjacent point) pairs
+
+The counts live in one flat list, feature + player - 1 is the count of a
+player (e.g. features[MILLS + 1] are the mills of black).
+
+Putting a piece on, or taking it off, point i only changes the two lines
+through i and the pieces on i and its neighbours, so Position updates the
+counts by subtracting the features around i before the change and adding
+them back after it (update_features). features computes them from scratch,
+which the tests use as the reference.
+"""
+from domain.tables import POINT_COUNT, ALL_POINTS, MILL_MASKS, POINT_MILL_MASKS, ADJACENT, ADJACENT_MASKS
+
+MILLS = 0
+TWOS = 2
+BLOCKED = 4
+MOBILITY = 6
+FEATURE_COUNT = 8
+
+# index -> the index and its neighbours, whose mobility changes with the index
+_NEIGHBOURHOOD = tuple((index,) + ADJACENT[index] for index in range(POINT_COUNT))
+
+
+def _count(counts, white, black, lines, points, sign):
+    # adds sign times the features of the given lines and points to counts
+    for line in lines:
+        in_white = (white & line).bit_count()
+        in_black = (black & line).bit_count()
+        if in_white == 3:
+            counts[MILLS] += sign
+        elif in_black == 3:
+            counts[MILLS + 1] += sign
+        elif in_white == 2 and not in_black:
+            counts[TWOS] += sign
+        elif in_black == 2 and not in_white:
+            counts[TWOS + 1] += sign
+    empty = ALL_POINTS & ~(white | black)
+    for index in points:
+        if white >> index & 1:
+            side = 0
+        elif black >> index & 1:
+            side = 1
+        else:
+            continue
+        free = (ADJACENT_MASKS[index] & empty).bit_count()
+        counts[MOBILITY + side] += sign * free
+        if not free:
+            counts[BLOCKED + side] += sign
+
+
+def features(white, black):
+    """
+    Counts the features of a whole board.
+
+    :param white: mask of the white pieces
+    :param black: mask of the black pieces
+    :return: list of FEATURE_COUNT counts
+    """
+    counts = [0] * FEATURE_COUNT
+    _count(counts, white, black, MILL_MASKS, range(POINT_COUNT), 1)
+    return counts
+
+
+def update_features(counts, masks, index, player):
+    """
+    Flips point index in the mask of player and updates counts to match, in place.
+
+    :param counts: the feature counts of the position before the change
+    :param masks: [unused, white mask, black mask], changed in place
+    """
+    lines = POINT_MILL_MASKS[index]
+    points = _NEIGHBOURHOOD[index]
+    _count(counts, masks[1], masks[2], lines, points, -1)
+    masks[player] ^= 1 << index
+    _count(counts, masks[1], masks[2], lines, points, 1)
@@ -0,0 +1,317 @@
+"""
+Bitboard position
+
+A position keeps one 24-bit mask per color (see domain.tables for the point
+numbering), the player to move and the pieces each player still has in hand.
+Copying a position is a handful of integer assignments, so the search can
+afford one per node instead of copying the 8x8 grid of the Board.
+
+Players use the same ids as the rest of the game: 1 for white, 2 for black.
+
+A move is a (start, end, removed) tuple of point indices: start is None for
+a placement and removed is None when the move does not take a piece. A move
+that closes a mill is generated once for every piece it may take, so the
+search sees each capture as its own move.
+
+Each position also carries its Zobrist key (domain.zobrist) and the counts
+of the evaluation features (domain.features), both updated along with the
+masks.
+"""
+from domain.tables import POINTS, ALL_POINTS, MILL_MASKS, POINT_MILL_MASKS, ADJACENT_MASKS, PIECES_PER_PLAYER
+from domain.zobrist import PIECE_KEYS, IN_HAND_KEYS, BLACK_TO_MOVE_KEY, zobrist_key
+from domain.features import features, update_features
+
+PLACING = "placing"
+MOVING = "moving"
+FLYING = "flying"
+
+
+def mill_points(mask):
+    """
+    Finds the pieces of a mask that stand in a closed mill.
+
+    :param mask: the pieces of one player
+    :return: bitmask of the pieces that belong to at least one full mill
+    """
+    points = 0
+    for mill in MILL_MASKS:
+        if mask & mill == mill:
+            points |= mill
+    return points
+
+
+def removable_points(mask):
+    """
+    Finds the pieces of a mask the opponent may take after closing a mill.
+
+    :param mask: the pieces of the player who loses a piece
+    :return: bitmask of the pieces outside closed mills, or of all pieces when every piece is in a mill
+    """
+    outside = mask & ~mill_points(mask)
+    return outside if outside else mask
+
+
+class Position:
+    __slots__ = ("masks", "in_hand", "turn", "key", "features")
+
+    def __init__(self, white=0, black=0, turn=1, white_in_hand=0, black_in_hand=0):
+        # index 0 is unused so the lists can be indexed with the player id
+        self.masks = [0, white, black]
+        self.in_hand = [0, white_in_hand, black_in_hand]
+        self.turn = turn
+        self.key = zobrist_key(self.masks, self.in_hand, turn)
+        self.features = features(white, black)
+
+    @classmethod
+    def from_board(cls, board, turn, white_in_hand=0, black_in_hand=0):
+        """
+        Builds a position from the occupancy masks of a Board.
+
+        :param board: the Board to read
+        :param turn: the player to move
+        :param white_in_hand: pieces white still has to place
+        :param black_in_hand: pieces black still has to place
+        :return: a new Position
+        """
+        masks = board.masks
+        return cls(masks[1], masks[2], turn, white_in_hand, black_in_hand)
+
+    def copy(self):
+        position = Position.__new__(Position)
+        position.masks = self.masks[:]
+        position.in_hand = self.in_hand[:]
+        position.turn = self.turn
+        position.key = self.key
+        position.features = self.features[:]
+        return position
+
+    @property
+    def occupied(self):
+        return self.masks[1] | self.masks[2]
+
+    @property
+    def empty(self):
+        return ALL_POINTS & ~(self.masks[1] | self.masks[2])
+
+    def count(self, player):
+        return self.masks[player].bit_count()
+
+    def phase(self, player=None):
+        if player is None:
+            player = self.turn
+        if self.in_hand[player] > 0:
+            return PLACING
+        if self.count(player) == 3:
+            return FLYING
+        return MOVING
+
+    def has_moves(self, player):
+        """Checks if the player can place or move a piece (flying counts as a move)."""
+        empty = self.empty
+        if not empty:
+            return False
+        if self.phase(player) != MOVING:
+            return True
+        pieces = self.masks[player]
+        while pieces:
+            bit = pieces & -pieces
+            if ADJACENT_MASKS[bit.bit_length() - 1] & empty:
+                return True
+            pieces ^= bit
+        return False
+
+    def is_lost(self, player):
+        """A player loses with fewer than three pieces left in total or when blocked after placing."""
+        if self.count(player) + self.in_hand[player] < 3:
+            return True
+        return self.in_hand[player] == 0 and not self.has_moves(player)
+
+    def _toggle(self, index, player):
+        # Flips one point of a mask and updates the feature counts around it
+        update_features(self.features, self.masks, index, player)
+
+    def place(self, index, player):
+        in_hand = self.in_hand[player]
+        self._toggle(index, player)
+        self.in_hand[player] = in_hand - 1
+        keys = IN_HAND_KEYS[player]
+        self.key ^= PIECE_KEYS[player][index] ^ keys[in_hand] ^ keys[in_hand - 1]
+
+    def move(self, start, end, player):
+        self._toggle(start, player)
+        self._toggle(end, player)
+        self.key ^= PIECE_KEYS[player][start] ^ PIECE_KEYS[player][end]
+
+    def remove(self, index, player):
+        if self.masks[player] >> index & 1:
+            self._toggle(index, player)
+            self.key ^= PIECE_KEYS[player][index]
+
+    def forms_mill(self, index, player):
+        """
+        Checks if a piece of the given player on index closes a mill.
+
+        :param index: the point index
+        :param player: the player ID
+        :return: True if the point would be part of a full mill
+        """
+        return self.closes_mill(None, index, player)
+
+    def closes_mill(self, start, end, player):
+        """
+        Checks if moving (or placing, when start is None) a piece to end closes a mill.
+        """
+        mask = self.masks[player] | (1 << end)
+        if start is not None:
+            mask &= ~(1 << start)
+        first, second = POINT_MILL_MASKS[end]
+        return mask & first == first or mask & second == second
+
+    def in_mill(self, index, player):
+        return bool(self.masks[player] >> index & 1) and self.forms_mill(index, player)
+
+    def generate_moves(self, captures=False):
+        """
+        Lists the placements or moves of the player to move.
+
+        :param captures: expand moves that close a mill into one move per piece they may take;
+                         without it removed is always None
+        :return: list of (start, end, removed) moves
+        """
+        player = self.turn
+        empty = self.empty
+        moves = []
+        phase = self.phase(player)
+        if phase == PLACING:
+            while empty:
+                bit = empty & -empty
+                moves.append((None, bit.bit_length() - 1, None))
+                empty ^= bit
+        else:
+            pieces = self.masks[player]
+            while pieces:
+                bit = pieces & -pieces
+                start = bit.bit_length() - 1
+                targets = empty if phase == FLYING else ADJACENT_MASKS[start] & empty
+                while targets:
+                    target = targets & -targets
+                    moves.append((start, target.bit_length() - 1, None))
+                    targets ^= target
+                pieces ^= bit
+        if not captures:
+            return moves
+
+        removable = removable_points(self.masks[3 - player])
+        if not removable:
+            return moves
+        expanded = []
+        for move in moves:
+            start, end, _ = move
+            if not self.closes_mill(start, end, player):
+                expanded.append(move)
+                continue
+            targets = removable
+            while targets:
+                bit = targets & -targets
+                expanded.append((start, end, bit.bit_length() - 1))
+                targets ^= bit
+        return expanded
+
+    def make_move(self, move):
+        """
+        Plays a move for the player to move, in place.
+
+        :param move: a (start, end, removed) tuple
+        :return: the token to give to unmake_move
+        """
+        start, end, removed = move
+        player = self.turn
+        key = self.key
+        # the counts are restored as a whole on unmake, the position keeps a copy it can change
+        token = (move, key, self.features)
+        self.features = self.features[:]
+        keys = PIECE_KEYS[player]
+        if start is None:
+            in_hand = self.in_hand[player]
+            self._toggle(end, player)
+            self.in_hand[player] = in_hand - 1
+            key ^= keys[end] ^ IN_HAND_KEYS[player][in_hand] ^ IN_HAND_KEYS[player][in_hand - 1]
+        else:
+            self._toggle(start, player)
+            self._toggle(end, player)
+            key ^= keys[start] ^ keys[end]
+        if removed is not None:
+            self._toggle(removed, 3 - player)
+            key ^= PIECE_KEYS[3 - player][removed]
+        self.turn = 3 - player
+        self.key = key ^ BLACK_TO_MOVE_KEY
+        return token
+
+    def unmake_move(self, token):
+        """
+        Takes back the move that returned the token; moves must be undone in reverse order.
+        """
+        (start, end, removed), key, counts = token
+        player = 3 - self.turn
+        self.turn = player
+        self.key = key
+        self.features = counts
+        if removed is not None:
+            self.masks[3 - player] |= 1 << removed
+        if start is None:
+            self.masks[player] &= ~(1 << end)
+            self.in_hand[player] += 1
+        else:
+            self.masks[player] ^= (1 << start) | (1 << end)
+
+    def to_string(self):
+        """
+        Writes the position as text: the 24 points in index order ('W' white, 'B' black,
+        '.' empty), the player to move and the pieces each player has in hand,
+        e.g. "WW.B.................... 1 7 8".
+        """
+        white, black = self.masks[1], self.masks[2]
+        points = "".join("W" if white >> index & 1 else "B" if black >> index & 1 else "."
+                         for index in range(len(POINTS)))
+        return f"{points} {self.turn} {self.in_hand[1]} {self.in_hand[2]}"
+
+    @classmethod
+    def from_string(cls, text):
+        """
+        Reads a position written by to_string.
+
+        :raises ValueError: if the text is not a valid position
+        """
+        fields = text.split()
+        if len(fields) != 4 or len(fields[0]) != len(POINTS) or set(fields[0]) - set("WB."):
+            raise ValueError(f"Invalid position: {text!r}")
+        white = black = 0
+        for index, point in enumerate(fields[0]):
+            if point == "W":
+                white |= 1 << index
+            elif point == "B":
+                black |= 1 << index
+        turn, white_in_hand, black_in_hand = (int(field) for field in fields[1:])
+        if turn not in (1, 2) or not 0 <= white_in_hand <= PIECES_PER_PLAYER or \
+                not 0 <= black_in_hand <= PIECES_PER_PLAYER:
+            raise ValueError(f"Invalid position: {text!r}")
+        return cls(white, black, turn, white_in_hand, black_in_hand)
+
+    def to_grid(self):
+        """Expands the position to the 8x8 list layout used by Board._data."""
+        grid = [[0] * 8 for _ in range(8)]
+        white, black = self.masks[1], self.masks[2]
+        for index, (row, col) in enumerate(POINTS):
+            if white >> index & 1:
+                grid[row][col] = 1
+            elif black >> index & 1:
+                grid[row][col] = 2
+        return grid
+
+    def __eq__(self, other):
+        return isinstance(other, Position) and self.masks == other.masks and \
+            self.in_hand == other.in_hand and self.turn == other.turn
+
+    def __repr__(self):
+        return f"Position(white={self.masks[1]:#08x}, black={self.masks[2]:#08x}, turn={self.turn}, " \
+               f"in_hand={self.in_hand[1]}/{self.in_hand[2]})"
@@ -0,0 +1,130 @@
+"""
+Board symmetries
+
+The board looks the same after 16 transformations: the 4 rotations, each
+with or without a mirror image, each with or without swapping the inner and
+the outer square (the middle square stays). Every one of them maps adjacent
+points to adjacent points and mills to mills, so a position and its images
+have the same value.
+
+PERMUTATIONS[s][i] is the index of the point that point i goes to under
+symmetry s; symmetry 0 is the identity. transform_mask moves the bits of a
+point mask with three table lookups, one per byte.
+
+The canonical form of a position is its image with the smallest (black,
+white) masks. Caches keyed by the canonical key (canonical_key) hold one
+entry for all the images of a position; a move found in the canonical form
+is played in the original one after transform_move with the inverse
+symmetry (INVERSES).
+"""
+from domain.tables import POINT_COUNT, ALL_POINTS, POINTS, POINT_INDEX
+from domain.zobrist import zobrist_key
+
+SYMMETRY_COUNT = 16
+
+_CENTER = 4
+
+
+def _rotate(point):
+    row, col = point
+    return col, 2 * _CENTER - row
+
+
+def _mirror(point):
+    row, col = point
+    return row, 2 * _CENTER - col
+
+
+def _swap_rings(point):
+    # the outer square is three steps from the center, the inner one one step
+    row, col = point
+    ring = max(abs(row - _CENTER), abs(col - _CENTER))
+    if ring == 2:
+        return point
+    scale = 1 / 3 if ring == 3 else 3
+    return _CENTER + round((row - _CENTER) * scale), _CENTER + round((col - _CENTER) * scale)
+
+
+def _permutation(rotations, mirror, swap):
+    permutation = []
+    for point in POINTS:
+        for _ in range(rotations):
+            point = _rotate(point)
+        if mirror:
+            point = _mirror(point)
+        if swap:
+            point = _swap_rings(point)
+        permutation.append(POINT_INDEX[point])
+    return tuple(permutation)
+
+
+# symmetry -> index -> image index
+PERMUTATIONS = tuple(_permutation(rotations, mirror, swap)
+                     for swap in (False, True) for mirror in (False, True) for rotations in range(4))
+
+# symmetry -> the symmetry that undoes it
+INVERSES = tuple(next(inverse for inverse in range(len(PERMUTATIONS))
+                      if all(PERMUTATIONS[inverse][image] == index for index, image in enumerate(permutation)))
+                 for permutation in PERMUTATIONS)
+
+# symmetry -> byte number -> byte value -> the image bits of that byte
+_BYTE_IMAGES = tuple(
+    tuple(tuple(sum(1 << permutation[8 * byte + bit] for bit in range(8) if value >> bit & 1)
+                for value in range(256))
+          for byte in range(POINT_COUNT // 8))
+    for permutation in PERMUTATIONS)
+
+
+def transform_mask(mask, symmetry):
+    """Maps a point mask through a symmetry."""
+    low, middle, high = _BYTE_IMAGES[symmetry]
+    return low[mask & 0xFF] | middle[mask >> 8 & 0xFF] | high[mask >> 16]
+
+
+def canonical_mask(mask):
+    """
+    Picks the smallest image of a point mask.
+
+    :return: (the smallest image, the first symmetry that gives it)
+    """
+    best, best_symmetry = mask, 0
+    for symmetry in range(1, SYMMETRY_COUNT):
+        image = transform_mask(mask, symmetry)
+        if image < best:
+            best, best_symmetry = image, symmetry
+    return best, best_symmetry
+
+
+def transform_move(move, symmetry):
+    """Maps a (start, end, removed) move through a symmetry."""
+    if move is None:
+        return None
+    permutation = PERMUTATIONS[symmetry]
+    return tuple(None if index is None else permutation[index] for index in move)
+
+
+def transform_position(position, symmetry):
+    """The image of a Position under a symmetry, as a new Position."""
+    image = position.copy()
+    image.masks = [0, transform_mask(position.masks[1], symmetry), transform_mask(position.masks[2], symmetry)]
+    # the features count the same things on the image; only the key depends on the points
+    image.key = zobrist_key(image.masks, image.in_hand, image.turn)
+    return image
+
+
+def canonical_key(position):
+    """
+    The Zobrist key of the canonical form of a position.
+
+    :return: (key, the symmetry that maps the position to its canonical form)
+    """
+    white, black = position.masks[1], position.masks[2]
+    best, best_symmetry = black << POINT_COUNT | white, 0
+    for symmetry in range(1, SYMMETRY_COUNT):
+        image = transform_mask(black, symmetry) << POINT_COUNT | transform_mask(white, symmetry)
+        if image < best:
+            best, best_symmetry = image, symmetry
+    if not best_symmetry:
+        return position.key, 0
+    masks = [0, best & ALL_POINTS, best >> POINT_COUNT]
+    return zobrist_key(masks, position.in_hand, position.turn), best_symmetry
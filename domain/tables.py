@@ -0,0 +1,69 @@
+"""
+Board geometry tables
+
+The twenty-four points are numbered 0-23 in reading order (top row first,
+left to right). A set of points is stored as a 24-bit integer where bit i
+stands for point POINTS[i]; this is the layout used by domain.position.
+"""
+
+POINT_COUNT = 24
+PIECES_PER_PLAYER = 9
+ALL_POINTS = (1 << POINT_COUNT) - 1
+
+# index -> (row, col)
+POINTS = ((1, 1), (1, 4), (1, 7),
+          (2, 2), (2, 4), (2, 6),
+          (3, 3), (3, 4), (3, 5),
+          (4, 1), (4, 2), (4, 3),
+          (4, 5), (4, 6), (4, 7),
+          (5, 3), (5, 4), (5, 5),
+          (6, 2), (6, 4), (6, 6),
+          (7, 1), (7, 4), (7, 7))
+
+# (row, col) -> index
+POINT_INDEX = {point: index for index, point in enumerate(POINTS)}
+
+# adjacency list for each intersection
+ADJ = {(1, 1): ((1, 4), (4, 1)), (1, 4): ((1, 1), (1, 7), (2, 4)), (1, 7): ((1, 4), (4, 7)),
+       (4, 7): ((1, 7), (7, 7), (4, 6)),
+       (7, 7): ((4, 7), (7, 4)), (7, 4): ((7, 7), (7, 1), (6, 4)), (7, 1): ((7, 4), (4, 1)),
+       (4, 1): ((7, 1), (1, 1), (4, 2)),
+       (2, 2): ((2, 4), (4, 2)), (2, 4): ((2, 2), (2, 6), (1, 4), (3, 4)), (2, 6): ((2, 4), (4, 6)),
+       (4, 6): ((2, 6), (6, 6), (4, 7), (4, 5)),
+       (6, 6): ((4, 6), (6, 4)), (6, 4): ((6, 6), (6, 2), (7, 4), (5, 4)), (6, 2): ((6, 4), (4, 2)),
+       (4, 2): ((6, 2), (2, 2), (4, 1), (4, 3)),
+       (3, 3): ((3, 4), (4, 3)), (3, 4): ((3, 3), (3, 5), (2, 4)), (3, 5): ((3, 4), (4, 5)),
+       (4, 5): ((3, 5), (5, 5), (4, 6)),
+       (5, 5): ((4, 5), (5, 4)), (5, 4): ((5, 5), (5, 3), (6, 4)), (5, 3): ((5, 4), (4, 3)),
+       (4, 3): ((5, 3), (3, 3), (4, 2))
+       }
+
+# list of mills
+MILLS = (((1, 1), (1, 4), (1, 7)), ((4, 1), (4, 2), (4, 3)), ((7, 1), (7, 4), (7, 7)),
+         ((2, 2), (2, 4), (2, 6)), ((2, 2), (4, 2), (6, 2)), ((6, 2), (6, 4), (6, 6)),
+         ((3, 3), (3, 4), (3, 5)), ((5, 3), (5, 4), (5, 5)), ((2, 6), (4, 6), (6, 6)),
+         ((1, 4), (2, 4), (3, 4)), ((3, 5), (4, 5), (5, 5)), ((1, 7), (4, 7), (7, 7)),
+         ((5, 4), (6, 4), (7, 4)), ((3, 3), (4, 3), (5, 3)), ((1, 1), (4, 1), (7, 1)),
+         ((4, 5), (4, 6), (4, 7))
+         )
+
+
+def _mask(points):
+    mask = 0
+    for point in points:
+        mask |= 1 << POINT_INDEX[point]
+    return mask
+
+
+# index -> bitmask of the adjacent points
+ADJACENT_MASKS = tuple(_mask(ADJ[point]) for point in POINTS)
+
+# bitmask of the three points of each mill, same order as MILLS
+MILL_MASKS = tuple(_mask(mill) for mill in MILLS)
+
+# index -> indices of the adjacent points
+ADJACENT = tuple(tuple(POINT_INDEX[adj] for adj in ADJ[point]) for point in POINTS)
+
+# index -> the two mills the point belongs to, as (row, col) triples and as bitmasks
+POINT_MILLS = tuple(tuple(mill for mill in MILLS if point in mill) for point in POINTS)
+POINT_MILL_MASKS = tuple(tuple(_mask(mill) for mill in mills) for mills in POINT_MILLS)
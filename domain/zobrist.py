@@ -0,0 +1,51 @@
+"""
+Zobrist keys
+
+Every (point, color), every (color, pieces in hand) pair and the side to move
+get a random 64-bit number; the key of a position is the xor of the numbers
+of everything that is true in it. Playing a move only changes a few of those
+facts, so Position updates its key with a couple of xors instead of hashing
+the whole board.
+
+The generator is seeded, so all processes agree on the keys.
+"""
+from random import Random
+
+from domain.tables import POINT_COUNT, PIECES_PER_PLAYER
+
+_random = Random(0x9E3779B97F4A7C15)
+
+
+def _keys(count):
+    return tuple(_random.getrandbits(64) for _ in range(count))
+
+
+# PIECE_KEYS[player][index], index 0 of the outer tuple is unused
+PIECE_KEYS = (None, _keys(POINT_COUNT), _keys(POINT_COUNT))
+
+# IN_HAND_KEYS[player][pieces in hand]
+IN_HAND_KEYS = (None, _keys(PIECES_PER_PLAYER + 1), _keys(PIECES_PER_PLAYER + 1))
+
+# xor-ed in when black is to move
+BLACK_TO_MOVE_KEY = _random.getrandbits(64)
+
+
+def zobrist_key(masks, in_hand, turn):
+    """
+    Computes the key of a position from scratch.
+
+    :param masks: [unused, white mask, black mask]
+    :param in_hand: [unused, white in hand, black in hand]
+    :param turn: the player to move
+    :return: the 64-bit key
+    """
+    key = BLACK_TO_MOVE_KEY if turn == 2 else 0
+    for player in (1, 2):
+        mask = masks[player]
+        keys = PIECE_KEYS[player]
+        while mask:
+            bit = mask & -mask
+            key ^= keys[bit.bit_length() - 1]
+            mask ^= bit
+        key ^= IN_HAND_KEYS[player][in_hand[player]]
+    return key
@@ -1,224 +1,630 @@
 #from game import Game
+from time import perf_counter
+
+from domain.position import PLACING, FLYING
+from domain.features import MILLS, TWOS, BLOCKED, MOBILITY
+from domain.tables import POINTS, ADJACENT_MASKS
+from services.transposition import TranspositionTable, EXACT, LOWER, UPPER
+from services.move_ordering import MoveOrderer
+from services.batch_eval import encode, encode_masks, batch_evaluate
+from services.parallel_search import ParallelSearch
+from services.lazy_smp import LazySMP
+from services.tablebase import WIN, LOSS, MAX_PLIES
+from domain.symmetry import INVERSES, canonical_key, transform_move
+from services.game_exceptions import SearchTimeout
 
 inf = 1000000000
 
+# memory for the transposition table of each AI, in MB
+DEFAULT_HASH_MB = 16
+# depth searched when no time or node budget is given
+DEFAULT_DEPTH = 3
+# deepest iteration tried when searching on a budget
+MAX_SEARCH_DEPTH = 64
+# the clock is read once every this many nodes
+CHECK_EVERY_NODES = 256
+
+# evaluation weights, per piece, mill, two in a row, (piece, free point) pair and blocked piece
+PIECE_WEIGHT = 1000
+MILL_WEIGHT = 200
+TWO_WEIGHT = 150
+MOBILITY_WEIGHT = 10
+BLOCKED_WEIGHT = 50
+EVALUATION_WEIGHTS = (PIECE_WEIGHT, MILL_WEIGHT, TWO_WEIGHT, MOBILITY_WEIGHT, BLOCKED_WEIGHT)
+# value of a won position, well inside the range the transposition table stores
+WIN_SCORE = 1000000
+
 class AIPLayer:
-    def __init__(self, game, graphic):
+    def __init__(self, game, graphic, hash_size_mb=DEFAULT_HASH_MB, max_depth=None, time_limit=None, node_limit=None,
+                 batch_leaves=False, workers=1, smp_helpers=0, tablebase=None,
+                 symmetric_table=False, opening_book=None):
+        """
+        :param hash_size_mb: memory for the transposition table, in MB
+        :param max_depth: deepest iteration; DEFAULT_DEPTH without a budget, MAX_SEARCH_DEPTH with one
+        :param time_limit: seconds per move, None for no limit
+        :param node_limit: nodes per move, None for no limit
+        :param batch_leaves: evaluate all children of a node one ply above the leaves in one NumPy batch
+        :param workers: worker processes to split the root moves over; 1 searches in this process
+        :param smp_helpers: helper processes searching the same root into a shared transposition table (Lazy SMP)
+        :param tablebase: services.tablebase.Tablebase with solved endgames, None to search them
+        :param symmetric_table: key the transposition table by the canonical form of each position (domain.symmetry),
+                                so the images of a position share one entry
+        :param opening_book: services.opening_book.OpeningBook probed before searching a placement
+        """
         self.__game = game
         self.__game_mode = "human_vs_ai"
         self.graphic = graphic
+        self.hash_size_mb = hash_size_mb
+        if max_depth is None:
+            max_depth = DEFAULT_DEPTH if time_limit is None and node_limit is None else MAX_SEARCH_DEPTH
+        self.max_depth = max_depth
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.batch_leaves = batch_leaves
+        self.workers = workers
+        self.smp_helpers = smp_helpers
+        self.tablebase = tablebase
+        self.symmetric_table = symmetric_table
+        self.opening_book = opening_book
+        # the worker pools are started on the first search and kept until close()
+        self.__parallel = None
+        self.__smp = None
+        self.helper_nodes = 0
+        # set while running as a Lazy SMP helper, the search stops when it is set
+        self.__stop = None
+        # statistics of the last search
+        self.depth_reached = 0
+        self.nodes = 0
+        self.best_value = None
+        self.search_time = 0.0
+        # the (start, end, removed) move of the last decision
+        self.last_search_move = None
+        self.__deadline = None
+        self.__node_budget = node_limit
+        self.__can_abort = False
+        # allocated on the first search, an AI that never searches costs no memory
+        self.__table = None
+        self.__table_placing = None
+        self.__root_key = None
+        self.__iteration_depth = 0
+        # the piece the last search decided to take if its move closes a mill
+        self.__planned_removal = None
+        # (key, move, depth, nodes, seconds, value) of the last ponder search
+        self.__ponder_result = None
+        self.move_orderer = MoveOrderer()
+
+    @property
+    def transposition_table(self):
+        if self.__table is None:
+            if self.smp_helpers > 0:
+                # the table lives in shared memory so the helpers write into it too
+                self.__smp = LazySMP(self.smp_helpers, self.process_options())
+                self.__table = self.__smp.table
+            else:
+                self.__table = TranspositionTable(self.hash_size_mb)
+        return self.__table
+
+    def table_key(self, position):
+        # (key of the table entry, symmetry from the position to the frame the entry's move is stored in)
+        if self.symmetric_table:
+            return canonical_key(position)
+        return position.key, 0
+
+    def process_options(self):
+        """
+        The constructor options a worker or helper process builds its own AIPLayer with, so it searches alike.
+        They are pickled: the tablebase is given as its directory, which the process opens again.
+        """
+        return {"hash_size_mb": self.hash_size_mb, "batch_leaves": self.batch_leaves,
+                "symmetric_table": self.symmetric_table,
+                "tablebase": None if self.tablebase is None else self.tablebase.directory}
+
+    def attach_table(self, table):
+        """Makes the search use the given transposition table, e.g. one in shared memory."""
+        self.__table = table
 
     def place_on_board(self):
-        # Use minimax to decide placement during the placement phase
-        best_move = self.minimax_decision(placing = True)
+        # Decide a placement (book first, then minimax) and play it
+        return self.play_placement(self.choose_move(placing = True))
+
+    def play_placement(self, best_move):
+        # Play a placement decided elsewhere, e.g. by a background search (services.search_worker)
         # print("best move:", best_move)
         row = best_move[0]
         col = best_move[1]
         #self.__game.place_piece(row, col, 2)  # 2 is the AI player
         self.__game.place_piece(row, col, 2, self.__game_mode)  # 2 is the AI player
         # print(f"AI placed piece at {self.__game._inv_coord[col]}{row}")
-        self.__game.is_mill(row, col, 2, self.__game_mode)
-        # self.__game.is_mill(row, col, 2, self.__game_mode)
+        # place_piece already handles (and records) a mill formed by this piece
         return row, col
 
     def move_piece(self):
-        # Use minimax to decide a move during the moving phase
-        best_move = self.minimax_decision(placing = False)
+        # Use minimax to decide a move during the moving phase and play it
+        best_move = self.choose_move(placing = False)
         if best_move == None:
             # print("AI could not find a move")
             return
+        return self.play_move(best_move)
+
+    def play_move(self, best_move):
+        # Play a move decided elsewhere, e.g. by a background search (services.search_worker)
         start, end = best_move
         #self.__game.move_piece(start[0], start[1], end[0], end[1], 2)  # 2 is the AI player
         self.__game.move_piece(start[0], start[1], end[0], end[1], 2, self.__game_mode)  # 2 is the AI player
         # print(f"AI moved piece from {self.__game._inv_coord[start[1]]}{start[0]} to {self.__game._inv_coord[end[1]]}{end[0]}")
-        self.__game.is_mill(end[0], end[1], 2, self.__game_mode)
-        # self.__game.is_mill(end[0], end[1], 2, self.__game_mode)
+        # move_piece already handles (and records) a mill formed by this move
         return start, end
 
-    def minimax_decision(self, placing):
-        # Perform minimax decision-making to return the optimal move (row, col)
-        # board_state = self.__game._board._data
-        # board_state = self.__game._board._data
-        board_state = [row[:] for row in self.__game._board._data]
-        depth = 3  # Example depth for minimax
+    def choose_move(self, placing, stop=None):
+        """
+        Decides the move of the AI without playing it, e.g. on a background thread (services.search_worker).
+
+        :param stop: threading or multiprocessing Event, the search ends with the best move so far once it is set
+        :return: the move in the legacy format, see legacy_move
+        """
+        best_move = self.book_decision() if placing else None
+        if best_move is None:
+            best_move = self.ponder_decision()
+        if best_move is None:
+            best_move = self.minimax_decision(placing, stop)
+        return best_move
+
+    def minimax_decision(self, placing, stop=None):
+        # the only read of the live game: the search plays and takes back moves on this snapshot
+        root = self.__game.get_position(2)
+        if self.tablebase is not None and self.tablebase.covers(root, distances=True):
+            return self.tablebase_decision(root)
+        best_move = self.search(root, placing, stop, self.max_depth, self.time_limit, self.node_limit)
+        return self.decide(best_move)
+
+    def search(self, root, placing, stop=None, max_depth=DEFAULT_DEPTH, time_limit=None, node_limit=None, report=None):
+        # Iterative deepening: search depth 1, 2, ... until max_depth or the budget runs out,
+        # and return the best (start, end, removed) move of black in root from the last iteration that completed;
+        # report(depth, value, move) is called after each iteration
+        table = self.transposition_table
+        if placing != self.__table_placing:
+            # the evaluation depends on the placing flag, values from the other phase are not comparable
+            table.clear()
+            self.__table_placing = placing
+        self.__root_key = self.table_key(root)[0]
+        self.move_orderer.new_search()
+        self.helper_nodes = 0
+        if self.__smp is not None:
+            self.__smp.start(root, placing)
+        self.__stop = stop
+        self.__node_budget = node_limit
+
+        start_time = perf_counter()
+        self.__deadline = None if time_limit is None else start_time + time_limit
+        self.nodes = 0
+        self.depth_reached = 0
+        best_move = None
         maximizing_player = True
-        best_value, best_move = self.minimax(board_state, depth, maximizing_player, float(-inf), float(inf), placing)
+        for depth in range(1, max_depth + 1):
+            if depth > 1 and stop is not None and stop.is_set():
+                break
+            # the first iteration always completes so there is a move to play
+            self.__can_abort = depth > 1
+            self.__iteration_depth = depth
+            if self.workers > 1:
+                result = self.parallel_root(root, depth, placing, best_move)
+                if result is None:
+                    break
+                best_value, move = result
+            else:
+                try:
+                    best_value, move = self.minimax(root.copy(), depth, maximizing_player, float(-inf), float(inf), placing)
+                except SearchTimeout:
+                    break
+            best_move = move
+            self.best_value = best_value
+            self.depth_reached = depth
+            if report is not None:
+                report(depth, best_value, move)
+            if move is None:
+                break
+        self.__stop = None
+        if self.__smp is not None:
+            self.helper_nodes = self.__smp.stop()
+        self.search_time = perf_counter() - start_time
         return best_move
 
+    def decide(self, best_move):
+        # Remembers the chosen move and the piece it takes, and returns it in the legacy format
+        self.last_search_move = best_move
+        self.__planned_removal = None
+        if best_move is not None and best_move[2] is not None:
+            self.__planned_removal = POINTS[best_move[2]]
+        return self.legacy_move(best_move)
+
+    def book_decision(self):
+        # The opening book move of the live position, None if the book does not know it
+        if self.opening_book is None:
+            return None
+        root = self.__game.get_position(2)
+        best_move = self.opening_book.probe(root)
+        if best_move is None or best_move not in root.generate_moves(captures=True):
+            return None
+        self.nodes = 0
+        self.depth_reached = 0
+        self.search_time = 0.0
+        return self.decide(best_move)
+
+    def ponder_position(self):
+        """
+        Predicts the reply of the human to the move the AI just played: the move the last search expects
+        (the transposition table move of the live position, with white to move).
+
+        :return: the Position after that reply with the AI to move, None if there is no prediction
+        """
+        self.__ponder_result = None
+        if self.__table is None:
+            return None
+        root = self.__game.get_position(1)
+        if root.is_lost(1):
+            return None
+        line = self.principal_variation(root, 1)
+        if not line:
+            return None
+        root.make_move(line[0])
+        if root.is_lost(2):
+            return None
+        return root
+
+    def principal_variation(self, root, length=MAX_SEARCH_DEPTH):
+        """
+        The line the search expects from root: the transposition table moves, as long as they are legal
+        and no position repeats.
+
+        :return: list of (start, end, removed) moves
+        """
+        line = []
+        if self.__table is None:
+            return line
+        position = root.copy()
+        seen = set()
+        while len(line) < length and position.key not in seen:
+            seen.add(position.key)
+            key, symmetry = self.table_key(position)
+            entry = self.__table.probe(key)
+            if entry is None or entry[3] is None:
+                break
+            move = transform_move(entry[3], INVERSES[symmetry]) if symmetry else entry[3]
+            if move not in position.generate_moves(captures=True):
+                break
+            line.append(move)
+            position.make_move(move)
+        return line
+
+    def ponder(self, position, stop):
+        """
+        Searches the position after the predicted reply of the human until stop is set, on the human's time.
+        The search fills the transposition table, and its move is played at once if the human makes the
+        predicted reply (ponder_decision).
+
+        :param position: the Position returned by ponder_position
+        :param stop: threading Event set when the human has moved
+        :return: the (start, end, removed) move found, None if the position is left to the tablebase
+        """
+        if self.tablebase is not None and self.tablebase.covers(position, distances=True):
+            return None
+        move = self.search(position, position.in_hand[2] > 0, stop, MAX_SEARCH_DEPTH)
+        self.__ponder_result = (position.key, move, self.depth_reached, self.nodes, self.search_time,
+                                self.best_value)
+        return move
+
+    def ponder_decision(self):
+        # The move of the ponder search when the human played the predicted reply and it searched
+        # as far as a search of this move would, None otherwise
+        result, self.__ponder_result = self.__ponder_result, None
+        if result is None:
+            return None
+        key, best_move, depth, nodes, seconds, value = result
+        root = self.__game.get_position(2)
+        if key != root.key or best_move is None:
+            return None
+        enough = (depth >= self.max_depth
+                  or self.time_limit is not None and seconds >= self.time_limit
+                  or self.node_limit is not None and nodes >= self.node_limit)
+        if not enough or best_move not in root.generate_moves(captures=True):
+            return None
+        self.depth_reached = depth
+        self.nodes = nodes
+        self.best_value = value
+        self.search_time = 0.0
+        return self.decide(best_move)
+
+    def tablebase_decision(self, root):
+        # A solved endgame: play the table move without searching
+        start_time = perf_counter()
+        best_move = self.tablebase.best_move(root)
+        self.best_value = self.tablebase_value(root)
+        self.nodes = 0
+        self.depth_reached = 0
+        self.search_time = perf_counter() - start_time
+        return self.decide(best_move)
+
+    def tablebase_value(self, position):
+        # The tablebase result as a search value for black, None if no table covers the position
+        probe = self.tablebase.probe(position)
+        if probe is None:
+            return None
+        result, plies = probe
+        if plies is None:
+            # a WDL file only: every win counts as the slowest one
+            plies = MAX_PLIES
+        # faster wins and slower losses are worth more, like in the search
+        value = {WIN: WIN_SCORE - plies, LOSS: plies - WIN_SCORE}.get(result, 0)
+        return value if position.turn == 2 else -value
+
+    def parallel_root(self, root, depth, placing, previous_move):
+        # One iteration split over the worker processes, the budget is checked between iterations
+        if self.__can_abort and self.__node_budget is not None and self.nodes >= self.__node_budget:
+            return None
+        moves = root.generate_moves(captures=True)
+        if not moves or root.is_lost(2):
+            return self.evaluate_board(root, placing), None
+        if self.__parallel is None:
+            self.__parallel = ParallelSearch(self.workers, self.process_options())
+        moves = self.move_orderer.order(root, moves, 2, 0, previous_move)
+        time_left = None
+        if self.__can_abort and self.__deadline is not None:
+            time_left = self.__deadline - perf_counter()
+            if time_left <= 0:
+                return None
+        result = self.__parallel.search_root(root, moves, depth, placing, time_left,
+                                             self.__stop if self.__can_abort else None)
+        if result is None:
+            return None
+        value, move, nodes = result
+        self.nodes += nodes
+        return value, move
+
+    def search_subtree(self, position, depth, placing, alpha, beta, time_limit=None, stop=None):
+        """
+        Searches a position below the root, for a worker of the parallel search.
+
+        :param position: the Position after a root move
+        :param depth: remaining depth
+        :param time_limit: seconds for this search, None for no limit
+        :param stop: multiprocessing.Event, the search ends once it is set
+        :return: the value of the position, None if the time ran out or the search was stopped
+        """
+        table = self.transposition_table
+        if placing != self.__table_placing:
+            table.clear()
+            self.__table_placing = placing
+        self.__root_key = None
+        self.__iteration_depth = depth
+        self.__deadline = None if time_limit is None else perf_counter() + time_limit
+        self.__node_budget = self.node_limit
+        self.__can_abort = time_limit is not None or stop is not None
+        self.__stop = stop
+        self.nodes = 0
+        try:
+            return self.minimax(position, depth, position.turn == 2, alpha, beta, placing)[0]
+        except SearchTimeout:
+            return None
+        finally:
+            self.__stop = None
+
+    def helper_search(self, position, placing, depth_offset, stop):
+        """
+        Searches deeper and deeper from position until stop is set, as a Lazy SMP helper.
+
+        :param depth_offset: plies to skip at the start, so helpers run ahead of the main search
+        :param stop: multiprocessing.Event set by the main search when it is done
+        :return: the number of nodes searched
+        """
+        # the main search already cleared the shared table if the placing flag changed
+        self.__table_placing = placing
+        self.__root_key = self.table_key(position)[0]
+        self.__deadline = None
+        self.__node_budget = self.node_limit
+        self.__stop = stop
+        self.nodes = 0
+        self.move_orderer.new_search()
+        try:
+            for depth in range(1 + depth_offset, MAX_SEARCH_DEPTH + 1):
+                if stop.is_set():
+                    break
+                self.__can_abort = True
+                self.__iteration_depth = depth
+                self.minimax(position.copy(), depth, position.turn == 2, float(-inf), float(inf), placing)
+        except SearchTimeout:
+            pass
+        finally:
+            self.__stop = None
+        return self.nodes
+
+    def close(self):
+        """Stops the worker processes of the parallel search and the Lazy SMP helpers, if any."""
+        if self.__parallel is not None:
+            self.__parallel.close()
+            self.__parallel = None
+        if self.__smp is not None:
+            self.__smp.close()
+            self.__smp = None
+            self.__table = None
+
+    def check_budget(self):
+        # Called every CHECK_EVERY_NODES nodes, stops the current iteration when over budget
+        if not self.__can_abort:
+            return
+        if self.__stop is not None and self.__stop.is_set():
+            raise SearchTimeout("search stopped")
+        if self.__node_budget is not None and self.nodes >= self.__node_budget:
+            raise SearchTimeout("node budget used up")
+        if self.__deadline is not None and perf_counter() >= self.__deadline:
+            raise SearchTimeout("time budget used up")
+
     def minimax(self, board_state, depth, maximizing_player, alpha, beta, placing):
         # Implement the minimax algorithm with alpha-beta pruning
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY_NODES == 0:
+            self.check_budget()
+        table = self.__table
+        key, symmetry = self.table_key(board_state)
+        entry = table.probe(key)
+        tt_move = entry[3] if entry is not None else None
+        if symmetry and tt_move is not None:
+            tt_move = transform_move(tt_move, INVERSES[symmetry])
+        if entry is not None and entry[0] >= depth and key != self.__root_key:
+            # the root needs a move to play, so it is always searched
+            value, bound = entry[1], entry[2]
+            if bound == EXACT:
+                return value, None
+            if bound == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if beta <= alpha:
+                return value, None
+        original_alpha, original_beta = alpha, beta
+
+        if self.tablebase is not None and key != self.__root_key:
+            value = self.tablebase_value(board_state)
+            if value is not None:
+                # solved exactly, whatever depth is left
+                table.store(key, depth, value, EXACT)
+                return value, None
+
         # print("yes")
-        if depth == 0 or (self.is_terminal_state(board_state) and not placing):
+        if depth == 0 or self.is_terminal_state(board_state):
             # print("terminal state ", self.is_terminal_state(board_state))
             # print("depth", depth)
-            return self.evaluate_board(board_state, placing), None
+            value = self.evaluate_board(board_state, placing)
+            table.store(key, depth, value, EXACT)
+            return value, None
 
         # print("no")
+        player = 2 if maximizing_player else 1  # player 2 is the AI, player 1 is human
+        ply = self.__iteration_depth - depth
+        orderer = self.move_orderer
+        # every legal capture is a move of its own, so alpha-beta searches the removal too
+        search_moves = board_state.generate_moves(captures=True)
+        search_moves = orderer.order(board_state, search_moves, player, ply, tt_move)
+        if depth == 1 and self.batch_leaves:
+            value, best_search_move = self.evaluate_last_ply(board_state, search_moves, maximizing_player, placing)
+            self.store_result(key, depth, value, original_alpha, original_beta,
+                              transform_move(best_search_move, symmetry))
+            return value, best_search_move
+        best_search_move = None
         if maximizing_player:
             max_eval = float(-inf)
-            best_move = None
             # print("maxi")
-            generating_moves = self.generate_moves(board_state, player=2, placing=placing)
-            # print("generate moves - maximazing phase ", generating_moves)
-            for move in generating_moves:  # Assuming player 2 is the AI
-                # print("gets in")
-                new_state = [row[:] for row in board_state]
-                new_state = self.simulate_move(new_state, move, player=2, placing=placing)
-                eval = self.minimax(new_state, depth - 1, False, alpha, beta, placing)[0]
+            for index, search_move in enumerate(search_moves):
+                token = board_state.make_move(search_move)
+                eval = self.minimax(board_state, depth - 1, False, alpha, beta, placing)[0]
+                board_state.unmake_move(token)
                 # print(eval)
                 if eval > max_eval:
                     max_eval = eval
-                    best_move = move
-                    # print(type(move))
-                    # print(move)
-                    # print(best_move)
+                    best_search_move = search_move
                 alpha = max(alpha, eval)
                 if beta <= alpha:
+                    orderer.cutoff(search_move, player, ply, depth, index)
                     break
-            return max_eval, best_move
+            self.store_result(key, depth, max_eval, original_alpha, original_beta,
+                              transform_move(best_search_move, symmetry))
+            return max_eval, best_search_move
         else:
             min_eval = float(inf)
-            best_move = None
             # print("mini")
-            generating_moves = self.generate_moves(board_state, player=1, placing=placing)
-            # print("generate moves - minimazing phase ", generating_moves)
-            for move in generating_moves:  # Assuming player 1 is human
-                # print("gets in")
-                new_state = [row[:] for row in board_state]
-                new_state = self.simulate_move(new_state, move, player=1, placing=placing)
-                eval = self.minimax(new_state, depth - 1, True, alpha, beta, placing)[0]
+            for index, search_move in enumerate(search_moves):
+                token = board_state.make_move(search_move)
+                eval = self.minimax(board_state, depth - 1, True, alpha, beta, placing)[0]
+                board_state.unmake_move(token)
                 # print(eval)
                 if eval < min_eval:
                     min_eval = eval
-                    best_move = move
+                    best_search_move = search_move
                 beta = min(beta, eval)
                 if beta <= alpha:
+                    orderer.cutoff(search_move, player, ply, depth, index)
                     break
-            return min_eval, best_move
+            self.store_result(key, depth, min_eval, original_alpha, original_beta,
+                              transform_move(best_search_move, symmetry))
+            return min_eval, best_search_move
+
+    def evaluate_last_ply(self, board_state, search_moves, maximizing_player, placing):
+        # Evaluates every child in one batch instead of searching them one by one
+        white, black, in_hand = [], [], []
+        for search_move in search_moves:
+            token = board_state.make_move(search_move)
+            white.append(board_state.masks[1])
+            black.append(board_state.masks[2])
+            in_hand.append(board_state.in_hand[1:])
+            board_state.unmake_move(token)
+        self.nodes += len(search_moves)
+        values = batch_evaluate(encode_masks(white, black), in_hand, placing, EVALUATION_WEIGHTS, WIN_SCORE)
+        best = values.argmax() if maximizing_player else values.argmin()
+        return int(values[best]), search_moves[best]
+
+    def evaluate_batch(self, positions, placing):
+        """
+        Evaluates many positions at once, for analysis jobs.
+
+        :param positions: list of Position
+        :param placing: the placing flag the positions are evaluated with
+        :return: NumPy array with the value of each position, the same as evaluate_board
+        """
+        boards, in_hand = encode(positions)
+        return batch_evaluate(boards, in_hand, placing, EVALUATION_WEIGHTS, WIN_SCORE)
+
+    @staticmethod
+    def legacy_move(search_move):
+        # (start, end, removed) -> (row, col) for a placement, ((row, col), (row, col)) for a move
+        if search_move is None:
+            return None
+        start, end, removed = search_move
+        if start is None:
+            return POINTS[end]
+        return POINTS[start], POINTS[end]
+
+    def store_result(self, key, depth, value, alpha, beta, move):
+        # The bound type depends on where the value fell relative to the window the node was searched with
+        if value <= alpha:
+            bound = UPPER
+        elif value >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.__table.store(key, depth, value, bound, move)
 
     def is_fly_phase(self, board_state):
-        return self.__game._black_pieces == 3
+        return board_state.phase(2) == FLYING
 
     def is_terminal_state(self, board_state):
         # Determine if the game is in a terminal state
-        return not self.__game.check_moves_left(player=1) or not self.__game.check_moves_left(player=2)
+        return board_state.is_lost(1) or board_state.is_lost(2)
 
-    def evaluate_board(self, board_state, placing):
-        # Initialize score
-        score = 0
+    def evaluate_board(self, position, placing):
+        # Every term is black (the AI) minus white, read from the counts the position keeps up to date
+        if position.is_lost(1):
+            return WIN_SCORE
+        if position.is_lost(2):
+            return -WIN_SCORE
+        counts = position.features
 
-        # Evaluate mills (existing logic)
-        score += 200 * self.evaluate_mills(board_state)
+        # Pieces on the board and still in hand
+        score = PIECE_WEIGHT * (position.count(2) + position.in_hand[2] - position.count(1) - position.in_hand[1])
 
-        # Evaluate piece positions (center control, safe pieces, etc.)
-        score += 150 * self.evaluate_piece_positions(board_state, placing)
+        # Closed mills and two in a row with the third point free
+        score += MILL_WEIGHT * (counts[MILLS + 1] - counts[MILLS])
+        score += TWO_WEIGHT * (counts[TWOS + 1] - counts[TWOS])
 
-        # Evaluate piece mobility (number of available moves)
-        score += 100 * self.evaluate_mobility(board_state)
-
-        # Optional: Consider piece counts
-        score += 50 * self.evaluate_piece_count(board_state)
-
-        # Evaluate blocking opponent mills
-        score +=  300 * self.evaluate_block_opponent_mill(board_state, placing)
-
-        return score
+        if not placing:
+            # Evaluate piece mobility (number of available moves) and pieces that cannot move
+            score += MOBILITY_WEIGHT * self.evaluate_mobility(position)
+            score -= BLOCKED_WEIGHT * (counts[BLOCKED + 1] - counts[BLOCKED])
 
-    def evaluate_piece_positions(self, board_state, placing):
-        score = 0
-        if placing:
-            # Prioritize forming mills or blocking opponent’s mill during placement phase
-            for row in range(len(board_state)):
-                for col in range(len(board_state[row])):
-                    if board_state[row][col] == 2:  # AI's pieces (player 2)
-                        # Check if the AI can complete a mill
-                        if self.__game.check_mill(board_state, row, col, 2):
-                            score += 150  # Forming a mill should be highly rewarded
-                    elif board_state[row][col] == 1:  # Opponent's pieces (player 1)
-                        # Check if the opponent is one move away from completing a mill
-                        if self.__game.check_mill(board_state, row, col, 1):
-                            score -= 200  # Penalize AI for letting opponent form a mill
-        else:
-            # In the movement phase, prioritize making a mill or blocking the opponent
-            for row in range(len(board_state)):
-                for col in range(len(board_state[row])):
-                    if board_state[row][col] == 2:  # AI's pieces (player 2)
-                        # 1. Check if moving the AI piece can form a mill
-                        if self.__game.check_mill(board_state, row, col, 2):
-                            score += 100  # Reward for forming a mill during movement phase
-                            # 2. Look for opponent pieces forming a potential mill
-                            for adj in self.__game._ADJ[(row, col)]:
-                                if board_state[adj[0]][adj[1]] == 1:  # Opponent’s piece adjacent
-                                    # Check for a potential third piece to form a mill
-                                    for neighbor in self.__game._ADJ[(adj[0], adj[1])]:
-                                        if board_state[neighbor[0]][neighbor[1]] == 0:  # Empty spot
-                                            # Check if this empty spot completes a mill for the opponent
-                                            temp_board = [row[:] for row in board_state]
-                                            temp_board[neighbor[0]][neighbor[1]] = 1  # Simulate opponent's move
-                                            if self.__game.check_mill(temp_board, neighbor[0], neighbor[1], 1):
-                                                # Block this mill by moving AI’s piece to the empty spot
-                                                temp_board[neighbor[0]][neighbor[1]] = 2  # Simulate AI's move
-
-                                                # 3. Reward the AI for blocking the mill
-                                                score += 120  # Arbitrary reward for blocking
-
-                                                # 4. Check if this blocking move also forms a mill for the AI
-                                                if self.__game.check_mill(temp_board, neighbor[0], neighbor[1], 2):
-                                                    score += 50  # Additional reward for forming a mill
-                                                break  # No need to check further for this position
         return score
 
     def evaluate_mobility(self, board_state):
-        # Calculate mobility for both players
-        ai_mobility = self.calculate_mobility(board_state, 2)
-        human_mobility = self.calculate_mobility(board_state, 1)
-        return ai_mobility - human_mobility  # More mobility is better for the AI
-
-    def evaluate_block_opponent_mill(self, board_state, placing):
-        score = 0
-        for row in range(len(board_state)):
-            for col in range(len(board_state[row])):
-                if board_state[row][col] == 1:  # Opponent's pieces (player 1)
-                    # Check if the opponent is one move away from forming a mill
-                    for adj in self.__game._ADJ[(row, col)]:
-                        if board_state[adj[0]][adj[1]] == 0:  # Empty spot adjacent to the piece
-                            new_board_state = [row[:] for row in board_state]
-                            new_board_state[adj[0]][adj[1]] = 1  # Place the opponent's piece
-                            if self.__game.check_mill(new_board_state, adj[0], adj[1], 1):
-                                if placing:
-                                    # During placing, prioritize preventing the opponent's mill
-                                    score -= 200  # Deduct points if we let the opponent form a mill
-                                else:
-                                    # During moving, only block if there's an actual threat
-                                    score += 300  # Reward the AI for blocking the opponent’s mill
-                elif board_state[row][col] == 2:  # AI's pieces (player 2)
-                    if not placing:  # In movement phase
-                        # Check if moving AI piece can block the opponent’s mill
-                        for adj in self.__game._ADJ[(row, col)]:
-                            if board_state[adj[0]][adj[1]] == 1:  # If the opponent’s piece is adjacent
-                                for neighbor in self.__game._ADJ[(adj[0], adj[1])]:
-                                    if board_state[neighbor[0]][neighbor[1]] == 0:  # Empty spot
-                                        # Check if this empty spot completes a mill for the opponent
-                                        temp_board = [row[:] for row in board_state]
-                                        temp_board[neighbor[0]][neighbor[1]] = 1  # Simulate opponent's move
-                                        if self.__game.check_mill(temp_board, neighbor[0], neighbor[1], 1):
-                                            # Block this mill by moving AI’s piece to the empty spot
-                                            temp_board[neighbor[0]][neighbor[1]] = 2  # Simulate AI's move
-
-                                            # 3. Reward the AI for blocking the mill
-                                            score += 100  # Arbitrary reward for blocking
-
-                                            # 4. Check if this blocking move also forms a mill for the AI
-                                            if self.__game.check_mill(temp_board, neighbor[0], neighbor[1], 2):
-                                                score += 50  # Additional reward for forming a mill
-                                            break  # No need to check further for this position
-        return score
-
-    def evaluate_piece_count(self, board_state):
-        # Count the number of pieces for both players
-        ai_pieces = sum(row.count(2) for row in board_state)
-        human_pieces = sum(row.count(1) for row in board_state)
-        return ai_pieces - human_pieces  # More pieces is better for the AI
+        # Mobility for both players, kept up to date by the position
+        counts = board_state.features
+        return counts[MOBILITY + 1] - counts[MOBILITY]  # More mobility is better for the AI
 
     def position_value(self, row, col):
         # Center positions are more valuable (value them higher)
@@ -232,32 +638,23 @@ class AIPLayer:
     def calculate_mobility(self, board_state, player):
         # Calculate the number of valid moves for a player
         mobility = 0
-        pieces = self.__game.black_pieces if player == 2 else self.__game.white_pieces
-        for piece in pieces:
-            for adj in self.__game._ADJ[piece]:  # Assuming ADJ is the list of adjacent positions
-                if board_state[adj[0]][adj[1]] == 0:  # If position is empty
-                    mobility += 10
+        empty = board_state.empty
+        pieces = board_state.masks[player]
+        while pieces:
+            bit = pieces & -pieces
+            mobility += 10 * (ADJACENT_MASKS[bit.bit_length() - 1] & empty).bit_count()
+            pieces ^= bit
         return mobility
 
-    def evaluate_mills(self, board_state):
-        # Check for mills and assign score
-        score = 0
-        # Loop through the pieces (either AI's or the opponent's)
-        for row in range(len(board_state)):
-            for col in range(len(board_state[row])):
-                if board_state[row][col] == 2:  # AI's pieces (player 2)
-                    if self.__game.check_mill(board_state, row, col, 2):  # Check if it's part of a mill
-                        score += 100  # +10 for each mill the AI has
-                        score += self.evaluate_mill_removal(board_state, row, col, 2)  # Update for piece removal strategy
-                elif board_state[row][col] == 1:  # Human's pieces (player 1)
-                    if self.__game.check_mill(board_state, row, col, 1):  # Check if it's part of a mill
-                        score -= 200  # -10 for each mill the human has
-        return score
-
-    def best_piece_to_remove(self, player):
-        # Get the board state
-        board_state = self.__game._board._data
-        possible_moves = self.__game.valid_remove_piece(player)
+    def best_piece_to_remove(self, player, board_state=None):
+        # Get the board state, the live game unless the search passes its own grid
+        if board_state is None:
+            # the search already chose the piece to take along with the move that closed the mill
+            planned, self.__planned_removal = self.__planned_removal, None
+            if planned is not None and planned in self.__game.valid_remove_piece(player):
+                return planned
+            board_state = self.__game._board._data
+        possible_moves = self.removable_pieces(board_state, player)
 
         # Evaluate the best piece for removal using the evaluate_mill_removal function
         best_value = float(-inf)
@@ -304,7 +701,7 @@ class AIPLayer:
 
     def evaluate_mill_removal(self, board_state, row, col, player):
         opponent = 1 if player == 2 else 2
-        removable_pieces = self.__game.valid_remove_piece(player)
+        removable_pieces = self.removable_pieces(board_state, player)
         # print(removable_pieces)
 
         if len(removable_pieces) == 0:
@@ -362,9 +759,16 @@ class AIPLayer:
                     return True  # Placing this piece would block an AI mill
         return False
 
+    def removable_pieces(self, board_state, player):
+        # Same rule as Game.valid_remove_piece, applied to the given grid
+        opponent = 1 if player == 2 else 2
+        pieces = [point for point in POINTS if board_state[point[0]][point[1]] == opponent]
+        outside_mills = [point for point in pieces if not self.__game.check_mill(board_state, point[0], point[1], opponent)]
+        return outside_mills if outside_mills else pieces
+
     def calculate_distance_to_ai(self, board_state, row, col):
         # Calculate the Manhattan distance between the opponent's piece and the AI’s pieces
-        ai_pieces = self.__game.black_pieces  # Assuming player 2 is AI
+        ai_pieces = [point for point in POINTS if board_state[point[0]][point[1]] == 2]  # Assuming player 2 is AI
         min_distance = float(inf)
 
         for ai_piece in ai_pieces:
@@ -375,32 +779,27 @@ class AIPLayer:
         return -min_distance  # A shorter distance means higher priority for removal
 
     def generate_moves(self, board_state, player, placing):
+        # The phase and the pieces come from the searched position, not from the live game
         valid_moves = []
-        pieces = self.__game.black_pieces if player == 2 else self.__game.white_pieces
-        # print(pieces)
-        if placing:  # During the placement phase
-            for row in range(len(board_state)):
-                for col in range(len(board_state[row])):
-                    if board_state[row][col] == 0 and (row, col) in self.__game._VALID_POSITIONS:  # If the position is empty
-                        valid_moves.append((row, col))
+        empty = board_state.empty
+        if board_state.phase(player) == PLACING:  # During the placement phase
+            while empty:
+                bit = empty & -empty
+                valid_moves.append(POINTS[bit.bit_length() - 1])
+                empty ^= bit
         else:  # During the movement phase
-            if len(pieces) != 3:
-                for piece in pieces:
-                    for adj in self.__game._ADJ[piece]:
-                        # print(adj)
-                        # print(board_state[adj[0]][adj[1]])
-                        # print(board_state)
-                        if board_state[adj[0]][adj[1]] == 0 and adj in self.__game._VALID_POSITIONS:  # If position is empty
-                            # print("we put the piece in the valid moves", adj)
-                            valid_moves.append((piece, adj))
-            else:
-                for piece in pieces:
-                    for row in range(len(board_state)):
-                        for col in range(len(board_state[row])):
-                            if board_state[row][col] == 0 and (row, col) in self.__game._VALID_POSITIONS:
-                                valid_moves.append((piece, (row, col)))
-
-                # print("flying_phase:", valid_moves)
+            flying = board_state.phase(player) == FLYING
+            pieces = board_state.masks[player]
+            while pieces:
+                piece_bit = pieces & -pieces
+                start = piece_bit.bit_length() - 1
+                # adjacent empty points, or every empty point when flying
+                targets = empty if flying else ADJACENT_MASKS[start] & empty
+                while targets:
+                    bit = targets & -targets
+                    valid_moves.append((POINTS[start], POINTS[bit.bit_length() - 1]))
+                    targets ^= bit
+                pieces ^= piece_bit
         return valid_moves
 
     # def simulate_move(self, board_state, move, player, placing):
@@ -458,35 +857,6 @@ class AIPLayer:
     #
     #     return new_state
 
-    def simulate_move(self, board_state, move, player, placing):
-        new_state = [row[:] for row in board_state]
-        # Directly modify the board for simulation
-        from copy import deepcopy
-        new_state = deepcopy(board_state)
-        # new_state = [row[:] for row in board_state]
-        if placing:
-            (row, col) = move
-            new_state[row][col] = player
-        else:
-            (start, end) = move
-            new_state[start[0]][start[1]] = 0  # Remove from start
-            new_state[end[0]][end[1]] = player  # Place at end
-
-            # Remove an opponent's piece if a mill is formed
-            # Simulate removal if a mill is formed
-            if self.__game.check_mill(new_state, end[0], end[1], player):
-                # opponent = 1 if player == 2 else 2
-                # Remove an opponent's piece (find one to remove)
-                # pieces = self.__game.valid_remove_piece(player)
-                # for piece in pieces:
-                #     new_state[piece[0]][piece[1]] = 0
-                #     break
-                best_piece = self.best_piece_to_remove(player)
-                new_state[best_piece[0]][best_piece[1]] = 0
-
-
-        return new_state
-
 #TODO: fix the removing piece logic, it is not working properly -> gets stuck in a loop of invalid moves
 #TODO: implement the fly phase
 #TODO: Ai still moves a piece after it remains with 2 pieces
@@ -0,0 +1,330 @@
+"""
+Self-play arena
+
+Plays games between engines without a user interface and reports how they
+did against each other. An engine is one of the players of the game:
+
+- random:  ComputerPlayer, random placements and moves
+- smart:   SmartComputer, the point based rules
+- minimax: AIPLayer, with any of its constructor options
+
+and is written as kind:option=value,... on the command line, for example
+minimax:max_depth=4 or minimax:time_limit=0.05,symmetric_table=True.
+
+Every player plays black (player 2) through its usual API, the way the GUI
+drives it, on a Game of its own. Before each of its turns the arena loads
+the current position into that Game, with the colors swapped when the player
+plays white, and after the turn reads the move back from the board. The move
+is checked against the rules of domain.position; a player that makes an
+illegal move or breaks a rule (ValueError, AdjError, PlayerError) plays a
+random legal move instead, which is counted; any other error is a bug and
+ends the match with its traceback.
+
+The first plies of each game can be random (opening randomization), and a
+pair of games with the same opening is played with the colors swapped.
+Games are spread over a process pool. A game is drawn after max_plies plies
+or when a position comes back for the third time.
+
+Run from the repository root:
+
+    python -m services.arena minimax:max_depth=3 smart random --games 200 --workers 4
+"""
+import abc
+import argparse
+import ast
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from random import Random
+from time import perf_counter
+
+from domain.board import Board
+from domain.position import Position
+from domain.tables import POINTS, PIECES_PER_PLAYER
+from services.ai import AIPLayer
+from services.computer_player import SmartComputer
+from services.game import Game, ComputerPlayer
+from services.game_exceptions import AdjError, PlayerError
+
+START_POSITION = "........................ 1 9 9"
+DEFAULT_MAX_PLIES = 200
+OPENING_PLIES = 4
+REPETITIONS = 3
+
+
+def parse_engine(text):
+    """
+    Reads an engine written as kind:option=value,...
+
+    :return: (kind, dict of options)
+    """
+    kind, _, rest = text.partition(":")
+    if kind not in ENGINES:
+        raise ValueError(f"unknown engine {kind!r}, expected one of {', '.join(ENGINES)}")
+    options = {}
+    for item in filter(None, rest.split(",")):
+        name, _, value = item.partition("=")
+        try:
+            options[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            options[name] = value
+    return kind, options
+
+
+class _Seat(abc.ABC):
+    """One player of an arena game: the engine and the Game it plays on, always as black."""
+
+    def __init__(self, random):
+        self.board = Board()
+        self.game = Game(self.board, self, "arena")
+        self.random = random
+        self.fallbacks = 0
+
+    def load(self, position, player):
+        # the position as the engine sees it: its own pieces black
+        game = self.game
+        for point in POINTS:
+            self.board.update(point[0], point[1], 0)
+        game._white_pieces, game._black_pieces = [], []
+        game.mill_history.clear()
+        for color, owner in ((1, 3 - player), (2, player)):
+            mask = position.masks[owner]
+            for index, point in enumerate(POINTS):
+                if mask >> index & 1:
+                    self.board.update(point[0], point[1], color)
+                    (game._white_pieces if color == 1 else game._black_pieces).append(point)
+        game._placed = [0, PIECES_PER_PLAYER - position.in_hand[3 - player],
+                        PIECES_PER_PLAYER - position.in_hand[player]]
+
+    def remove_piece(self, player, game_mode):
+        # Game asks here for the piece to take once the engine closed a mill
+        valid = self.game.valid_remove_piece(player)
+        try:
+            piece = self.choose_removal()
+        except (ValueError, AdjError, PlayerError):
+            piece = None
+        if piece not in valid:
+            self.fallbacks += 1
+            piece = self.random.choice(valid)
+        return piece
+
+    def choose_removal(self):
+        return self.random.choice(self.game.valid_remove_piece(2))
+
+    @abc.abstractmethod
+    def play(self, placing):
+        """Plays the turn of black on the Game, placing or moving."""
+
+
+class _RandomSeat(_Seat):
+    def __init__(self, random, options):
+        super().__init__(random)
+        self.player = ComputerPlayer(self.game, "arena")
+
+    def play(self, placing):
+        if placing:
+            self.player.place_on_board()
+        else:
+            self.player.move_computer()
+
+
+class _SmartSeat(_Seat):
+    def __init__(self, random, options):
+        super().__init__(random)
+        self.player = SmartComputer(self.game, "arena")
+
+    def choose_removal(self):
+        return self.player.remove_piece(2)
+
+    def play(self, placing):
+        if placing:
+            row, col = self.player.place_piece(2)
+            self.game.place_piece(row, col, 2, "human_vs_computer")
+        else:
+            fly = len(self.game.black_pieces) == 3
+            start, end = self.player.fly_piece(2) if fly else self.player.move_piece(2)
+            self.game.move_piece(start[0], start[1], end[0], end[1], 2, "human_vs_computer")
+
+
+class _MinimaxSeat(_Seat):
+    def __init__(self, random, options):
+        super().__init__(random)
+        self.player = AIPLayer(self.game, "arena", **options)
+
+    def choose_removal(self):
+        return self.player.best_piece_to_remove(2)
+
+    def play(self, placing):
+        if placing:
+            self.player.place_on_board()
+        else:
+            self.player.move_piece()
+
+
+ENGINES = {"random": _RandomSeat, "smart": _SmartSeat, "minimax": _MinimaxSeat}
+
+
+def _read_move(before, after, player):
+    # the (start, end, removed) move that turned before into the board of after (a view with player as black)
+    own, other = before.masks[player], before.masks[3 - player]
+    now_own, now_other = after.masks[2], after.masks[1]
+    started, ended, removed = own & ~now_own, now_own & ~own, other & ~now_other
+    if ended.bit_count() != 1 or started.bit_count() > 1 or removed.bit_count() > 1:
+        return None
+    return ((started.bit_length() - 1) if started else None, ended.bit_length() - 1,
+            (removed.bit_length() - 1) if removed else None)
+
+
+def play_game(white, black, seed=0, opening_plies=OPENING_PLIES, max_plies=DEFAULT_MAX_PLIES):
+    """
+    Plays one game.
+
+    :param white: engine of white, (kind, options) as returned by parse_engine
+    :param black: engine of black
+    :param seed: seeds the opening and the random choices of the players
+    :return: dict with the winner (1, 2, or 0 for a draw), the plies, and per player (index 1 and 2)
+             the thinking time, the moves and the fallback moves
+    """
+    random = Random(seed)
+    opening = Random(seed)
+    seats = [None, ENGINES[white[0]](random, white[1]), ENGINES[black[0]](random, black[1])]
+    position = Position.from_string(START_POSITION)
+    seen = {}
+    times, moves = [0, 0.0, 0.0], [0, 0, 0]
+    winner, ply = 0, 0
+    # Game and the players print as they go
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        while ply < max_plies:
+            player = position.turn
+            if position.is_lost(player):
+                winner = 3 - player
+                break
+            seen[position.key] = seen.get(position.key, 0) + 1
+            if seen[position.key] >= REPETITIONS:
+                break
+            legal = position.generate_moves(captures=True)
+            if ply < opening_plies:
+                move = opening.choice(legal)
+            else:
+                seat = seats[player]
+                seat.load(position, player)
+                start = perf_counter()
+                try:
+                    seat.play(position.in_hand[player] > 0)
+                    move = _read_move(position, seat.game.get_position(2), player)
+                except (ValueError, AdjError, PlayerError):
+                    move = None
+                times[player] += perf_counter() - start
+                moves[player] += 1
+                if move not in legal:
+                    seat.fallbacks += 1
+                    move = random.choice(legal)
+            position.make_move(move)
+            ply += 1
+    for seat in seats[1:]:
+        if isinstance(seat, _MinimaxSeat):
+            seat.player.close()
+    return {"winner": winner, "plies": ply, "time": times[1:], "moves": moves[1:],
+            "fallbacks": [seats[1].fallbacks, seats[2].fallbacks]}
+
+
+def _play_pair_game(args):
+    first, second, index, seed, opening_plies, max_plies = args
+    # games come in pairs with the same opening, first plays white in the even one
+    swap = index % 2 == 1
+    white, black = (second, first) if swap else (first, second)
+    result = play_game(white, black, seed + index // 2, opening_plies, max_plies)
+    if swap:
+        for field in ("time", "moves", "fallbacks"):
+            result[field].reverse()
+        result["winner"] = {0: 0, 1: 2, 2: 1}[result["winner"]]
+    return result
+
+
+def elo_difference(wins, draws, losses, z=1.96):
+    """
+    The Elo difference that matches a score, with a confidence interval.
+
+    :param z: width of the interval in standard deviations, 1.96 for 95%
+    :return: (difference, lower bound, upper bound); infinite when every game went one way
+    """
+    games = wins + draws + losses
+    if not games:
+        return 0.0, -math.inf, math.inf
+    score = (wins + draws / 2) / games
+    # standard error of the mean score per game
+    variance = (wins + draws / 4) / games - score * score
+    margin = z * math.sqrt(max(variance, 0.0) / games)
+
+    def elo(p):
+        if p <= 0:
+            return -math.inf
+        if p >= 1:
+            return math.inf
+        return -400 * math.log10(1 / p - 1)
+
+    return elo(score), elo(score - margin), elo(score + margin)
+
+
+def run_match(first, second, games, workers=1, seed=0, opening_plies=OPENING_PLIES, max_plies=DEFAULT_MAX_PLIES):
+    """
+    Plays games between two engines, each playing white in half of them.
+
+    :param first: (kind, options) as returned by parse_engine
+    :param second: the opponent
+    :param workers: processes to spread the games over; 1 plays them in this process
+    :return: dict with wins, draws and losses of first, elo (difference, low, high) of first over second,
+             average seconds per move and fallback moves of each engine
+    """
+    tasks = [(first, second, index, seed, opening_plies, max_plies) for index in range(games)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_play_pair_game, tasks, chunksize=max(1, games // (4 * workers))))
+    else:
+        results = [_play_pair_game(task) for task in tasks]
+
+    wins = sum(result["winner"] == 1 for result in results)
+    draws = sum(result["winner"] == 0 for result in results)
+    losses = games - wins - draws
+    time = [sum(result["time"][side] for result in results) for side in (0, 1)]
+    moves = [sum(result["moves"][side] for result in results) for side in (0, 1)]
+    return {
+        "wins": wins, "draws": draws, "losses": losses,
+        "elo": elo_difference(wins, draws, losses),
+        "time_per_move": [time[side] / moves[side] if moves[side] else 0.0 for side in (0, 1)],
+        "fallbacks": [sum(result["fallbacks"][side] for result in results) for side in (0, 1)],
+        "plies": sum(result["plies"] for result in results) / games if games else 0.0,
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Play engines against each other and compare them.")
+    parser.add_argument("engines", nargs="+", help="engines as kind:option=value,... (kinds: "
+                                                   + ", ".join(ENGINES) + "); every pair plays a match")
+    parser.add_argument("--games", type=int, default=100, help="games per pair")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--opening-plies", type=int, default=OPENING_PLIES, help="random plies at the start")
+    parser.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES, help="plies before a game is drawn")
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args(args)
+
+    engines = [parse_engine(text) for text in options.engines]
+    if len(engines) < 2:
+        parser.error("give at least two engines")
+    for first in range(len(engines)):
+        for second in range(first + 1, len(engines)):
+            start = perf_counter()
+            result = run_match(engines[first], engines[second], options.games, options.workers,
+                               options.seed, options.opening_plies, options.max_plies)
+            elo, low, high = result["elo"]
+            print(f"{options.engines[first]} vs {options.engines[second]}: "
+                  f"+{result['wins']} ={result['draws']} -{result['losses']}, "
+                  f"Elo {elo:+.0f} [{low:+.0f}, {high:+.0f}], "
+                  f"{result['time_per_move'][0] * 1000:.1f} / {result['time_per_move'][1] * 1000:.1f} ms per move, "
+                  f"fallbacks {result['fallbacks'][0]} / {result['fallbacks'][1]}, "
+                  f"{result['plies']:.0f} plies per game, {perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
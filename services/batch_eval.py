@@ -0,0 +1,116 @@
+"""
+Batched evaluation with NumPy
+
+Evaluates many positions at once. A batch is a uint8 array of shape (N, 24),
+one row per position, with 0 for an empty point, 1 for white and 2 for black
+(the point numbering of domain.tables). The features of domain.features are
+computed for all rows together with a few matrix products:
+
+- pieces per mill line: pieces (N, 24) @ MILL_INCIDENCE (24, 16)
+- empty neighbours per point: empty (N, 24) @ ADJACENCY (24, 24)
+
+batch_features returns the same counts as domain.features.features, in the
+same layout, and batch_evaluate the same values as AIPLayer.evaluate_board
+when given the weights the AI uses.
+"""
+import numpy as np
+
+from domain.tables import POINT_COUNT, MILL_MASKS, ADJACENT
+from domain.features import MILLS, TWOS, BLOCKED, MOBILITY, FEATURE_COUNT
+
+# MILL_INCIDENCE[point, line] is 1 if the point is on the line
+MILL_INCIDENCE = np.array([[mill >> index & 1 for mill in MILL_MASKS] for index in range(POINT_COUNT)],
+                          dtype=np.float32)
+
+# ADJACENCY[point, neighbour] is 1 if the points are adjacent
+ADJACENCY = np.array([[int(other in ADJACENT[index]) for other in range(POINT_COUNT)]
+                      for index in range(POINT_COUNT)], dtype=np.float32)
+
+_BITS = np.arange(POINT_COUNT, dtype=np.int64)
+
+
+def encode(positions):
+    """
+    Encodes positions as a batch.
+
+    :param positions: iterable of Position
+    :return: (boards, in_hand): uint8 array of shape (N, 24) and int32 array of shape (N, 2)
+             with the pieces white and black have in hand
+    """
+    rows = np.array([(position.masks[1], position.masks[2], position.in_hand[1], position.in_hand[2])
+                     for position in positions], dtype=np.int64).reshape(-1, 4)
+    return encode_masks(rows[:, 0], rows[:, 1]), rows[:, 2:].astype(np.int32)
+
+
+def encode_masks(white, black):
+    """
+    Encodes arrays of white and black masks as a batch.
+
+    :return: uint8 array of shape (N, 24)
+    """
+    white = np.asarray(white, dtype=np.int64)[:, None] >> _BITS & 1
+    black = np.asarray(black, dtype=np.int64)[:, None] >> _BITS & 1
+    return (white + 2 * black).astype(np.uint8)
+
+
+def batch_features(boards):
+    """
+    Counts the features of every row.
+
+    :param boards: uint8 array of shape (N, 24)
+    :return: int32 array of shape (N, FEATURE_COUNT), laid out like domain.features
+    """
+    # float32 so the products run through BLAS; the results are small integers and exact
+    white = (boards == 1).astype(np.float32)
+    black = (boards == 2).astype(np.float32)
+    empty = (boards == 0).astype(np.float32)
+
+    white_lines = white @ MILL_INCIDENCE
+    black_lines = black @ MILL_INCIDENCE
+    free = empty @ ADJACENCY
+
+    counts = np.empty((len(boards), FEATURE_COUNT), dtype=np.int32)
+    counts[:, MILLS] = (white_lines == 3).sum(axis=1)
+    counts[:, MILLS + 1] = (black_lines == 3).sum(axis=1)
+    counts[:, TWOS] = ((white_lines == 2) & (black_lines == 0)).sum(axis=1)
+    counts[:, TWOS + 1] = ((black_lines == 2) & (white_lines == 0)).sum(axis=1)
+    blocked = free == 0
+    counts[:, BLOCKED] = ((boards == 1) & blocked).sum(axis=1)
+    counts[:, BLOCKED + 1] = ((boards == 2) & blocked).sum(axis=1)
+    counts[:, MOBILITY] = (white * free).sum(axis=1)
+    counts[:, MOBILITY + 1] = (black * free).sum(axis=1)
+    return counts
+
+
+def batch_evaluate(boards, in_hand, placing, weights, win_score):
+    """
+    Evaluates every row from the point of view of black, like AIPLayer.evaluate_board.
+
+    :param boards: uint8 array of shape (N, 24)
+    :param in_hand: int array of shape (N, 2), pieces in hand of white and black
+    :param placing: the placing flag of the search
+    :param weights: (piece, mill, two, mobility, blocked) weights
+    :param win_score: value of a position where white has lost
+    :return: int64 array of N values
+    """
+    piece_weight, mill_weight, two_weight, mobility_weight, blocked_weight = weights
+    counts = batch_features(boards).astype(np.int64)
+    pieces = np.stack(((boards == 1).sum(axis=1), (boards == 2).sum(axis=1)), axis=1)
+    in_hand = np.asarray(in_hand, dtype=np.int64)
+    material = pieces + in_hand
+
+    values = piece_weight * (material[:, 1] - material[:, 0])
+    values += mill_weight * (counts[:, MILLS + 1] - counts[:, MILLS])
+    values += two_weight * (counts[:, TWOS + 1] - counts[:, TWOS])
+    if not placing:
+        values += mobility_weight * (counts[:, MOBILITY + 1] - counts[:, MOBILITY])
+        values -= blocked_weight * (counts[:, BLOCKED + 1] - counts[:, BLOCKED])
+
+    # same rule as Position.is_lost: fewer than three pieces, or nothing to place and no move
+    any_empty = (boards == 0).any(axis=1)
+    lost = []
+    for side, mobility in ((0, MOBILITY), (1, MOBILITY + 1)):
+        has_moves = any_empty & ((in_hand[:, side] > 0) | (pieces[:, side] == 3) | (counts[:, mobility] > 0))
+        lost.append((material[:, side] < 3) | ((in_hand[:, side] == 0) & ~has_moves))
+    values = np.where(lost[1], -win_score, values)
+    return np.where(lost[0], win_score, values)
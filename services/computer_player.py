@@ -1,9 +1,9 @@
-from copy import deepcopy
 from random import choice
 from turtledemo.penrose import start
 
 from numpy.ma.extras import atleast_1d
 
+from domain.tables import POINT_INDEX
 from services.game import Game
 from services.game_exceptions import AdjError, PlayerError
 
@@ -30,14 +30,11 @@ class SmartComputer:
     """
 
     def check_own_morris(self, board_state, row, col):
-        # board_state = deepcopy(self.__game._board._data)
-        board_state[row][col] = self.player
-        return self.__game.check_mill(board_state, row, col, self.player)
+        # board_state is a bitboard Position, asking it does not modify it
+        return board_state.forms_mill(POINT_INDEX[(row, col)], self.player)
 
     def check_opponent_morris(self, board_state, row, col):
-        # board_state = deepcopy(self.__game._board._data)
-        board_state[row][col] = 3 - self.player
-        return self.__game.check_mill(board_state, row, col, 3 - self.player)
+        return board_state.forms_mill(POINT_INDEX[(row, col)], 3 - self.player)
 
     def can_get_morris(self):
         """
@@ -47,7 +44,7 @@ class SmartComputer:
         for pos in self.__game._VALID_POSITIONS:
             try:
                 self.__game.can_place_piece(pos[0], pos[1])
-                board_state = deepcopy(self.__game._board._data)
+                board_state = self.__game.get_position(self.player)
                 ok = self.check_own_morris(board_state, pos[0], pos[1])
                 if ok:
                     return pos, 500
@@ -64,7 +61,7 @@ class SmartComputer:
         for pos in self.__game._VALID_POSITIONS:
             try:
                 self.__game.can_place_piece(pos[0], pos[1])
-                board_state = deepcopy(self.__game._board._data)
+                board_state = self.__game.get_position(self.player)
                 ok = self.check_opponent_morris(board_state, pos[0], pos[1])
                 if ok:
                     return pos, 600
@@ -131,8 +128,8 @@ class SmartComputer:
         checks if all the pieces are in mills
         :return:
         """
+        board_state = self.__game.get_position(self.player)
         for pos in self.__game.black_pieces if player == 2 else self.__game.white_pieces:
-            board_state = deepcopy(self.__game._board._data)
             if not self.check_own_morris(board_state, pos[0], pos[1]):
                 return False
         return True
@@ -250,8 +247,8 @@ class SmartComputer:
             # for adj in self.__game._ADJ[pos]:
             try:
                 self.__game.can_place_piece(adj[0], adj[1])
-                board_state = deepcopy(self.__game._board._data)
-                board_state[current_positon[0]][current_positon[1]] = 0
+                board_state = self.__game.get_position(self.player)
+                board_state.remove(POINT_INDEX[current_positon], self.player)
                 ok = self.check_own_morris(board_state, adj[0], adj[1])
                 if ok:
                     return adj, 600
@@ -269,8 +266,8 @@ class SmartComputer:
             #   for adj in self.__game._ADJ[pos]:
             try:
                 self.__game.can_place_piece(adj[0], adj[1])
-                board_state = deepcopy(self.__game._board._data)
-                board_state[current_position[0]][current_position[1]] = 0
+                board_state = self.__game.get_position(self.player)
+                board_state.remove(POINT_INDEX[current_position], self.player)
                 ok = self.check_opponent_morris(board_state, adj[0], adj[1])
                 if ok:
                     return adj, 500
@@ -453,7 +450,7 @@ class SmartComputer:
         for pos in self.__game._VALID_POSITIONS:
             try:
                 self.__game.can_place_piece(pos[0], pos[1])
-                board_state = deepcopy(self.__game._board._data)
+                board_state = self.__game.get_position(self.player)
                 ok = self.check_opponent_morris(board_state, pos[0], pos[1])
                 if ok:
                     return piece1, pos, 500
@@ -0,0 +1,212 @@
+"""
+Headless game driver
+
+A state machine for one game that advances on explicit actions (place a
+piece, move a piece, take a piece) and returns what happened as a list of
+events, without a user interface, input() or prints. The rules are the ones
+of Game, played on a domain.position Position.
+
+Actions are taken by the player to act (to_act). A placement or a move that
+closes a mill leaves that player to take a piece before the turn passes:
+awaiting_removal is set and the only legal actions are removals.
+
+Points are (row, col) pairs like everywhere in Game; play() also takes the
+(start, end, removed) point index moves of the AI search.
+
+Events are Event(kind, player, points) tuples:
+
+    PLACED      player placed a piece,      points (point,)
+    MOVED       player moved a piece,       points (start, end)
+    MILL        player closed a mill,       points ()
+    REMOVED     player took a piece,        points (point,)
+    TURN        player is to act,           points ()
+    GAME_OVER   player won, 0 for a draw,   points ()
+"""
+from collections import namedtuple
+
+from domain.position import Position, PLACING, FLYING, removable_points
+from domain.tables import POINTS, POINT_INDEX, ADJACENT_MASKS
+from services.game_exceptions import AdjError, PlayerError
+
+PLACED = "placed"
+MOVED = "moved"
+MILL = "mill"
+REMOVED = "removed"
+TURN = "turn"
+GAME_OVER = "game_over"
+
+Event = namedtuple("Event", "kind player points")
+
+START_POSITION = "........................ 1 9 9"
+
+
+def _index(point):
+    if point not in POINT_INDEX:
+        raise ValueError("Invalid position")
+    return POINT_INDEX[point]
+
+
+class GameDriver:
+    def __init__(self, position=None, max_plies=None):
+        """
+        :param position: the Position to start from, the empty board with white to move by default
+        :param max_plies: the game is drawn after this many placements and moves, None for no limit
+        """
+        self.position = position.copy() if position is not None else Position.from_string(START_POSITION)
+        self.max_plies = max_plies
+        self.plies = 0
+        # the player who closed a mill and still has to take a piece
+        self.__remover = None
+        self.winner = None
+        self.__check_end([])
+
+    @property
+    def over(self):
+        return self.winner is not None
+
+    @property
+    def awaiting_removal(self):
+        return self.__remover is not None
+
+    @property
+    def to_act(self):
+        """The player whose action is expected next."""
+        return self.__remover if self.__remover is not None else self.position.turn
+
+    def legal_actions(self):
+        """
+        Lists the actions the player to act may take.
+
+        :return: list of ("place", point), ("move", start, end) or ("remove", point) tuples
+        """
+        if self.over:
+            return []
+        position = self.position
+        if self.__remover is not None:
+            removable = removable_points(position.masks[3 - self.__remover])
+            return [("remove", point) for index, point in enumerate(POINTS) if removable >> index & 1]
+        return [("place", POINTS[end]) if start is None else ("move", POINTS[start], POINTS[end])
+                for start, end, _ in position.generate_moves()]
+
+    def apply(self, action):
+        """Takes an action as listed by legal_actions."""
+        kind, points = action[0], action[1:]
+        if kind == "place":
+            return self.place(*points)
+        if kind == "move":
+            return self.move(*points)
+        if kind == "remove":
+            return self.remove(*points)
+        raise ValueError(f"Unknown action {kind!r}")
+
+    def place(self, point, player=None):
+        """
+        Places a piece of the player to act.
+
+        :param player: when given, checked against the player to act
+        :return: list of Event
+        """
+        player = self.__check_turn(player, removal=False)
+        position = self.position
+        if position.phase(player) != PLACING:
+            raise PlayerError("There are no pieces left to place")
+        end = _index(point)
+        if position.occupied >> end & 1:
+            raise ValueError("Position already occupied")
+        return self.__play(player, None, end)
+
+    def move(self, start_point, end_point, player=None):
+        """
+        Moves a piece of the player to act, to an adjacent point or anywhere when flying.
+
+        :return: list of Event
+        """
+        player = self.__check_turn(player, removal=False)
+        position = self.position
+        if position.phase(player) == PLACING:
+            raise PlayerError("Place all the pieces before moving")
+        start, end = _index(start_point), _index(end_point)
+        if position.occupied >> end & 1:
+            raise ValueError("Position already occupied")
+        if position.masks[3 - player] >> start & 1:
+            raise PlayerError("This is the piece of the other player")
+        if not position.masks[player] >> start & 1:
+            raise PlayerError(f"There is no piece at {start_point}")
+        if position.phase(player) != FLYING and not ADJACENT_MASKS[start] >> end & 1:
+            raise AdjError("Invalid move")
+        return self.__play(player, start, end)
+
+    def remove(self, point, player=None):
+        """
+        Takes a piece of the opponent after closing a mill.
+
+        :return: list of Event
+        """
+        player = self.__check_turn(player, removal=True)
+        index = _index(point)
+        if not removable_points(self.position.masks[3 - player]) >> index & 1:
+            raise PlayerError("This piece cannot be removed")
+        self.position.remove(index, 3 - player)
+        self.__remover = None
+        events = [Event(REMOVED, player, (point,))]
+        self.__check_end(events)
+        return events
+
+    def play(self, move):
+        """
+        Plays a whole (start, end, removed) move of point indices, e.g. one chosen by the AI search.
+
+        :return: list of Event
+        """
+        start, end, removed = move
+        if start is None:
+            events = self.place(POINTS[end])
+        else:
+            events = self.move(POINTS[start], POINTS[end])
+        if self.awaiting_removal:
+            if removed is None:
+                raise PlayerError("The move closes a mill, it must take a piece")
+            events += self.remove(POINTS[removed])
+        elif removed is not None:
+            raise PlayerError("The move does not close a mill")
+        return events
+
+    def __check_turn(self, player, removal):
+        if self.over:
+            raise PlayerError("The game is over")
+        if player is not None and player != self.to_act:
+            raise PlayerError(f"It is the turn of player {self.to_act}")
+        if removal != self.awaiting_removal:
+            raise PlayerError("A piece has to be removed first" if self.awaiting_removal
+                              else "There is no mill to remove a piece for")
+        return self.to_act
+
+    def __play(self, player, start, end):
+        position = self.position
+        closes = position.closes_mill(start, end, player)
+        position.make_move((start, end, None))
+        self.plies += 1
+        if start is None:
+            events = [Event(PLACED, player, (POINTS[end],))]
+        else:
+            events = [Event(MOVED, player, (POINTS[start], POINTS[end]))]
+        if closes and position.masks[3 - player]:
+            events.append(Event(MILL, player, ()))
+            self.__remover = player
+            events.append(Event(TURN, player, ()))
+            return events
+        self.__check_end(events)
+        return events
+
+    def __check_end(self, events):
+        # called once the turn has passed: the player to move may have lost, or the game run out of plies
+        position = self.position
+        player = position.turn
+        if position.is_lost(player):
+            self.winner = 3 - player
+        elif self.max_plies is not None and self.plies >= self.max_plies:
+            self.winner = 0
+        if self.winner is not None:
+            events.append(Event(GAME_OVER, self.winner, ()))
+        else:
+            events.append(Event(TURN, player, ()))
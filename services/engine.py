@@ -0,0 +1,323 @@
+"""
+Engine protocol
+
+Drives an AIPLayer over stdin and stdout with a text protocol modelled on
+UCI, so tournament managers and batch drivers can keep one engine process
+running over many games. One command per line:
+
+    uci                         identify, list the options, answer uciok
+    isready                     answer readyok
+    setoption name <name> value <value>
+    ucinewgame                  forget what earlier games filled the table with
+    position startpos [moves <move> ...]
+    position fen <board> <turn> <white in hand> <black in hand> [moves <move> ...]
+    go [depth <n>] [movetime <ms>] [nodes <n>] [wtime <ms> btime <ms> [winc <ms> binc <ms>]] [ponder] [infinite]
+    stop                        end the search, answer bestmove
+    ponderhit                   the expected move was played, the search of go ponder goes on under its limits
+    quit
+
+fen is the text of Position.to_string. Points are named like in the console
+UI, column letter then row (a1 .. g7). A placement is written as its point
+(d7), a move as its two points (d7d6), and a move that closes a mill ends
+with x and the point of the piece it takes (d7d6xa1).
+
+While it searches, the engine writes one line per completed iteration:
+
+    info depth <d> score cp <value> nodes <n> nps <n> time <ms> pv <move> ...
+
+with the value seen from the side to move and 100 for one piece, or
+score mate <moves> for a won or lost position, and ends with
+
+    bestmove <move> [ponder <move>]
+
+The AI plays both colors: a position with white to move is searched with the
+colors swapped, since the search always plays black.
+
+Options: Hash (MB), Threads (1 searches alone, more start Lazy SMP helper
+processes), TablebasePath (directory of services.tablebase files, empty for
+none) and OwnBook (the opening book for placements).
+
+Run from the repository root:
+
+    python -m services.engine
+"""
+import re
+import sys
+from threading import Event, Lock, Thread, Timer
+from time import perf_counter
+
+from domain.position import Position
+from domain.tables import POINTS, POINT_INDEX
+from services.ai import AIPLayer, DEFAULT_HASH_MB, MAX_SEARCH_DEPTH, PIECE_WEIGHT, WIN_SCORE
+from services.driver import START_POSITION
+from services.opening_book import OpeningBook
+from services.server import parse_point, format_point
+from services.tablebase import Tablebase, MAX_PLIES
+
+ENGINE_NAME = "Nine Men's Morris minimax"
+MOVE_PATTERN = re.compile(r"([a-g][1-7])([a-g][1-7])?(?:x([a-g][1-7]))?$")
+# a game is expected to last this many more moves when only the clock is given
+MOVES_TO_GO = 30
+MAX_HASH_MB = 4096
+MAX_THREADS = 64
+
+
+def format_move(move):
+    start, end, removed = move
+    text = format_point(POINTS[end]) if start is None else format_point(POINTS[start]) + format_point(POINTS[end])
+    return text if removed is None else f"{text}x{format_point(POINTS[removed])}"
+
+
+def parse_move(text):
+    """:return: the (start, end, removed) move of a move written like d7d6xa1"""
+    match = MOVE_PATTERN.match(text.lower())
+    if match is None:
+        raise ValueError(f"Invalid move {text!r}")
+    first, second, removed = (None if name is None else POINT_INDEX[parse_point(name)] for name in match.groups())
+    if second is None:
+        return None, first, removed
+    return first, second, removed
+
+
+def swap_colors(position):
+    """The position with the colors of the pieces and the side to move swapped."""
+    return Position(white=position.masks[2], black=position.masks[1], turn=3 - position.turn,
+                    white_in_hand=position.in_hand[2], black_in_hand=position.in_hand[1])
+
+
+class Engine:
+    def __init__(self, output=None):
+        """
+        :param output: where the answers go, a file with write and flush; sys.stdout by default
+        """
+        self.output = output if output is not None else sys.stdout
+        self.options = {"Hash": DEFAULT_HASH_MB, "Threads": 1, "TablebasePath": "", "OwnBook": True}
+        self.position = Position.from_string(START_POSITION)
+        self.ai = None
+        self.__book = None
+        self.__output_lock = Lock()
+        self.__thread = None
+        self.__stop = Event()
+        # set on ponderhit or stop: a search started with go ponder may only answer after it
+        self.__released = Event()
+        self.__pondering = False
+        self.__time_limit = None
+        self.__timer = None
+
+    def send(self, line):
+        with self.__output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def run(self, lines=None):
+        """Answers the commands of lines (sys.stdin by default) until quit or the end of the input."""
+        for line in (lines if lines is not None else sys.stdin):
+            if not self.handle(line):
+                break
+        self.quit()
+
+    def handle(self, line):
+        """
+        Runs one command.
+
+        :return: False once the engine should quit
+        """
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+        if command == "quit":
+            return False
+        handler = getattr(self, f"command_{command}", None)
+        if handler is None:
+            self.send(f"info string unknown command {command}")
+            return True
+        try:
+            handler(args)
+        except ValueError as error:
+            self.send(f"info string {error}")
+        return True
+
+    def quit(self):
+        self.command_stop([])
+        if self.ai is not None:
+            self.ai.close()
+            self.ai = None
+
+    def command_uci(self, args):
+        self.send(f"id name {ENGINE_NAME}")
+        self.send(f"option name Hash type spin default {DEFAULT_HASH_MB} min 1 max {MAX_HASH_MB}")
+        self.send(f"option name Threads type spin default 1 min 1 max {MAX_THREADS}")
+        self.send("option name TablebasePath type string default <empty>")
+        self.send("option name OwnBook type check default true")
+        self.send("uciok")
+
+    def command_isready(self, args):
+        self.send("readyok")
+
+    def command_setoption(self, args):
+        text = " ".join(args)
+        match = re.match(r"name (.+?)(?: value (.*))?$", text)
+        if match is None:
+            raise ValueError(f"Invalid setoption {text!r}")
+        name, value = match.group(1), (match.group(2) or "").strip()
+        option = next((option for option in self.options if option.lower() == name.lower()), None)
+        if option is None:
+            raise ValueError(f"unknown option {name}")
+        self.command_stop([])
+        if option in ("Hash", "Threads"):
+            limit = MAX_HASH_MB if option == "Hash" else MAX_THREADS
+            self.options[option] = min(max(int(value), 1), limit)
+        elif option == "TablebasePath":
+            self.options[option] = "" if value == "<empty>" else value
+        else:
+            self.options[option] = value.lower() == "true"
+        # built again with the new options on the next search
+        self.command_ucinewgame([])
+
+    def command_ucinewgame(self, args):
+        self.command_stop([])
+        if self.ai is not None:
+            self.ai.close()
+            self.ai = None
+
+    def command_position(self, args):
+        if not args:
+            raise ValueError("position needs startpos or fen")
+        moves = args.index("moves") if "moves" in args else len(args)
+        if args[0] == "startpos":
+            position = Position.from_string(START_POSITION)
+        elif args[0] == "fen":
+            position = Position.from_string(" ".join(args[1:moves]))
+        else:
+            raise ValueError("position needs startpos or fen")
+        for text in args[moves + 1:]:
+            move = parse_move(text)
+            if move not in position.generate_moves(captures=True):
+                raise ValueError(f"illegal move {text}")
+            position.make_move(move)
+        self.command_stop([])
+        self.position = position
+
+    def command_go(self, args):
+        self.command_stop([])
+        limits = {}
+        index = 0
+        while index < len(args):
+            name = args[index]
+            if name in ("ponder", "infinite"):
+                limits[name] = True
+                index += 1
+            else:
+                if index + 1 >= len(args):
+                    raise ValueError(f"go {name} needs a value")
+                limits[name] = int(args[index + 1])
+                index += 2
+        position = self.position
+        # the clock of the side to move, when no fixed time is given
+        time_limit = limits["movetime"] / 1000 if "movetime" in limits else None
+        clock = "wtime" if position.turn == 1 else "btime"
+        if time_limit is None and clock in limits and not limits.get("infinite"):
+            increment = limits.get("winc" if position.turn == 1 else "binc", 0)
+            time_limit = max(limits[clock] / MOVES_TO_GO + increment * 0.8, 1) / 1000
+        self.__stop.clear()
+        self.__released.clear()
+        self.__pondering = bool(limits.get("ponder"))
+        self.__time_limit = time_limit
+        if not self.__pondering:
+            self.__released.set()
+            self.start_timer()
+        max_depth = min(limits.get("depth", MAX_SEARCH_DEPTH), MAX_SEARCH_DEPTH)
+        self.__thread = Thread(target=self.search, args=(position.copy(), max_depth, limits.get("nodes")),
+                               name="engine-search", daemon=True)
+        self.__thread.start()
+
+    def command_stop(self, args):
+        """Ends the running search, if any, and waits for its bestmove."""
+        if self.__timer is not None:
+            self.__timer.cancel()
+        self.__stop.set()
+        self.__released.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def command_ponderhit(self, args):
+        if self.__pondering:
+            self.__pondering = False
+            self.start_timer()
+            self.__released.set()
+
+    def start_timer(self):
+        # the time budget runs from here: from go, or from ponderhit when pondering
+        if self.__time_limit is not None:
+            self.__timer = Timer(self.__time_limit, self.__stop.set)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def engine_ai(self):
+        # built on first use and after the options change
+        if self.ai is None:
+            path = self.options["TablebasePath"]
+            self.ai = AIPLayer(None, "engine", hash_size_mb=self.options["Hash"], max_depth=MAX_SEARCH_DEPTH,
+                               smp_helpers=self.options["Threads"] - 1, tablebase=Tablebase(path) if path else None)
+            if self.__book is None and self.options["OwnBook"]:
+                self.__book = OpeningBook.load()
+        return self.ai
+
+    def search(self, position, max_depth, node_limit):
+        # on the search thread: decide, stream the iterations, then answer bestmove
+        ai = self.engine_ai()
+        # the search plays black
+        root = swap_colors(position) if position.turn == 1 else position
+        placing = root.in_hand[2] > 0
+        start = perf_counter()
+        best_move = None
+        if not root.generate_moves(captures=True) or root.is_lost(2):
+            self.send("info string no legal move")
+        elif placing and self.options["OwnBook"] and self.__book is not None:
+            best_move = self.__book.probe(root)
+            if best_move not in root.generate_moves(captures=True):
+                best_move = None
+            else:
+                self.send("info string book move")
+        if best_move is None and ai.tablebase is not None and ai.tablebase.covers(root, distances=True):
+            best_move = ai.tablebase.best_move(root)
+            ai.nodes = 0
+            self.send_info(ai, root, 0, ai.tablebase_value(root), start)
+        if best_move is None and root.generate_moves(captures=True) and not root.is_lost(2):
+            def report(depth, value, move):
+                self.send_info(ai, root, depth, value, start)
+
+            best_move = ai.search(root, placing, self.__stop, max_depth, None, node_limit, report)
+        # a pondering search answers only once the expected move has been played, or on stop
+        self.__released.wait()
+        if best_move is None:
+            self.send("bestmove (none)")
+            return
+        line = ai.principal_variation(root, 2)
+        answer = f"bestmove {format_move(best_move)}"
+        if len(line) == 2 and line[0] == best_move:
+            answer += f" ponder {format_move(line[1])}"
+        self.send(answer)
+
+    def send_info(self, ai, root, depth, value, start):
+        elapsed = perf_counter() - start
+        line = ai.principal_variation(root)
+        if abs(value) >= WIN_SCORE - MAX_PLIES:
+            # a won or lost position, the tablebase knows in how many plies, the search only that it is
+            plies = WIN_SCORE - abs(value) or len(line)
+            score = f"mate {(plies + 1) // 2 if value > 0 else -((plies + 1) // 2)}"
+        else:
+            score = f"cp {round(value * 100 / PIECE_WEIGHT)}"
+        nps = int(ai.nodes / elapsed) if elapsed > 0 else 0
+        self.send(f"info depth {depth} score {score} nodes {ai.nodes} nps {nps} time {int(elapsed * 1000)} "
+                  f"pv {' '.join(format_move(move) for move in line)}".rstrip())
+
+
+def main():
+    Engine().run()
+
+
+if __name__ == "__main__":
+    main()
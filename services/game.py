@@ -1,23 +1,36 @@
-# adjacency list for each intersection
-from copy import deepcopy
+from collections import deque
 from random import choice
 
 from services.ai import AIPLayer
 from domain.board import Board
+from domain.position import Position, PIECES_PER_PLAYER, mill_points, removable_points
+from domain.tables import ADJ, MILLS, POINTS, POINT_INDEX, POINT_MILLS, ADJACENT_MASKS, ALL_POINTS
 from services.game_exceptions import AdjError, PlayerError
 
 #TODO: daca face moara trebuie sa printeze prima data unde a mutat si apoi la ce piesa i-a dat remove atunci cand joaca pc-ul
+# how many formed mills are remembered, older ones are dropped
+MILL_HISTORY_SIZE = 64
+
 #TODO: in lo ca make_move sa fie apelat din diferite clase, mai bine dau return la row si col si apelez din clasa game direct ca atunci cred ca mi-e mai usor si cu printatul
 
 class Game(Board):
+    # the geometry tables are built once in domain.tables and shared by every game
+    _ADJ = ADJ
+    _MILLS = MILLS
+    _VALID_POSITIONS = POINTS
+
     def __init__(self, board: Board, graphic_mode, graphic):
         self._board = board
         self._white_pieces = []
         self._black_pieces = []
-        self._white_mills = []
-        self.black_mills = []
+        # (player, mill) for the mills actually formed during the game, most recent last
+        self._mill_history = deque(maxlen=MILL_HISTORY_SIZE)
+        # pieces placed so far by each player (index 0 unused)
+        self._placed = [0, 0, 0]
         self.graphic = graphic
         self.__graphic_mode = graphic_mode
+        # the AI taking black's pieces in the console human_vs_ai mode; the UI hands over the one that searches,
+        # so a capture takes the piece its search chose
         self._AIPlayer = AIPLayer(self, graphic)
         self._inv_coord = {
             1: "A",
@@ -28,37 +41,6 @@ class Game(Board):
             6: "F",
             7: "G",
         }
-        self._ADJ = {(1, 1): [(1, 4), (4, 1)], (1, 4): [(1, 1), (1, 7), (2, 4)], (1, 7): [(1, 4), (4, 7)],
-               (4, 7): [(1, 7), (7, 7), (4, 6)],
-               (7, 7): [(4, 7), (7, 4)], (7, 4): [(7, 7), (7, 1), (6, 4)], (7, 1): [(7, 4), (4, 1)],
-               (4, 1): [(7, 1), (1, 1), (4, 2)],
-               (2, 2): [(2, 4), (4, 2)], (2, 4): [(2, 2), (2, 6), (1, 4), (3, 4)], (2, 6): [(2, 4), (4, 6)],
-               (4, 6): [(2, 6), (6, 6), (4, 7), (4, 5)],
-               (6, 6): [(4, 6), (6, 4)], (6, 4): [(6, 6), (6, 2), (7, 4), (5, 4)], (6, 2): [(6, 4), (4, 2)],
-               (4, 2): [(6, 2), (2, 2), (4, 1), (4, 3)],
-               (3, 3): [(3, 4), (4, 3)], (3, 4): [(3, 3), (3, 5), (2, 4)], (3, 5): [(3, 4), (4, 5)],
-               (4, 5): [(3, 5), (5, 5), (4, 6)],
-               (5, 5): [(4, 5), (5, 4)], (5, 4): [(5, 5), (5, 3), (6, 4)], (5, 3): [(5, 4), (4, 3)],
-               (4, 3): [(5, 3), (3, 3), (4, 2)]
-               }
-
-        # list of mills
-        self._MILLS = (((1, 1), (1, 4), (1, 7)), ((4, 1), (4, 2), (4, 3)), ((7, 1), (7, 4), (7, 7)),
-                 ((2, 2), (2, 4), (2, 6)), ((2, 2), (4, 2), (6, 2)), ((6, 2), (6, 4), (6, 6)),
-                 ((3, 3), (3, 4), (3, 5)), ((5, 3), (5, 4), (5, 5)), ((2, 6), (4, 6), (6, 6)),
-                 ((1, 4), (2, 4), (3, 4)), ((3, 5), (4, 5), (5, 5)), ((1, 7), (4, 7), (7, 7)),
-                 ((5, 4), (6, 4), (7, 4)), ((3, 3), (4, 3), (5, 3)), ((1, 1), (4, 1), (7, 1)),
-                 ((4, 5), (4, 6), (4, 7))
-                 )
-
-        self._VALID_POSITIONS = [(1, 1), (1, 4), (1, 7),
-                           (2, 2), (2, 4), (2, 6),
-                           (3, 3), (3, 4), (3, 5),
-                           (4, 1), (4, 2), (4, 3),
-                           (4, 5), (4, 6), (4, 7),
-                           (5, 3), (5, 4), (5, 5),
-                           (6, 2), (6, 4), (6, 6),
-                           (7, 1), (7, 4), (7, 7)]
 
     @property
     def black_pieces(self):
@@ -68,8 +50,27 @@ class Game(Board):
     def white_pieces(self):
         return self._white_pieces
 
+    @property
+    def ai_player(self):
+        return self._AIPlayer
+
+    @ai_player.setter
+    def ai_player(self, ai_player):
+        self._AIPlayer = ai_player
+
+    def get_position(self, turn):
+        """
+        Takes a bitboard snapshot of the current game.
+
+        :param turn: the player to move (1 or 2)
+        :return: a Position with the board masks and the pieces left in hand
+        """
+        return Position.from_board(self._board, turn,
+                                   max(PIECES_PER_PLAYER - self._placed[1], 0),
+                                   max(PIECES_PER_PLAYER - self._placed[2], 0))
+
     def can_place_piece(self, row, col):
-        if row < 1 or row > 7 or col < 1 or col > 7 or (row, col) not in self._VALID_POSITIONS:
+        if (row, col) not in POINT_INDEX:
             raise ValueError("Invalid position")
         if self._board._data[row][col] != 0:
             raise ValueError("Position already occupied")
@@ -78,6 +79,7 @@ class Game(Board):
         try:
             self.can_place_piece(row, col)
             self._board.update(row, col, player)
+            self._placed[player] += 1
             if player == 1:
                 self._white_pieces.append((row, col))
             else:
@@ -122,8 +124,25 @@ class Game(Board):
         except (ValueError, AdjError, PlayerError) as ve:
             raise ve
 
+    @property
+    def mill_history(self):
+        return self._mill_history
+
+    def record_mills(self, row, col, player):
+        """
+        Remembers the mills closed by the piece on (row, col).
+
+        :return: True if at least one mill was recorded
+        """
+        formed = False
+        for mill in POINT_MILLS[POINT_INDEX[(row, col)]]:
+            if all(self._board._data[r][c] == player for r, c in mill):
+                self._mill_history.append((player, mill))
+                formed = True
+        return formed
+
     def is_mill(self, row, col, player, game_mode):
-        mill = self.check_mill(self._board._data, row, col, player)
+        mill = self.record_mills(row, col, player)
         # print(f"White pieces: {self._white_pieces}")
         # print(f"Black pieces: {self._black_pieces}")
         if mill:
@@ -134,46 +153,32 @@ class Game(Board):
 
     def check_mill(self, board_state, row, col, player):
         """
-        Checks if placing a piece at (row, col) will form a mill for the given player.
+        Checks if (row, col) is part of a full mill of the given player on board_state.
+        This is a pure query: the board is neither copied nor modified and nothing is recorded.
 
         :param board_state: The current state of the board (2D list).
         :param row: The row of the position being checked.
         :param col: The column of the position being checked.
         :param player: The player ID (1 for opponent, 2 for AI).
-        :return: True if placing a piece forms a mill, False otherwise.
+        :return: True if the position is part of a mill, False otherwise.
         """
-        # Temporarily place the piece on the simulated board
-        # print(row, col)
-        new_state = deepcopy(board_state)
-        new_state[row][col] = player
-
-        for mill in self._MILLS:
-            if (row, col) in mill:
-                # Check if all 3 positions in the mill contain pieces from the same player
-                if all(board_state[r][c] == player for r, c in mill):
-                    self._white_mills.append(mill) if player == 1 else self.black_mills.append(mill)
-                    return True
+        # only the two mills through (row, col) can be closed by it
+        for mill in POINT_MILLS[POINT_INDEX[(row, col)]]:
+            # Check if all 3 positions in the mill contain pieces from the same player
+            if all(board_state[r][c] == player for r, c in mill):
+                return True
         return False
 
     def pieces_outside_mill(self, player):
-        if player == 1:
-            for piece in self._white_pieces:
-                if not self.check_mill(self._board._data,piece[0], piece[1], player):
-                    return True
-        else:
-            for piece in self._black_pieces:
-                if not self.check_mill(self._board._data, piece[0], piece[1], player):
-                    return True
-        return False
+        mask = self._board.masks[player]
+        return mask & ~mill_points(mask) != 0
 
     def valid_remove_piece(self, player):
         opponent = 2 if player == 1 else 1
-        pieces_not_in_mill = self.pieces_outside_mill(opponent)
-        valid_pieces = [
-            piece for piece in (self._white_pieces if opponent == 1 else self._black_pieces)
-            if not self.check_mill(self._board._data, piece[0], piece[1], opponent) or not pieces_not_in_mill
-        ]
-        return valid_pieces
+        # pieces in a mill can only be taken when there is nothing else to take
+        removable = removable_points(self._board.masks[opponent])
+        pieces = self._white_pieces if opponent == 1 else self._black_pieces
+        return [piece for piece in pieces if removable >> POINT_INDEX[piece] & 1]
 
     def best_piece_to_remove(self, player):
         # Get opponent player number
@@ -250,16 +255,14 @@ class Game(Board):
             #     pass
 
     def check_moves_left(self, player):
-        if player == 1:
-            for piece in self._white_pieces:
-                for adj in self._ADJ[piece]:
-                    if self._board._data[adj[0]][adj[1]] == 0:
-                        return True
-        else:
-            for piece in self._black_pieces:
-                for adj in self._ADJ[piece]:
-                    if self._board._data[adj[0]][adj[1]] == 0:
-                        return True
+        masks = self._board.masks
+        empty = ALL_POINTS & ~(masks[1] | masks[2])
+        pieces = masks[player]
+        while pieces:
+            bit = pieces & -pieces
+            if ADJACENT_MASKS[bit.bit_length() - 1] & empty:
+                return True
+            pieces ^= bit
 
         return False
 
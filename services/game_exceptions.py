@@ -10,4 +10,8 @@ class PlayerError(Exception):
         self.__message = message
 
     def __str__(self):
-        return self.__message
\ No newline at end of file
+        return self.__message
+
+class SearchTimeout(Exception):
+    """Raised inside the AI search when its time or node budget runs out."""
+    pass
@@ -0,0 +1,93 @@
+"""
+Lazy SMP
+
+Helper processes run the same iterative deepening search as the main AI on
+the same root, and all of them read and write one transposition table kept in
+a multiprocessing.shared_memory block. The helpers do not report moves: their
+only output is the table entries, which give the main search cutoffs and
+move ordering it would otherwise have to compute itself. Half of the helpers
+start one ply deeper than the others, so they tend to be ahead of the main
+search and to search different parts of the tree. The helpers are built with
+the options of the main AI (AIPLayer.process_options), so they key the table
+entries the same way and store the values of its tablebase, not their own.
+
+The table entries store the key xor-ed with the data (see
+services.transposition), so the processes write without locks: an entry torn
+by two concurrent writers fails the key check and is treated as missing.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Event
+from multiprocessing.shared_memory import SharedMemory
+
+from domain.position import Position
+from services.transposition import TranspositionTable, table_bytes
+
+_ai = None
+_stop = None
+_memory = None
+
+
+def _init_helper(name, ai_options, stop):
+    global _ai, _stop, _memory
+    # imported here, services.ai imports this module
+    from services.ai import AIPLayer
+    from services.tablebase import Tablebase
+    _memory = SharedMemory(name=name)
+    ai_options = dict(ai_options)
+    if ai_options.get("tablebase") is not None:
+        # memory mapped again in this process, the pages of the files are shared
+        ai_options["tablebase"] = Tablebase(ai_options["tablebase"])
+    _ai = AIPLayer(None, "helper", **ai_options)
+    _ai.attach_table(TranspositionTable(_ai.hash_size_mb, buffer=_memory.buf))
+    _stop = stop
+
+
+def _help(text, placing, depth_offset):
+    """
+    Searches deeper and deeper from a root until the main search stops, in a helper.
+
+    :return: the number of nodes searched
+    """
+    return _ai.helper_search(Position.from_string(text), placing, depth_offset, _stop)
+
+
+class LazySMP:
+    def __init__(self, helpers, ai_options):
+        """
+        :param helpers: number of helper processes
+        :param ai_options: constructor options of the AIPLayer of each helper, see AIPLayer.process_options;
+                           hash_size_mb is the memory for the shared transposition table, in MB
+        """
+        self.helpers = helpers
+        size_mb = ai_options["hash_size_mb"]
+        self.__memory = SharedMemory(create=True, size=table_bytes(size_mb))
+        self.table = TranspositionTable(size_mb, buffer=self.__memory.buf)
+        self.__stop = Event()
+        self.__pool = ProcessPoolExecutor(max_workers=helpers, initializer=_init_helper,
+                                          initargs=(self.__memory.name, ai_options, self.__stop))
+        self.__searches = []
+
+    def start(self, root, placing):
+        """Starts the helpers on root; the main search runs in the calling process meanwhile."""
+        self.__stop.clear()
+        text = root.to_string()
+        self.__searches = [self.__pool.submit(_help, text, placing, 1 + helper % 2)
+                           for helper in range(self.helpers)]
+
+    def stop(self):
+        """
+        Stops the helpers and waits for them.
+
+        :return: the number of nodes the helpers searched
+        """
+        self.__stop.set()
+        nodes = sum(search.result() for search in self.__searches)
+        self.__searches = []
+        return nodes
+
+    def close(self):
+        self.stop()
+        self.__pool.shutdown()
+        self.table.release()
+        self.__memory.close()
+        self.__memory.unlink()
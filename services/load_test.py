@@ -0,0 +1,171 @@
+"""
+Load test for the game server
+
+Plays many games against the AI of a services.server at once and reports how
+fast they went: moves per second (the client's and the AI's), the latency of
+the requests (from sending an action to its answer, which includes the AI
+reply), and how often the server was busy.
+
+The client plays white with random legal moves. Games are spread over a few
+connections and each connection carries many games at once, told apart by
+the request tags. A busy answer is retried after a short pause and counted.
+
+Run from the repository root against a running server, or without --port to
+start one in this process:
+
+    python -m services.load_test --games 2000 --connections 8 --port 7878
+    python -m services.load_test --games 200 --workers 4 --ai max_depth=2
+"""
+import argparse
+import asyncio
+import itertools
+import math
+import os
+from random import Random
+from time import perf_counter
+
+from domain.position import Position, removable_points
+from domain.tables import POINTS
+from services.arena import parse_engine
+from services.server import GameServer, format_point
+
+BUSY_PAUSE = 0.05
+
+
+class _Connection:
+    """One connection to the server, shared by many games; answers are matched to requests by tag."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.waiting = {}
+        self.tags = itertools.count()
+        self.listener = asyncio.create_task(self.listen())
+
+    async def listen(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            tag, _, response = line.decode().rstrip("\n").partition(" ")
+            self.waiting.pop(tag).set_result(response.split())
+        for future in self.waiting.values():
+            future.set_exception(ConnectionError("The server closed the connection"))
+
+    async def request(self, text):
+        tag = str(next(self.tags))
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[tag] = future
+        self.writer.write(f"{tag} {text}\n".encode())
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.listener
+
+
+def percentile(values, fraction):
+    """The value below which the given fraction of the sorted values lies (nearest rank)."""
+    if not values:
+        return 0.0
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+async def _play_game(connection, random, stats):
+    # a game against the AI, white playing random legal actions
+    words = await connection.request("new")
+    game = words[1]
+    while True:
+        if words[0] != "ok":
+            stats["errors"] += 1
+            return
+        position = Position.from_string(" ".join(words[2:6]))
+        to_act, removal, winner = int(words[6]), words[7] == "1", words[8]
+        if winner != "-" or to_act != 1:
+            break
+        if removal:
+            removable = removable_points(position.masks[2])
+            point = random.choice([index for index in range(len(POINTS)) if removable >> index & 1])
+            action = f"remove {game} {format_point(POINTS[point])}"
+        else:
+            start, end, _ = random.choice(position.generate_moves())
+            action = (f"place {game} {format_point(POINTS[end])}" if start is None
+                      else f"move {game} {format_point(POINTS[start])} {format_point(POINTS[end])}")
+        while True:
+            sent = perf_counter()
+            answer = await connection.request(action)
+            if answer[0] != "busy":
+                break
+            stats["busy"] += 1
+            await asyncio.sleep(BUSY_PAUSE)
+        stats["latencies"].append(perf_counter() - sent)
+        if answer[0] == "ok":
+            # the client's action and the AI reply, if any
+            stats["moves"] += sum(event.split(":")[0] in ("placed", "moved") for event in answer[9:])
+        words = answer
+    stats["games"] += 1
+    await connection.request(f"close {game}")
+
+
+async def run_load_test(host, port, games, connections=4, seed=0):
+    """
+    Plays games against a server, all at once.
+
+    :return: dict with the games finished, the moves played by both sides, the seconds taken, moves per second,
+             request latency (p50, p99 and max, in seconds), busy answers and failed games
+    """
+    stats = {"games": 0, "moves": 0, "busy": 0, "errors": 0, "latencies": []}
+    pool = []
+    for _ in range(connections):
+        reader, writer = await asyncio.open_connection(host, port)
+        pool.append(_Connection(reader, writer))
+    random = Random(seed)
+    start = perf_counter()
+    await asyncio.gather(*(_play_game(pool[index % connections], Random(random.random()), stats)
+                           for index in range(games)))
+    elapsed = perf_counter() - start
+    for connection in pool:
+        await connection.close()
+    latencies = sorted(stats["latencies"])
+    return {
+        "games": stats["games"], "moves": stats["moves"], "seconds": elapsed,
+        "moves_per_second": stats["moves"] / elapsed if elapsed else 0.0,
+        "latency": (percentile(latencies, 0.5), percentile(latencies, 0.99), latencies[-1] if latencies else 0.0),
+        "busy": stats["busy"], "errors": stats["errors"],
+    }
+
+
+async def _load_test(options):
+    server = None
+    host, port = options.host, options.port
+    if port is None:
+        server = GameServer(options.workers, parse_engine("minimax:" + options.ai)[1])
+        await server.start(host, 0)
+        host, port = server.address
+    try:
+        return await run_load_test(host, port, options.games, options.connections, options.seed)
+    finally:
+        if server is not None:
+            await server.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Play many games against a game server and measure it.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="server port; without it a server is started here")
+    parser.add_argument("--games", type=int, default=200, help="games played at once")
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="AI processes of a started server")
+    parser.add_argument("--ai", default="", help="AIPLayer options of a started server, as option=value,...")
+    options = parser.parse_args(args)
+    result = asyncio.run(_load_test(options))
+    p50, p99, worst = result["latency"]
+    print(f"{result['games']} games, {result['moves']} moves in {result['seconds']:.1f}s: "
+          f"{result['moves_per_second']:.0f} moves/s, latency p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms, "
+          f"max {worst * 1000:.1f} ms, {result['busy']} busy, {result['errors']} failed games")
+
+
+if __name__ == "__main__":
+    main()
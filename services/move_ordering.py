@@ -0,0 +1,117 @@
+"""
+Move ordering for the AI search
+
+Alpha-beta prunes the most when the best move is searched first. The moves of
+a node are sorted by, in this order:
+
+- the move stored for the position in the transposition table
+- moves that close a mill
+- moves that stop the opponent from closing a mill on the target point
+- the killer moves of the ply (quiet moves that caused a cutoff in a sibling)
+- the history score of the move (how often and how deep it caused cutoffs)
+
+Moves are (start, end, removed) tuples as played by Position.make_move.
+
+The orderer also counts at which index of the ordered list each cutoff
+happened; with good ordering almost all of them are at index 0.
+"""
+
+TT_MOVE_SCORE = 1 << 40
+MILL_SCORE = 1 << 38
+BLOCK_SCORE = 1 << 36
+KILLER_SCORE = 1 << 34
+
+KILLERS_PER_PLY = 2
+
+# history index used for the start of a placement
+_PLACE = 24
+
+
+class MoveOrderer:
+    def __init__(self):
+        self.killers = []
+        # history[player][start][end], start 24 is a placement
+        self.history = [[[0] * 24 for _ in range(25)] for _ in range(3)]
+        self.cutoffs = []
+        self.nodes = 0
+
+    def clear(self):
+        """Forgets killers, history and statistics, e.g. when a new game starts."""
+        self.__init__()
+
+    def new_search(self):
+        """Keeps the history from the previous move but ages it, and resets the statistics."""
+        for player in (1, 2):
+            for row in self.history[player]:
+                for end in range(24):
+                    row[end] >>= 1
+        self.killers = []
+        self.cutoffs = []
+        self.nodes = 0
+
+    def order(self, position, moves, player, ply, tt_move=None):
+        """
+        Sorts moves best first.
+
+        :param position: the position the moves are played from
+        :param moves: list of (start, end, removed) moves
+        :param player: the player to move
+        :param ply: distance from the root, used for the killer moves
+        :param tt_move: the move stored in the transposition table, if any
+        :return: a new sorted list
+        """
+        self.nodes += 1
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        history = self.history[player]
+        opponent = 3 - player
+        scored = []
+        for move in moves:
+            start, end, removed = move
+            if move == tt_move:
+                score = TT_MOVE_SCORE
+            elif removed is not None or position.closes_mill(start, end, player):
+                score = MILL_SCORE
+            elif position.forms_mill(end, opponent):
+                score = BLOCK_SCORE
+            elif move in killers:
+                score = KILLER_SCORE - killers.index(move)
+            else:
+                score = history[_PLACE if start is None else start][end]
+            scored.append((score, move))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [move for _, move in scored]
+
+    def cutoff(self, move, player, ply, depth, index):
+        """
+        Records that move caused a beta cutoff.
+
+        :param index: the position of move in the ordered list
+        """
+        while len(self.cutoffs) <= index:
+            self.cutoffs.append(0)
+        self.cutoffs[index] += 1
+        start, end, removed = move
+        if removed is not None:
+            # captures are already searched early
+            return
+        self.history[player][_PLACE if start is None else start][end] += depth * depth
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        killers = self.killers[ply]
+        if move in killers:
+            killers.remove(move)
+        killers.insert(0, move)
+        del killers[KILLERS_PER_PLY:]
+
+    def stats(self):
+        """
+        :return: the cutoff counts per move index, the share of cutoffs on the first move
+                 and the number of ordered nodes
+        """
+        total = sum(self.cutoffs)
+        return {
+            "nodes": self.nodes,
+            "cutoffs": total,
+            "cutoff_index": list(self.cutoffs),
+            "first_move_rate": self.cutoffs[0] / total if total else 0.0,
+        }
@@ -0,0 +1,158 @@
+"""
+Opening book
+
+Stores the move to play in positions of the early placing phase, so the AI
+answers them without searching. Positions are keyed by their canonical key
+(domain.symmetry), so one entry serves all the images of a position; the
+move is kept in the frame of the canonical form and mapped back on probe.
+
+The book is built offline by deep searches: from the empty board every
+placement of white is followed, and in every position reached with black to
+move the AI searches to the given depth and the book records its move, which
+is the only black move followed further.
+
+File: a HEADER_SIZE byte header (magic b"NMOB", format version, number of
+entries) followed by the entries sorted by key, ENTRY.size bytes each: the
+key, the packed move (services.transposition.pack_move), the value and the
+depth of the search that chose it.
+
+Build the book shipped in books/ from the repository root:
+
+    python -m services.opening_book --moves 3 --depth 5
+"""
+import argparse
+import os
+import struct
+from time import perf_counter
+
+from domain.position import Position
+from domain.symmetry import INVERSES, canonical_key, transform_move
+from services.transposition import pack_move, unpack_move
+
+MAGIC = b"NMOB"
+FORMAT_VERSION = 1
+# magic, version, entries
+HEADER = struct.Struct("<4sH2xQ")
+HEADER_SIZE = HEADER.size
+# key, packed move, value, depth
+ENTRY = struct.Struct("<QHiB5x")
+
+DEFAULT_BOOK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "books", "opening.book")
+
+START_POSITION = "........................ 1 9 9"
+
+
+class OpeningBook:
+    def __init__(self):
+        # canonical key -> (move in the canonical frame, value, depth)
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def load(cls, path=DEFAULT_BOOK):
+        """
+        Reads a book file.
+
+        :return: the OpeningBook, empty if the file does not exist
+        """
+        book = cls()
+        if not os.path.isfile(path):
+            return book
+        with open(path, "rb") as file:
+            data = file.read()
+        magic, version, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION or len(data) != HEADER_SIZE + count * ENTRY.size:
+            raise ValueError(f"{path} is not an opening book")
+        for key, move, value, depth in ENTRY.iter_unpack(data[HEADER_SIZE:]):
+            book.entries[key] = unpack_move(move), value, depth
+        return book
+
+    def save(self, path=DEFAULT_BOOK):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(self.entries)))
+            for key in sorted(self.entries):
+                move, value, depth = self.entries[key]
+                file.write(ENTRY.pack(key, pack_move(move), value, depth))
+
+    def add(self, position, move, value, depth):
+        """Records the move to play in position, keeping the deepest search when there already is one."""
+        key, symmetry = canonical_key(position)
+        stored = self.entries.get(key)
+        if stored is None or stored[2] < depth:
+            self.entries[key] = transform_move(move, symmetry), value, depth
+
+    def probe(self, position):
+        """
+        Looks a position up.
+
+        :return: the (start, end, removed) move to play in position, None if the book does not know it
+        """
+        key, symmetry = canonical_key(position)
+        stored = self.entries.get(key)
+        if stored is None:
+            return None
+        return transform_move(stored[0], INVERSES[symmetry])
+
+
+def build(moves, depth, log=print):
+    """
+    Builds a book by searching every position black can reach in its first moves.
+
+    :param moves: black moves to cover
+    :param depth: depth of the search in each position
+    :return: the OpeningBook
+    """
+    from services.ai import AIPLayer
+
+    class _Game:
+        # the AI only asks the game for the position to search
+        position = None
+
+        def get_position(self, turn):
+            return self.position.copy()
+
+    game = _Game()
+    ai = AIPLayer(game, "book", max_depth=depth)
+    book = OpeningBook()
+    frontier = [Position.from_string(START_POSITION)]
+    for move_number in range(1, moves + 1):
+        start = perf_counter()
+        # the positions after every white move, one per canonical form
+        replies = {}
+        for position in frontier:
+            for move in position.generate_moves(captures=True):
+                token = position.make_move(move)
+                replies.setdefault(canonical_key(position)[0], position.copy())
+                position.unmake_move(token)
+        frontier = []
+        for position in replies.values():
+            if position.in_hand[2] == 0 or position.is_lost(2):
+                continue
+            game.position = position
+            ai.minimax_decision(placing=True)
+            move = ai.last_search_move
+            book.add(position, move, ai.best_value, depth)
+            position.make_move(move)
+            frontier.append(position)
+        log(f"move {move_number}: {len(replies)} positions in {perf_counter() - start:.1f}s")
+    return book
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Build the opening book by searching the first black moves.")
+    parser.add_argument("--moves", type=int, default=3, help="black moves to cover")
+    parser.add_argument("--depth", type=int, default=5, help="search depth in each position")
+    parser.add_argument("--out", default=DEFAULT_BOOK, help="file to write the book to")
+    options = parser.parse_args(args)
+    book = build(options.moves, options.depth)
+    book.save(options.out)
+    print(f"{len(book)} positions written to {options.out}")
+
+
+if __name__ == "__main__":
+    main()
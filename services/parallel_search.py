@@ -0,0 +1,176 @@
+"""
+Root-parallel search
+
+Splits the moves of the root over a pool of worker processes. Each worker has
+its own AIPLayer (and transposition table) and searches the position after
+one root move. The best value found so far at the root is kept in a shared
+multiprocessing.Value: a worker starts each subtree with it as alpha, so a
+root move that cannot beat the best one is cut off as early as in the
+sequential search.
+
+The first root move (the best of the previous iteration) is searched alone
+to set a good bound, the others are then searched in parallel. A stop Event
+of the caller is passed on to the workers through a shared
+multiprocessing.Event, so a cancelled search does not wait for the iteration.
+
+Positions travel between processes as text (Position.to_string).
+
+Run from the repository root to measure the speedup per worker count:
+
+    python -m services.parallel_search --depth 5 --workers 1 2 4
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import Event, Value
+from time import perf_counter
+
+from domain.position import Position
+
+# seconds between two looks at the stop Event of the caller while the workers search
+STOP_POLL = 0.02
+
+_alpha = None
+_stop = None
+_ai = None
+
+
+def _init_worker(alpha, stop, ai_options):
+    global _alpha, _stop, _ai
+    # imported here, services.ai imports this module
+    from services.ai import AIPLayer
+    from services.tablebase import Tablebase
+    _alpha = alpha
+    _stop = stop
+    ai_options = dict(ai_options)
+    if ai_options.get("tablebase") is not None:
+        # memory mapped again in this process, the pages of the files are shared
+        ai_options["tablebase"] = Tablebase(ai_options["tablebase"])
+    _ai = AIPLayer(None, "worker", **ai_options)
+
+
+def _search_move(text, move, depth, placing, time_limit, stoppable):
+    """
+    Searches the position after one root move, in a worker.
+
+    :param stoppable: end the search once the shared stop Event is set
+    :return: (move, value, nodes); value is None when the time ran out or the search was stopped
+    """
+    position = Position.from_string(text)
+    position.make_move(move)
+    alpha = _alpha.value
+    value = _ai.search_subtree(position, depth - 1, placing, alpha, float("inf"), time_limit,
+                               _stop if stoppable else None)
+    if value is not None:
+        with _alpha.get_lock():
+            if value > _alpha.value:
+                _alpha.value = value
+    return move, value, _ai.nodes
+
+
+class ParallelSearch:
+    def __init__(self, workers, ai_options):
+        """
+        :param workers: number of worker processes
+        :param ai_options: constructor options of the AIPLayer of each worker, see AIPLayer.process_options
+        """
+        self.workers = workers
+        self.__alpha = Value("d", float("-inf"))
+        self.__stop = Event()
+        self.__pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                          initargs=(self.__alpha, self.__stop, ai_options))
+
+    def search_root(self, root, moves, depth, placing, time_limit=None, stop=None):
+        """
+        Searches the root moves of black (the maximizing AI) in parallel.
+
+        :param root: the Position to search, black to move
+        :param moves: the root moves, best first
+        :param depth: search depth, counting the root move
+        :param time_limit: seconds left, None for no limit
+        :param stop: threading or multiprocessing Event, the workers stop once it is set; None to search to the end
+        :return: (value, best move, nodes), or None if the time ran out or the search was stopped
+                 before every move was searched
+        """
+        text = root.to_string()
+        self.__alpha.value = float("-inf")
+        self.__stop.clear()
+        start = perf_counter()
+        stoppable = stop is not None
+        first = self.results([self.__pool.submit(_search_move, text, moves[0], depth, placing, time_limit,
+                                                 stoppable)], stop)[0]
+        if first[1] is None:
+            return None
+        results = [first]
+        if time_limit is not None:
+            time_limit = max(time_limit - (perf_counter() - start), 0.0)
+        results += self.results([self.__pool.submit(_search_move, text, move, depth, placing, time_limit, stoppable)
+                                 for move in moves[1:]], stop)
+
+        best_value, best_move, nodes = float("-inf"), None, 0
+        for move, value, move_nodes in results:
+            nodes += move_nodes
+            if value is None:
+                return None
+            # ties keep the earlier move, the later ones were searched with a narrower window
+            if value > best_value:
+                best_value, best_move = value, move
+        return best_value, best_move, nodes
+
+    def results(self, futures, stop):
+        # waits for the futures, and tells the workers to stop once the caller's stop is set
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=None if stop is None else STOP_POLL)
+            if stop is not None and stop.is_set():
+                self.__stop.set()
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.__stop.set()
+        self.__pool.shutdown()
+
+
+def benchmark(position, depth, worker_counts, placing):
+    """
+    Times the same search with each worker count.
+
+    :return: list of (workers, seconds, nodes, speedup against the first count)
+    """
+    from services.ai import AIPLayer
+
+    class _Game:
+        # the AI only asks the game for the position to search
+        def get_position(self, turn):
+            return position.copy()
+
+    rows = []
+    for workers in worker_counts:
+        # a one ply search first, so starting the worker processes is not timed
+        ai = AIPLayer(_Game(), "worker", max_depth=1, workers=workers)
+        ai.minimax_decision(placing)
+        ai.max_depth = depth
+        ai.minimax_decision(placing)
+        ai.close()
+        rows.append((workers, ai.search_time, ai.nodes))
+    base = rows[0][1]
+    return [(workers, seconds, nodes, base / seconds if seconds else 0.0) for workers, seconds, nodes in rows]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Measure the speedup of the root-parallel search.")
+    parser.add_argument("--position", default="WW.B..W..B...B.W....B... 2 5 5",
+                        help="position written by Position.to_string, black to move")
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1])
+    options = parser.parse_args(args)
+
+    position = Position.from_string(options.position)
+    placing = position.in_hand[2] > 0
+    print(f"{os.cpu_count()} CPUs, depth {options.depth}")
+    for workers, seconds, nodes, speedup in benchmark(position, options.depth, options.workers, placing):
+        print(f"{workers} workers: {seconds:.3f}s, {nodes} nodes, speedup {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
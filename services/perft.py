@@ -0,0 +1,96 @@
+"""
+Perft: counts the positions reachable in exactly N moves
+
+Perft walks the whole game tree to a fixed depth with the same move generator
+the AI searches with (Position.generate_moves) and counts the leaves. The
+counts only depend on the rules, so they are kept as reference numbers in
+tests/fixtures/perft.json; a change in any of them means the move generator
+changed. The time per run gives the raw move generation speed.
+
+A game that is over (Position.is_lost for the player to move) ends the branch:
+it counts as a leaf only at depth 0, like a mate in chess.
+
+Run from the repository root:
+
+    python -m services.perft --depth 4
+    python -m services.perft --position "WW.B.................... 1 7 8" --depth 3 --divide
+"""
+import argparse
+from time import perf_counter
+
+from domain.position import Position
+from domain.tables import PIECES_PER_PLAYER
+
+START_POSITION = Position(turn=1, white_in_hand=PIECES_PER_PLAYER, black_in_hand=PIECES_PER_PLAYER).to_string()
+
+
+def perft(position, depth, captures=True):
+    """
+    Counts the leaves of the game tree below position.
+
+    :param position: the Position to start from; it is played on and restored
+    :param depth: number of moves
+    :param captures: count each capture as its own move; without it a move that closes a mill takes nothing
+    :return: the number of leaves
+    """
+    if depth == 0:
+        return 1
+    if position.is_lost(position.turn):
+        return 0
+    moves = position.generate_moves(captures)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        token = position.make_move(move)
+        nodes += perft(position, depth - 1, captures)
+        position.unmake_move(token)
+    return nodes
+
+
+def divide(position, depth, captures=True):
+    """
+    Splits the perft count by first move, to find which move a wrong count comes from.
+
+    :return: dict from move to the number of leaves below it
+    """
+    counts = {}
+    for move in position.generate_moves(captures):
+        token = position.make_move(move)
+        counts[move] = perft(position, depth - 1, captures)
+        position.unmake_move(token)
+    return counts
+
+
+def run(position, depth, captures=True):
+    """
+    Times one perft run.
+
+    :return: (nodes, seconds, nodes per second)
+    """
+    start = perf_counter()
+    nodes = perft(position, depth, captures)
+    seconds = perf_counter() - start
+    return nodes, seconds, nodes / seconds if seconds else 0.0
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Count the leaves of the game tree to a fixed depth.")
+    parser.add_argument("--position", default=START_POSITION, help="position written by Position.to_string")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--no-captures", action="store_true", help="moves that close a mill take nothing")
+    parser.add_argument("--divide", action="store_true", help="print the count below each first move")
+    options = parser.parse_args(args)
+
+    position = Position.from_string(options.position)
+    captures = not options.no_captures
+    if options.divide and options.depth > 0:
+        for move, nodes in divide(position, options.depth, captures).items():
+            print(f"{move}: {nodes}")
+    for depth in range(1, options.depth + 1):
+        nodes, seconds, speed = run(position, depth, captures)
+        print(f"depth {depth}: {nodes} nodes in {seconds:.3f}s ({speed:,.0f} nodes/s)")
+
+
+if __name__ == "__main__":
+    main()
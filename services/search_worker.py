@@ -0,0 +1,88 @@
+"""
+Background search
+
+Runs the decisions of an AIPLayer on a worker thread, so a caller with an
+event loop (the pygame GUI) keeps handling events while the AI thinks. The
+search holds the GIL while it runs, but the interpreter hands it over to
+the other thread every few milliseconds, which is plenty for redrawing a
+status line and reading the mouse.
+
+start returns a concurrent.futures.Future with the move; progress reads the
+depth and node count of the running search, and cancel makes the search
+return the best move of the iterations completed so far.
+
+ponder uses the human's time: once the AI has played, it searches the
+position after the reply the AI expects until the next start (or
+stop_pondering). If the human plays that reply, the AI answers at once with
+the ponder result; after any other move the search starts from the warmed
+transposition table.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+
+class SearchWorker:
+    def __init__(self, ai):
+        """
+        :param ai: the AIPLayer to run; only the worker thread may use it while a search runs
+        """
+        self.ai = ai
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+        self.__stop = Event()
+        self.future = None
+        self.pondering = False
+
+    @property
+    def thinking(self):
+        return self.future is not None and not self.future.done()
+
+    def start(self, placing):
+        """
+        Starts deciding the next move of the AI.
+
+        :return: Future resolving to the move in the legacy format (see AIPLayer.legacy_move)
+        """
+        self.stop_pondering()
+        if self.thinking:
+            raise RuntimeError("The AI is already searching")
+        self.__stop.clear()
+        self.future = self.__executor.submit(self.ai.choose_move, placing, self.__stop)
+        return self.future
+
+    def ponder(self):
+        """
+        Starts searching the position after the predicted reply of the human, call it once the AI has moved.
+
+        :return: Future resolving to the ponder move, None if there is nothing to predict
+        """
+        self.stop_pondering()
+        if self.thinking:
+            raise RuntimeError("The AI is already searching")
+        # predicted on this thread, while the game still holds the position the AI left
+        position = self.ai.ponder_position()
+        if position is None:
+            return None
+        self.__stop.clear()
+        self.pondering = True
+        self.future = self.__executor.submit(self.ai.ponder, position, self.__stop)
+        return self.future
+
+    def stop_pondering(self):
+        """Ends the ponder search, if any, and waits for it so the AI can be used again."""
+        if not self.pondering:
+            return
+        self.__stop.set()
+        self.future.result()
+        self.pondering = False
+
+    def progress(self):
+        """:return: (deepest completed iteration, nodes searched so far) of the running search"""
+        return self.ai.depth_reached, self.ai.nodes
+
+    def cancel(self):
+        """Asks the running search to stop; its future then resolves to the best move found so far."""
+        self.__stop.set()
+
+    def close(self):
+        self.cancel()
+        self.__executor.shutdown()
@@ -0,0 +1,368 @@
+"""
+Game server
+
+Hosts many games at once over TCP, for running the engine as a service. Each
+game is a GameDriver (services.driver); the AI, when it plays, takes black
+(player 2) and its searches run on a bounded process pool so the event loop
+only ever parses lines and applies moves.
+
+The protocol is one line per request and one line per response, ASCII, words
+separated by spaces. Every request starts with a tag chosen by the client, and
+the response to it starts with the same tag, so a client may send requests
+for many games over one connection without waiting; responses come back in
+the order they are ready.
+
+    <tag> new [human]           a game against the AI, or between two clients
+    <tag> place <game> <point>
+    <tag> move <game> <from> <to>
+    <tag> remove <game> <point>
+    <tag> show <game>
+    <tag> close <game>
+    <tag> stats
+
+Points are written like in the console UI, column letter then row: a1 .. g7.
+The answer is
+
+    <tag> ok <game> <state> [<event> ...]
+    <tag> busy                  the AI pool is saturated, nothing was played
+    <tag> error <message>       also for a failed AI move, which ends its game
+
+where state is the board, the player to move, the pieces in hand of white
+and black (as in Position.to_string), then the player to act, 1 if that
+player has to take a piece, and the winner (0 for a draw, - while playing):
+
+    W..B.................... 1 8 8 1 0 -
+
+and events are the driver events as kind:player[:point...], for example
+placed:1:a1 or moved:2:d2:d3. After an action that hands the turn to the AI,
+the AI move is played before answering and its events follow the client's.
+
+Backpressure: at most max_pending AI moves are queued or running; an action
+that would need one more waits up to queue_timeout seconds for a slot and is
+answered busy otherwise. A connection reads at most max_in_flight requests
+ahead of its answers, so a client that does not read stops being read too.
+Timeouts: an AI move that takes longer than move_timeout seconds ends its
+game, and a game without requests for idle_timeout seconds is dropped.
+
+Run from the repository root:
+
+    python -m services.server --port 7878 --workers 4 --ai max_depth=3
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import monotonic
+
+from domain.position import Position
+from services.arena import parse_engine
+from services.driver import GameDriver
+from services.game_exceptions import AdjError, PlayerError
+
+DEFAULT_PORT = 7878
+AI_PLAYER = 2
+DEFAULT_MAX_PLIES = 200
+# AI moves queued or running per pool worker
+PENDING_PER_WORKER = 4
+QUEUE_TIMEOUT = 1.0
+MOVE_TIMEOUT = 30.0
+IDLE_TIMEOUT = 600.0
+MAX_IN_FLIGHT = 64
+COLUMNS = "abcdefg"
+
+logger = logging.getLogger(__name__)
+
+_ai = None
+_book = None
+
+
+def _init_worker(options):
+    global _ai, _book
+    # imported here so a client process does not load the search
+    from services.ai import AIPLayer
+    from services.opening_book import OpeningBook
+    from services.tablebase import Tablebase
+    options = dict(options)
+    use_book = options.pop("book", True)
+    if isinstance(options.get("tablebase"), str):
+        options["tablebase"] = Tablebase(options["tablebase"])
+    _ai = AIPLayer(None, "server", **options)
+    _book = OpeningBook.load() if use_book else None
+
+
+def _ai_move(text):
+    """
+    Decides the move of black in a position, in a worker.
+
+    :param text: the position as Position.to_string, black to move
+    :return: the (start, end, removed) move
+    """
+    ai = _ai
+    root = Position.from_string(text)
+    placing = root.in_hand[AI_PLAYER] > 0
+    if placing and _book is not None:
+        move = _book.probe(root)
+        if move is not None and move in root.generate_moves(captures=True):
+            return move
+    if ai.tablebase is not None and ai.tablebase.covers(root, distances=True):
+        return ai.tablebase.best_move(root)
+    return ai.search(root, placing, None, ai.max_depth, ai.time_limit, ai.node_limit)
+
+
+def parse_point(text):
+    """Reads a point written as column letter and row, like a1; :return: (row, col)."""
+    if len(text) != 2 or text[0].lower() not in COLUMNS or text[1] not in "1234567":
+        raise ValueError(f"Invalid point {text!r}")
+    return int(text[1]), COLUMNS.index(text[0].lower()) + 1
+
+
+def format_point(point):
+    row, col = point
+    return f"{COLUMNS[col - 1]}{row}"
+
+
+def format_event(event):
+    return ":".join([event.kind, str(event.player)] + [format_point(point) for point in event.points])
+
+
+def format_state(driver):
+    winner = "-" if driver.winner is None else str(driver.winner)
+    return f"{driver.position.to_string()} {driver.to_act} {int(driver.awaiting_removal)} {winner}"
+
+
+class _HostedGame:
+    def __init__(self, ai, max_plies):
+        self.driver = GameDriver(max_plies=max_plies)
+        self.ai = ai
+        # one request at a time per game, the answers keep the order of the requests
+        self.lock = asyncio.Lock()
+        self.last_active = monotonic()
+
+
+class GameServer:
+    def __init__(self, workers=1, ai_options=None, max_pending=None, queue_timeout=QUEUE_TIMEOUT,
+                 move_timeout=MOVE_TIMEOUT, idle_timeout=IDLE_TIMEOUT, max_plies=DEFAULT_MAX_PLIES,
+                 max_in_flight=MAX_IN_FLIGHT):
+        """
+        :param workers: processes searching the AI moves
+        :param ai_options: AIPLayer constructor options of the AI, plus book=False to skip the opening book;
+                           tablebase may be the directory of the tables
+        :param max_pending: AI moves queued or running at most, PENDING_PER_WORKER per worker by default
+        :param queue_timeout: seconds an action waits for a free slot before it is answered busy
+        :param move_timeout: seconds an AI move may take before its game is ended
+        :param idle_timeout: seconds without requests before a game is dropped
+        :param max_plies: plies before a game is drawn
+        :param max_in_flight: requests of one connection read ahead of their answers
+        """
+        self.workers = workers
+        self.ai_options = dict(ai_options or {})
+        self.max_pending = max_pending if max_pending is not None else PENDING_PER_WORKER * workers
+        self.queue_timeout = queue_timeout
+        self.move_timeout = move_timeout
+        self.idle_timeout = idle_timeout
+        self.max_plies = max_plies
+        self.max_in_flight = max_in_flight
+        self.games = {}
+        self.__ids = itertools.count(1)
+        self.__pool = None
+        self.__slots = None
+        self.__server = None
+        self.__reaper = None
+        # counters reported by the stats command
+        self.pending = 0
+        self.ai_moves = 0
+        self.busy = 0
+        self.timeouts = 0
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT):
+        """Starts the pool and listens; port 0 picks a free port, see address."""
+        self.__pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                          initargs=(self.ai_options,))
+        # the workers are started before listening: a forked worker would hold on to the sockets open then,
+        # and a client that disconnects would never be read to the end
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.__pool, int) for _ in range(self.workers)))
+        self.__slots = asyncio.Semaphore(self.max_pending)
+        self.__server = await asyncio.start_server(self.handle_connection, host, port)
+        self.__reaper = asyncio.create_task(self.reap_idle_games())
+
+    @property
+    def address(self):
+        return self.__server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        async with self.__server:
+            await self.__server.serve_forever()
+
+    async def close(self):
+        self.__reaper.cancel()
+        self.__server.close()
+        await self.__server.wait_closed()
+        self.__pool.shutdown(cancel_futures=True)
+
+    async def reap_idle_games(self):
+        while True:
+            await asyncio.sleep(min(self.idle_timeout, 60.0))
+            expired = monotonic() - self.idle_timeout
+            for game_id in [game_id for game_id, game in self.games.items()
+                            if game.last_active < expired and not game.lock.locked()]:
+                del self.games[game_id]
+
+    async def handle_connection(self, reader, writer):
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        try:
+            while True:
+                await in_flight.acquire()
+                line = await reader.readline()
+                if not line:
+                    in_flight.release()
+                    break
+                task = asyncio.create_task(self.answer(line, writer, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def answer(self, line, writer, in_flight):
+        try:
+            words = line.decode("ascii", "replace").split()
+            if not words:
+                return
+            tag = words[0]
+            try:
+                response = await self.request(words[1:])
+            except (ValueError, AdjError, PlayerError) as error:
+                response = f"error {error}"
+            except Exception as error:
+                # a bug or a broken AI pool: answered, so the other games of the connection go on
+                logger.exception("Request %r failed", " ".join(words))
+                response = f"error internal {type(error).__name__}"
+            writer.write(f"{tag} {response}\n".encode())
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            in_flight.release()
+
+    async def request(self, words):
+        """
+        Runs one request, without its tag.
+
+        :return: the response, without the tag
+        """
+        if not words:
+            raise ValueError("Missing command")
+        command, args = words[0].lower(), words[1:]
+        if command == "new":
+            game = _HostedGame(ai=args[:1] != ["human"], max_plies=self.max_plies)
+            game_id = next(self.__ids)
+            self.games[game_id] = game
+            return f"ok {game_id} {format_state(game.driver)}"
+        if command == "stats":
+            return f"ok games={len(self.games)} pending={self.pending} ai_moves={self.ai_moves} " \
+                   f"busy={self.busy} timeouts={self.timeouts}"
+        if command not in ("place", "move", "remove", "show", "close"):
+            raise ValueError(f"Unknown command {command!r}")
+        if not args or not args[0].isdigit() or int(args[0]) not in self.games:
+            raise ValueError("Unknown game")
+        game_id = int(args[0])
+        game = self.games[game_id]
+        game.last_active = monotonic()
+        if command == "close":
+            # an action in flight for the game is answered before it is dropped
+            async with game.lock:
+                self.games.pop(game_id, None)
+            return f"ok {game_id}"
+        async with game.lock:
+            if self.games.get(game_id) is not game:
+                raise ValueError("Unknown game")
+            if command == "show":
+                return f"ok {game_id} {format_state(game.driver)}"
+            return await self.play(game_id, game, command, [parse_point(arg) for arg in args[1:]])
+
+    def release_slot(self):
+        self.pending -= 1
+        self.__slots.release()
+
+    async def play(self, game_id, game, command, points):
+        driver = game.driver
+        expected = {"place": 1, "move": 2, "remove": 1}[command]
+        if len(points) != expected:
+            raise ValueError(f"{command} takes {expected} point{'s' if expected > 1 else ''}")
+        if game.ai and driver.to_act == AI_PLAYER:
+            raise PlayerError(f"It is the turn of player {AI_PLAYER}")
+        slot = False
+        if game.ai and not driver.over:
+            # the slot is taken before the action, so a busy answer leaves the game as it was
+            try:
+                await asyncio.wait_for(self.__slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.busy += 1
+                return "busy"
+            self.pending += 1
+            slot = True
+        try:
+            events = getattr(driver, command)(*points)
+            if slot and not driver.over and driver.to_act == AI_PLAYER:
+                future = asyncio.get_running_loop().run_in_executor(self.__pool, _ai_move,
+                                                                    driver.position.to_string())
+                # the slot is freed when the worker is done, also after a timeout
+                future.add_done_callback(lambda _: self.release_slot())
+                slot = False
+                try:
+                    move = await asyncio.wait_for(asyncio.shield(future), self.move_timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    self.games.pop(game_id, None)
+                    return f"error AI move timed out, game {game_id} ended"
+                except Exception:
+                    # the AI did not move, the game cannot go on
+                    self.games.pop(game_id, None)
+                    raise
+                events += driver.play(move)
+                self.ai_moves += 1
+        finally:
+            if slot:
+                self.release_slot()
+        return " ".join([f"ok {game_id} {format_state(driver)}"] + [format_event(event) for event in events])
+
+
+async def _serve(options):
+    server = GameServer(options.workers, parse_engine("minimax:" + options.ai)[1], options.max_pending, options.queue_timeout,
+                        options.move_timeout, options.idle_timeout, options.max_plies)
+    await server.start(options.host, options.port)
+    host, port = server.address
+    print(f"Serving on {host}:{port} with {options.workers} AI workers")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Host games against the AI over a line protocol.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="AI search processes")
+    parser.add_argument("--ai", default="", help="AIPLayer options as option=value,..., e.g. max_depth=3")
+    parser.add_argument("--max-pending", type=int, default=None, help="AI moves queued or running at most")
+    parser.add_argument("--queue-timeout", type=float, default=QUEUE_TIMEOUT)
+    parser.add_argument("--move-timeout", type=float, default=MOVE_TIMEOUT)
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT)
+    parser.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES)
+    options = parser.parse_args(args)
+    try:
+        asyncio.run(_serve(options))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
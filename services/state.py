@@ -1,17 +1,18 @@
-from copy import deepcopy
 from services.game import Game
 INF = 1000000000
 
 class State(object):
-    def __init__(self, board, game, parent, player, nextstate=None):
+    def __init__(self, board, game, parent, player, nextstate=None, move=None):
         if nextstate is None:
             nextstate = []
 
+        # board is a bitboard Position whose turn is player
         self.board = board
         self.__game = game
         self.parent = parent
         self.nextstate = nextstate
         self.player = player
+        self.move = move
 
     def is_terminal_state(self):
         ai_lose = not self.__game.check_moves_left(player=1)
@@ -25,18 +26,14 @@ class State(object):
         return INF
 
     def next_states_place(self):
-        for pos in self.__game._VALID_POSITIONS():
-            boardcopy = deepcopy(self.board)
-            if self.player == 1:
-                boardcopy[pos[0]][pos[1]] = 1
-            else:
-                boardcopy[pos[0]][pos[1]] = 2
-            self.nextstate.append(State(boardcopy, self.__game, pos, player=3 - self.player, self))
+        self.__expand()
 
     def next_states_move(self):
-        for pos in self.__game._VALID_POSITIONS():
-            for move in self.__game.(pos):
-                boardcopy = deepcopy(self.board)
-                boardcopy[move[0]][move[1]] = self.player
-                boardcopy[pos[0]][pos[1]] = 0
-                self.nextstate.append(State(boardcopy, self.__game, move, player=3 - self.player, self))
+        self.__expand()
+
+    def __expand(self):
+        # play each move on the parent position and keep a copy of the result, no deepcopy involved
+        for move in self.board.generate_moves():
+            token = self.board.make_move(move)
+            self.nextstate.append(State(self.board.copy(), self.__game, self, 3 - self.player, move=move))
+            self.board.unmake_move(token)
@@ -0,0 +1,567 @@
+"""
+Endgame tablebases
+
+Solves the positions where both players have placed all their pieces and
+have between three and a configurable number of pieces each, by retrograde
+analysis: the result of every position (win, loss or draw for the player to
+move) and the number of plies to that result with best play.
+
+Positions are stored from the point of view of the player to move, so the
+table of (m, o) holds every position where the player to move has m pieces
+and the other player o, whichever color they are.
+
+Files
+
+Each table is written as a WDL file (m_o.wdl, the result only, 2 bits a
+position) and, optionally, a DTM file (m_o.dtm, one byte a position: 0 for a
+draw, or plies + 1, where an odd number of plies is a win for the player to
+move and an even number a loss). Both start with a HEADER_SIZE byte header:
+
+    magic b"NMTB", format version, kind (WDL or DTM), m, o, number of positions
+
+and are opened with mmap, so a probe reads one byte straight from the page
+cache, which every process probing the same files shares.
+
+Index
+
+A position and its 15 images under the board symmetries (domain.symmetry)
+have the same result, so only positions whose mover mask is the smallest of
+its images are stored. The other pieces are ranked among the 24 - m points
+left free by the mover:
+
+    class of the mover mask * C(24 - m, o) + colex rank of the other mask on the free points
+
+Mover masks with symmetries of their own keep the images of the other mask
+that these symmetries produce, so a handful of positions are stored twice.
+
+Generation
+
+A move of the (m, o) table leads to the (o, m) table, or to the (o - 1, m)
+table when it closes a mill and takes a piece, so tables are solved by total
+number of pieces and (m, o) together with (o, m). Solving runs backwards
+from the decided positions: positions are settled in order of distance, and
+each newly settled position settles or counts down its predecessors, found by
+taking moves back with NumPy over the whole frontier at once. The solver
+keeps every table in memory in the unreduced layout
+
+    rank(mover mask) * C(24, o) + rank(other mask)
+
+where rank is the colex rank of a mask among the masks with as many pieces,
+and converts them to the files at the end.
+
+Generate the tables from the repository root (3v3 takes about a minute,
+the 4 piece tables much longer and a few GB of memory):
+
+    python -m services.tablebase --pieces 3 --out tablebases
+
+The rules are the ones of Game (domain.tables ADJ and MILLS).
+"""
+import argparse
+import mmap
+import os
+import struct
+from functools import lru_cache
+from itertools import combinations
+from time import perf_counter
+
+import numpy as np
+
+from domain.tables import POINT_COUNT, ALL_POINTS, MILL_MASKS, POINT_MILL_MASKS, ADJACENT
+from domain.symmetry import SYMMETRY_COUNT, PERMUTATIONS, transform_mask, canonical_mask
+
+WIN = 1
+LOSS = -1
+DRAW = 0
+
+MIN_PIECES = 3
+MAX_PLIES = 254
+
+# file kinds
+WDL = 0
+DTM = 1
+_EXTENSIONS = {WDL: "wdl", DTM: "dtm"}
+
+MAGIC = b"NMTB"
+FORMAT_VERSION = 1
+# magic, version, kind, mover pieces, other pieces, positions
+HEADER = struct.Struct("<4sHBBB7xQ8x")
+HEADER_SIZE = HEADER.size
+
+# 2 bit WDL code -> result
+_WDL_CODES = {DRAW: 0, WIN: 1, LOSS: 2}
+_WDL_RESULTS = (DRAW, WIN, LOSS, DRAW)
+
+# BINOMIAL[n][k]
+BINOMIAL = [[0] * (POINT_COUNT + 2) for _ in range(POINT_COUNT + 2)]
+for _n in range(POINT_COUNT + 2):
+    BINOMIAL[_n][0] = 1
+    for _k in range(1, _n + 1):
+        BINOMIAL[_n][_k] = BINOMIAL[_n - 1][_k - 1] + BINOMIAL[_n - 1][_k]
+
+
+def rank(mask):
+    """The colex rank of a mask among the masks with the same number of pieces."""
+    result = 0
+    k = 1
+    while mask:
+        bit = mask & -mask
+        result += BINOMIAL[bit.bit_length() - 1][k]
+        k += 1
+        mask ^= bit
+    return result
+
+
+def table_size(mover, other):
+    """Number of entries of a table in the unreduced layout the generator works with."""
+    return BINOMIAL[POINT_COUNT][mover] * BINOMIAL[POINT_COUNT][other]
+
+
+def table_name(mover, other, kind=WDL):
+    return f"{mover}_{other}.{_EXTENSIONS[kind]}"
+
+
+def decode(entry):
+    """
+    :param entry: a DTM byte
+    :return: (WIN, LOSS or DRAW for the player to move, plies to the result)
+    """
+    if not entry:
+        return DRAW, 0
+    plies = entry - 1
+    return (WIN if plies % 2 else LOSS), plies
+
+
+@lru_cache(maxsize=None)
+def mover_classes(count):
+    """
+    The masks with count pieces that are the smallest of their images, in increasing order.
+
+    :return: (int64 array of the masks, dict from mask to its class number)
+    """
+    masks, _ = _subsets(count)
+    images = np.array([_transform_masks(masks, symmetry) for symmetry in range(SYMMETRY_COUNT)])
+    classes = np.unique(images.min(axis=0))
+    return classes, {int(mask): number for number, mask in enumerate(classes)}
+
+
+def reduced_size(mover, other):
+    """Number of positions of a table in the files."""
+    return len(mover_classes(mover)[0]) * BINOMIAL[POINT_COUNT - mover][other]
+
+
+def reduced_index(mover_mask, other_mask):
+    """The index of a position in the files, from the masks of the player to move and of the other player."""
+    mover_mask, symmetry = canonical_mask(mover_mask)
+    other_mask = transform_mask(other_mask, symmetry)
+    mover = mover_mask.bit_count()
+    result = mover_classes(mover)[1][mover_mask] * BINOMIAL[POINT_COUNT - mover][other_mask.bit_count()]
+    # colex rank of the other pieces, counting only the points the mover leaves free
+    k = 1
+    while other_mask:
+        bit = other_mask & -other_mask
+        result += BINOMIAL[bit.bit_length() - 1 - (mover_mask & (bit - 1)).bit_count()][k]
+        k += 1
+        other_mask ^= bit
+    return result
+
+
+def _transform_masks(masks, symmetry):
+    # transform_mask over a NumPy array of masks
+    images = np.zeros_like(masks)
+    for index, image in enumerate(PERMUTATIONS[symmetry]):
+        images |= (masks >> index & 1) << image
+    return images
+
+
+def write_table(directory, mover, other, entries, distances=True):
+    """
+    Writes the WDL file, and the DTM file if distances, of one table.
+
+    :param entries: the DTM bytes of the table in the unreduced layout (see decode)
+    """
+    classes, _ = mover_classes(mover)
+    free_count = POINT_COUNT - mover
+    # the o point subsets of the free points, in colex order
+    combos = np.array(list(combinations(range(free_count), other)), dtype=np.int64).reshape(-1, other)
+    binomial = np.array(BINOMIAL, dtype=np.int64)
+    combos = combos[np.argsort(binomial[combos, np.arange(1, other + 1)].sum(axis=1))]
+    mover_ranks = np.array([rank(int(mask)) for mask in classes], dtype=np.int64)
+
+    free = np.array([[index for index in range(POINT_COUNT) if not mask >> index & 1] for mask in classes],
+                    dtype=np.int64)
+    # points of the other pieces, per class and subset, ascending
+    points = free[:, combos]
+    other_ranks = binomial[points, np.arange(1, other + 1)].sum(axis=2)
+    dense = mover_ranks[:, None] * BINOMIAL[POINT_COUNT][other] + other_ranks
+    values = np.asarray(entries)[dense.ravel()]
+
+    plies = values.astype(np.int16) - 1
+    codes = np.where(values == 0, _WDL_CODES[DRAW], np.where(plies % 2 == 1, _WDL_CODES[WIN], _WDL_CODES[LOSS]))
+    codes = np.concatenate((codes.astype(np.uint8), np.zeros(-len(codes) % 4, dtype=np.uint8)))
+    packed = codes[0::4] | codes[1::4] << 2 | codes[2::4] << 4 | codes[3::4] << 6
+
+    os.makedirs(directory, exist_ok=True)
+    files = [(WDL, packed)] + ([(DTM, values.astype(np.uint8))] if distances else [])
+    for kind, data in files:
+        with open(os.path.join(directory, table_name(mover, other, kind)), "wb") as file:
+            file.write(HEADER.pack(MAGIC, FORMAT_VERSION, kind, mover, other, len(values)))
+            file.write(data.tobytes())
+
+
+def _open(path, kind, mover, other):
+    # maps a table file and checks its header
+    with open(path, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, file_kind, file_mover, file_other, positions = HEADER.unpack_from(data)
+    expected = reduced_size(mover, other)
+    size = (positions + 3) // 4 if kind == WDL else positions
+    if (magic != MAGIC or version != FORMAT_VERSION or (file_kind, file_mover, file_other) != (kind, mover, other)
+            or positions != expected or len(data) != HEADER_SIZE + size):
+        data.close()
+        raise ValueError(f"{path} is not a {_EXTENSIONS[kind].upper()} table of {mover}v{other}")
+    return data
+
+
+class Tablebase:
+    def __init__(self, directory):
+        """
+        Opens every table found in directory; the files are memory mapped, not read.
+
+        :param directory: the output directory of the generator
+        """
+        # kept so another process can open the same files, see AIPLayer.process_options
+        self.directory = directory
+        # (mover pieces, other pieces) -> mmap of the WDL and of the DTM file
+        self.tables = {}
+        self.distances = {}
+        self.max_pieces = 0
+        if not os.path.isdir(directory):
+            return
+        for name in sorted(os.listdir(directory)):
+            stem, _, extension = name.partition(".")
+            parts = stem.split("_")
+            kind = {value: key for key, value in _EXTENSIONS.items()}.get(extension)
+            if kind is None or len(parts) != 2 or not all(part.isdigit() for part in parts):
+                continue
+            mover, other = int(parts[0]), int(parts[1])
+            data = _open(os.path.join(directory, name), kind, mover, other)
+            (self.tables if kind == WDL else self.distances)[mover, other] = data
+            self.max_pieces = max(self.max_pieces, mover, other)
+
+    def close(self):
+        for data in list(self.tables.values()) + list(self.distances.values()):
+            data.close()
+        self.tables, self.distances = {}, {}
+
+    def covers(self, position, distances=False):
+        """
+        Checks if the position is in a table: nothing left in hand and the piece counts of a table.
+
+        :param distances: also require the DTM file of the table
+        """
+        if position.in_hand[1] or position.in_hand[2]:
+            return False
+        mover = position.turn
+        counts = position.count(mover), position.count(3 - mover)
+        return counts in (self.distances if distances else self.tables)
+
+    def probe(self, position):
+        """
+        Looks a position up.
+
+        :return: (WIN, LOSS or DRAW for the player to move, plies to the result or None without a DTM file),
+                 None if no table covers it
+        """
+        if not self.covers(position):
+            return None
+        mover = position.turn
+        mover_mask, other_mask = position.masks[mover], position.masks[3 - mover]
+        counts = mover_mask.bit_count(), other_mask.bit_count()
+        index = reduced_index(mover_mask, other_mask)
+        distances = self.distances.get(counts)
+        if distances is not None:
+            return decode(distances[HEADER_SIZE + index])
+        code = self.tables[counts][HEADER_SIZE + (index >> 2)] >> ((index & 3) << 1) & 3
+        return _WDL_RESULTS[code], None
+
+    def best_move(self, position):
+        """
+        Picks the best move of a covered position: the fastest win, else a draw, else the slowest loss.
+        Without the DTM file of a table, every win (and every loss) counts as just as far.
+
+        :return: a (start, end, removed) move, None if the player to move has no move
+        """
+        best, best_score = None, None
+        for move in position.generate_moves(captures=True):
+            token = position.make_move(move)
+            if position.is_lost(position.turn):
+                score = 2 * MAX_PLIES
+            else:
+                result, plies = self.probe(position)
+                if plies is None:
+                    plies = MAX_PLIES
+                # the result of the child is the one of the opponent
+                score = {LOSS: 2 * MAX_PLIES - plies, DRAW: 0, WIN: -2 * MAX_PLIES + plies}[result]
+            position.unmake_move(token)
+            if best_score is None or score > best_score:
+                best, best_score = move, score
+        return best
+
+
+# ---------------------------------------------------------------------------------------------
+# generation
+
+_POINT_MILLS = np.array(POINT_MILL_MASKS, dtype=np.int64)
+# index -> adjacent indices, padded with -1
+_ADJACENT = np.array([list(adjacent) + [-1] * (4 - len(adjacent)) for adjacent in ADJACENT], dtype=np.int64)
+
+
+def _subsets(count):
+    """All masks with count pieces and their colex ranks."""
+    combos = np.array(list(combinations(range(POINT_COUNT), count)), dtype=np.int64)
+    masks = (np.int64(1) << combos).sum(axis=1)
+    binomial = np.array(BINOMIAL, dtype=np.int64)
+    ranks = binomial[combos, np.arange(1, count + 1)].sum(axis=1)
+    return masks, ranks
+
+
+def _bit_index(bits):
+    # index of the single set bit of each value
+    return np.frexp(bits.astype(np.float64))[1] - 1
+
+
+def _nth_bits(masks, count):
+    # the set bits of each mask, lowest first, as a list of count arrays
+    bits = []
+    rest = masks.copy()
+    for _ in range(count):
+        bit = rest & -rest
+        bits.append(bit)
+        rest ^= bit
+    return bits
+
+
+def _in_mill(masks):
+    # bitmask of the pieces that stand in a closed mill
+    points = np.zeros_like(masks)
+    for mill in MILL_MASKS:
+        points |= np.where(masks & mill == mill, mill, 0)
+    return points
+
+
+def _closes_mill(masks, end_bits):
+    # checks if the pieces in masks (the moved piece already on end) form a mill through end
+    lines = _POINT_MILLS[_bit_index(end_bits)]
+    first, second = lines[:, 0], lines[:, 1]
+    return (masks & first == first) | (masks & second == second)
+
+
+class _Generator:
+    def __init__(self, max_pieces, log=print):
+        self.max_pieces = max_pieces
+        self.log = log
+        self.results = {}
+        # mask -> colex rank, for every mask with MIN_PIECES to max_pieces pieces
+        self.rank = np.zeros(1 << POINT_COUNT, dtype=np.int32)
+        # count -> the masks with count pieces, in rank order
+        self.subsets = {}
+        for count in range(MIN_PIECES, max_pieces + 1):
+            masks, ranks = _subsets(count)
+            self.rank[masks] = ranks
+            self.subsets[count] = masks[np.argsort(ranks)]
+
+    def index(self, mover, other, mover_masks, other_masks):
+        return (self.rank[mover_masks].astype(np.int64) * BINOMIAL[POINT_COUNT][other]
+                + self.rank[other_masks])
+
+    def solve_all(self):
+        for total in range(2 * MIN_PIECES, 2 * self.max_pieces + 1):
+            for mover in range(MIN_PIECES, self.max_pieces + 1):
+                other = total - mover
+                if MIN_PIECES <= other <= mover:
+                    start = perf_counter()
+                    self.solve_pair(mover, other)
+                    self.log(f"solved {mover}v{other} in {perf_counter() - start:.1f}s")
+        return self.results
+
+    def solve_pair(self, first, second):
+        # the (first, second) and (second, first) tables, solved together
+        spaces = [(first, second)] if first == second else [(first, second), (second, first)]
+        offsets, total = {}, 0
+        for space in spaces:
+            offsets[space] = total
+            total += table_size(*space)
+        entries = np.zeros(total, dtype=np.uint8)
+        decided = np.zeros(total, dtype=bool)
+        remaining = np.zeros(total, dtype=np.int32)
+        # capture moves: fastest capture win, slowest capture loss, and whether a capture draws
+        capture_win = np.full(total, MAX_PLIES + 1, dtype=np.int32)
+        capture_loss = np.full(total, -1, dtype=np.int32)
+        capture_draw = np.zeros(total, dtype=bool)
+        buckets = {}
+
+        def schedule(plies, indices, win):
+            buckets.setdefault(plies, []).append((indices, win))
+
+        for mover, other in spaces:
+            offset = offsets[mover, other]
+            mover_masks = np.repeat(self.subsets[mover], len(self.subsets[other]))
+            other_masks = np.tile(self.subsets[other], len(self.subsets[mover]))
+            valid = mover_masks & other_masks == 0
+            mover_masks, other_masks = mover_masks[valid], other_masks[valid]
+            indices = offset + self.index(mover, other, mover_masks, other_masks)
+            self.count_children(mover, other, mover_masks, other_masks, indices,
+                                remaining, capture_win, capture_loss, capture_draw)
+            has_capture = (capture_win[indices] <= MAX_PLIES) | (capture_loss[indices] >= 0) | capture_draw[indices]
+            blocked = (remaining[indices] == 0) & ~has_capture
+            schedule(0, indices[blocked], False)
+            wins = capture_win[indices] <= MAX_PLIES
+            for plies in np.unique(capture_win[indices[wins]]):
+                schedule(int(plies), indices[wins & (capture_win[indices] == plies)], True)
+            # every move captures and every capture loses
+            only_losses = (remaining[indices] == 0) & has_capture & ~wins & ~capture_draw[indices]
+            for plies in np.unique(capture_loss[indices[only_losses]]):
+                schedule(int(plies) + 1, indices[only_losses & (capture_loss[indices] == plies)], False)
+
+        plies = 0
+        while buckets:
+            if plies > MAX_PLIES:
+                raise OverflowError(f"{first}v{second}: distances beyond {MAX_PLIES} plies")
+            frontier = []
+            for indices, win in buckets.pop(plies, ()):
+                indices = np.unique(indices[~decided[indices]])
+                decided[indices] = True
+                entries[indices] = plies + 1
+                frontier.append((indices, win))
+            for indices, win in frontier:
+                if len(indices):
+                    self.settle_parents(spaces, offsets, indices, win, plies, decided, remaining,
+                                        capture_win, capture_loss, capture_draw, schedule)
+            plies += 1
+
+        for space in spaces:
+            offset = offsets[space]
+            self.results[space] = entries[offset:offset + table_size(*space)]
+
+    def count_children(self, mover, other, mover_masks, other_masks, indices,
+                       remaining, capture_win, capture_loss, capture_draw):
+        # counts the quiet moves of every position and looks the captures up in the smaller tables
+        empty = ALL_POINTS & ~(mover_masks | other_masks)
+        removable = other_masks & ~_in_mill(other_masks)
+        removable = np.where(removable == 0, other_masks, removable)
+        other_bits = _nth_bits(other_masks, other)
+        for start in _nth_bits(mover_masks, mover):
+            if mover == MIN_PIECES:
+                targets = [np.full_like(start, 1 << point) for point in range(POINT_COUNT)]
+            else:
+                adjacent = _ADJACENT[_bit_index(start)]
+                targets = [np.where(adjacent[:, k] >= 0, np.int64(1) << np.maximum(adjacent[:, k], 0), 0)
+                           for k in range(4)]
+            for end in targets:
+                legal = (end & empty) != 0
+                moved = mover_masks ^ start ^ end
+                closes = legal & _closes_mill(moved, np.where(legal, end, 1))
+                remaining[indices] += (legal & ~closes)
+                if not closes.any():
+                    continue
+                for piece in other_bits:
+                    takes = closes & (removable & piece != 0)
+                    if not takes.any():
+                        continue
+                    at = indices[takes]
+                    if other - 1 < MIN_PIECES:
+                        np.minimum.at(capture_win, at, 1)
+                        continue
+                    table = self.results[other - 1, mover]
+                    child = table[self.index(other - 1, mover, (other_masks ^ piece)[takes], moved[takes])]
+                    child_plies = child.astype(np.int32) - 1
+                    draw = child == 0
+                    child_wins = ~draw & (child_plies % 2 == 1)
+                    child_loses = ~draw & ~child_wins
+                    capture_draw[at[draw]] = True
+                    np.minimum.at(capture_win, at[child_loses], child_plies[child_loses] + 1)
+                    np.maximum.at(capture_loss, at[child_wins], child_plies[child_wins])
+
+    def settle_parents(self, spaces, offsets, indices, win, plies, decided, remaining,
+                       capture_win, capture_loss, capture_draw, schedule):
+        # takes back every quiet move that leads to the newly settled positions
+        for space in spaces:
+            offset = offsets[space]
+            size = table_size(*space)
+            mine = indices[(indices >= offset) & (indices < offset + size)] - offset
+            if not len(mine):
+                continue
+            mover, other = space
+            columns = BINOMIAL[POINT_COUNT][other]
+            waiting = self.subsets[mover][mine // columns]
+            moved = self.subsets[other][mine % columns]
+            parents = self.parents(other, mover, moved, waiting)
+            if not len(parents):
+                continue
+            parents = parents + offsets[other, mover]
+            if win:
+                # a parent with no other way out loses
+                np.add.at(remaining, parents, -1)
+                parents = np.unique(parents)
+                lost = ((remaining[parents] == 0) & ~decided[parents] & (capture_win[parents] > MAX_PLIES)
+                        & ~capture_draw[parents])
+                parents = parents[lost]
+                last = np.maximum(plies, capture_loss[parents]) + 1
+                for distance in np.unique(last):
+                    schedule(int(distance), parents[last == distance], False)
+            else:
+                schedule(plies + 1, parents[~decided[parents]], True)
+
+    def parents(self, mover, other, moved, waiting):
+        """
+        Takes back the quiet moves that lead to the given positions.
+
+        :param mover: pieces of the player who moved
+        :param other: pieces of the player now to move
+        :param moved: masks of the player who moved, after the move
+        :param waiting: masks of the player now to move
+        :return: indices of the positions before the move, in the (mover, other) table
+        """
+        occupied = moved | waiting
+        found = []
+        for end in _nth_bits(moved, mover):
+            # a move that closes a mill takes a piece, it cannot lead here
+            quiet = ~_closes_mill(moved, end)
+            if mover == MIN_PIECES:
+                starts = [np.full_like(end, 1 << point) for point in range(POINT_COUNT)]
+            else:
+                adjacent = _ADJACENT[_bit_index(end)]
+                starts = [np.where(adjacent[:, k] >= 0, np.int64(1) << np.maximum(adjacent[:, k], 0), 0)
+                          for k in range(4)]
+            for start in starts:
+                legal = quiet & (start & occupied == 0) & (start != 0)
+                if legal.any():
+                    before = (moved ^ end ^ start)[legal]
+                    found.append(self.index(mover, other, before, waiting[legal]))
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+
+def generate(max_pieces, directory, distances=True, log=print):
+    """
+    Solves every table up to max_pieces pieces a side and writes them to directory.
+
+    :param distances: also write the DTM files
+    :return: the solved tables, a dict from (mover pieces, other pieces) to the entries in the unreduced layout
+    """
+    results = _Generator(max_pieces, log).solve_all()
+    for (mover, other), entries in results.items():
+        write_table(directory, mover, other, entries, distances)
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Solve the endgames of the moving and flying phases.")
+    parser.add_argument("--pieces", type=int, default=MIN_PIECES, help="most pieces a side")
+    parser.add_argument("--out", default="tablebases", help="directory to write the tables to")
+    parser.add_argument("--no-dtm", action="store_true", help="write the WDL files only")
+    options = parser.parse_args(args)
+    generate(options.pieces, options.out, not options.no_dtm)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Transposition table for the AI search
+
+The table is a fixed block of memory sized in MB. Each entry takes two 64-bit
+words: the Zobrist key xor-ed with the data word, and the data word itself,
+which packs the value, the searched depth, the bound type and the best move.
+Storing the key xor-ed with the data lets a probe detect an entry whose two
+words do not belong together, so the same layout can later be shared between
+processes without locking.
+
+Replacement is depth-preferred: an entry is only overwritten by a search of
+the same position or by one that went at least as deep.
+"""
+from array import array
+
+EXACT = 0
+LOWER = 1  # the value is a lower bound (the search failed high)
+UPPER = 2  # the value is an upper bound (the search failed low)
+
+ENTRY_SIZE = 16  # bytes per entry
+
+_KEY_MASK = (1 << 64) - 1
+_VALUE_OFFSET = 1 << 31
+_NO_POINT = 31
+
+
+def pack_move(move):
+    """Packs a (start, end, removed) move into 15 bits, 5 per field."""
+    if move is None:
+        return 0
+    start, end, removed = move
+    return ((_NO_POINT if start is None else start) << 10 | end << 5 |
+            (_NO_POINT if removed is None else removed)) + 1
+
+
+def unpack_move(packed):
+    if not packed:
+        return None
+    packed -= 1
+    start, end, removed = packed >> 10, packed >> 5 & 31, packed & 31
+    return (None if start == _NO_POINT else start), end, (None if removed == _NO_POINT else removed)
+
+
+def entry_count(size_mb):
+    """The number of entries of a table of size_mb MB: the largest power of two that fits."""
+    entries = 1
+    while entries * 2 * ENTRY_SIZE <= size_mb * 1024 * 1024:
+        entries *= 2
+    return entries
+
+
+def table_bytes(size_mb):
+    """The size of the buffer a table of size_mb MB needs, e.g. for shared memory."""
+    return entry_count(size_mb) * ENTRY_SIZE
+
+
+class TranspositionTable:
+    def __init__(self, size_mb=16, buffer=None):
+        """
+        :param size_mb: memory for the entries, in MB
+        :param buffer: optional writable buffer to keep the entries in, at least table_bytes(size_mb) long;
+                       by default the table owns a bytearray
+        """
+        entries = entry_count(size_mb)
+        self.size = entries
+        self._mask = entries - 1
+        if buffer is None:
+            buffer = bytearray(entries * ENTRY_SIZE)
+        self._words = memoryview(buffer)[:entries * ENTRY_SIZE].cast("Q")
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def probe(self, key):
+        """
+        Looks a position up.
+
+        :param key: the Zobrist key of the position
+        :return: (depth, value, bound, move) or None when the position is not stored
+        """
+        slot = (key & self._mask) << 1
+        data = self._words[slot + 1]
+        if not data or self._words[slot] ^ data != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return (data >> 32 & 0xFF, (data & 0xFFFFFFFF) - _VALUE_OFFSET,
+                data >> 40 & 3, unpack_move(data >> 42 & 0x7FFF))
+
+    def store(self, key, depth, value, bound, move=None):
+        slot = (key & self._mask) << 1
+        words = self._words
+        old_data = words[slot + 1]
+        if old_data and words[slot] ^ old_data != key and old_data >> 32 & 0xFF > depth:
+            return
+        value = min(max(int(value), -_VALUE_OFFSET + 1), _VALUE_OFFSET - 1)
+        data = (value + _VALUE_OFFSET) | depth << 32 | bound << 40 | pack_move(move) << 42
+        words[slot] = (key ^ data) & _KEY_MASK
+        words[slot + 1] = data
+        self.stores += 1
+
+    def release(self):
+        """Lets go of the buffer, a shared memory block can only be closed once no table uses it."""
+        self._words.release()
+
+    def clear(self):
+        self._words[:] = array("Q", bytes(len(self._words) * 8))
+        self.hits = self.misses = self.stores = 0
+
+    def stats(self):
+        probes = self.hits + self.misses
+        return {
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": self.hits / probes if probes else 0.0,
+        }
@@ -1,9 +1,41 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
+import numpy as np
 from domain.board import Board
 from services.computer_player import SmartComputer
-from services.game import Game
+from services.game import Game, MILL_HISTORY_SIZE
 from services.ai import AIPLayer
+from services.state import State
 from services.game_exceptions import AdjError
+from domain.position import Position, PLACING, MOVING, FLYING
+from domain.tables import POINTS, POINT_INDEX, POINT_MILLS, ADJACENT, ADJACENT_MASKS, MILL_MASKS
+from domain.zobrist import zobrist_key
+from domain.features import features, MILLS, TWOS, BLOCKED, MOBILITY
+from multiprocessing.shared_memory import SharedMemory
+from services.transposition import TranspositionTable, EXACT, LOWER, table_bytes
+from services.move_ordering import MoveOrderer
+from services.parallel_search import ParallelSearch
+from services.lazy_smp import LazySMP
+from services.perft import perft, divide
+from services.batch_eval import encode, batch_features
+from services.opening_book import OpeningBook, build
+from services.arena import parse_engine, play_game, run_match, elo_difference
+from services.driver import GameDriver, Event, PLACED, MOVED, MILL, REMOVED, TURN, GAME_OVER
+from services.search_worker import SearchWorker
+from services.server import GameServer, parse_point, format_point
+from services.load_test import run_load_test
+from services.engine import Engine, parse_move, format_move
+from services.game_exceptions import PlayerError
+from services.tablebase import (Tablebase, WIN, LOSS, DRAW, BINOMIAL, MAX_PLIES, rank, table_size, decode,
+                                reduced_index, reduced_size, write_table, generate)
+from domain.symmetry import (SYMMETRY_COUNT, PERMUTATIONS, INVERSES, transform_mask, transform_move,
+                             transform_position, canonical_key)
 
 
 class MockGraphicMode:
@@ -90,6 +122,29 @@ class TestNineMensMorris(unittest.TestCase):
         self.game.place_piece(7, 4, 1, "human_vs_human")
         assert self.game.check_mill(self.board._data, 7, 7, 1) == False
 
+    def test_check_mill_is_pure(self):
+        """Test that querying mills does not change the board or the mill history."""
+        self.game.place_piece(7, 1, 1, "human_vs_human")
+        self.game.place_piece(7, 4, 1, "human_vs_human")
+        board_state = [row[:] for row in self.board._data]
+        board_state[7][7] = 1
+        for _ in range(3):
+            self.assertTrue(self.game.check_mill(board_state, 7, 7, 1))
+        self.assertEqual(self.board._data[7][7], 0)
+        self.assertEqual(len(self.game.mill_history), 0)
+
+    def test_mill_history(self):
+        """Test that formed mills are recorded once and the record is bounded."""
+        self.game.place_piece(3, 3, 2, "human_vs_human")
+        self.game.place_piece(7, 1, 1, "human_vs_human")
+        self.game.place_piece(7, 4, 1, "human_vs_human")
+        self.game.place_piece(7, 7, 1, "human_vs_human")  # the mock removes the black piece at (3, 3)
+        self.assertEqual(list(self.game.mill_history), [(1, ((7, 1), (7, 4), (7, 7)))])
+        self.game.valid_remove_piece(2)
+        self.game.pieces_outside_mill(1)
+        self.assertEqual(len(self.game.mill_history), 1)
+        self.assertEqual(self.game.mill_history.maxlen, MILL_HISTORY_SIZE)
+
     def test_pieces_outside_mill(self):
         """Test if pieces are correctly identified as outside mills."""
         self.game.place_piece(3, 3, 2, "human_vs_human")
@@ -114,5 +169,755 @@ class TestNineMensMorris(unittest.TestCase):
         self.ai.place_on_board()
         self.assertEqual(len(self.game.white_pieces), 1)  # AI should have removed a white piece
 
+    def test_board_masks_follow_updates(self):
+        """Test that the bitboard masks mirror the 8x8 grid."""
+        self.game.place_piece(1, 1, 1, "human_vs_human")
+        self.game.place_piece(4, 2, 2, "human_vs_human")
+        self.game.move_piece(1, 1, 1, 4, 1, "human_vs_human")
+        self.assertEqual(self.board.masks[1], 1 << POINT_INDEX[(1, 4)])
+        self.assertEqual(self.board.masks[2], 1 << POINT_INDEX[(4, 2)])
+        self.assertEqual(self.game.get_position(1).to_grid(), self.board._data)
+
+    def test_position_snapshot(self):
+        """Test the position snapshot taken from the game."""
+        self.game.place_piece(7, 1, 1, "human_vs_human")
+        self.game.place_piece(7, 4, 1, "human_vs_human")
+        position = self.game.get_position(2)
+        self.assertEqual(position.in_hand[1:], [7, 9])
+        self.assertEqual(position.phase(), PLACING)
+        self.assertTrue(position.forms_mill(POINT_INDEX[(7, 7)], 1))
+        self.assertFalse(position.forms_mill(POINT_INDEX[(7, 7)], 2))
+
+        child = position.copy()
+        child.place(POINT_INDEX[(7, 7)], 2)
+        self.assertEqual(position.count(2), 0)
+        self.assertEqual(child.count(2), 1)
+        self.assertEqual(child.in_hand[2], 8)
+
+    def test_position_phases(self):
+        """Test the phase of each player in a bitboard position."""
+        position = Position(white=0b111, black=0b111000 | 1 << 20, turn=1)
+        self.assertEqual(position.phase(1), FLYING)
+        self.assertEqual(position.phase(2), MOVING)
+        self.assertTrue(position.in_mill(0, 1))
+        self.assertFalse(position.in_mill(20, 2))
+
+    def test_geometry_tables(self):
+        """Test the precomputed point tables."""
+        self.assertEqual(len(POINTS), 24)
+        for index, point in enumerate(POINTS):
+            self.assertEqual(POINT_INDEX[point], index)
+            self.assertEqual(len(POINT_MILLS[index]), 2)
+            self.assertTrue(all(point in mill for mill in POINT_MILLS[index]))
+            self.assertTrue(all(index in ADJACENT[adj] for adj in ADJACENT[index]))
+
+    def test_valid_remove_piece(self):
+        """Test that pieces in a mill are protected while others are left."""
+        self.game.place_piece(7, 1, 1, "human_vs_human")
+        self.game.place_piece(7, 4, 1, "human_vs_human")
+        self.game.place_piece(2, 2, 1, "human_vs_human")
+        self.assertEqual(self.game.valid_remove_piece(2), [(7, 1), (7, 4), (2, 2)])
+        self.game._board.update(2, 2, 0)
+        self.game._white_pieces.remove((2, 2))
+        self.game._board.update(7, 7, 1)
+        self.game._white_pieces.append((7, 7))
+        self.assertEqual(self.game.valid_remove_piece(2), [(7, 1), (7, 4), (7, 7)])
+        self.game._board.update(3, 3, 1)
+        self.game._white_pieces.append((3, 3))
+        self.assertEqual(self.game.valid_remove_piece(2), [(3, 3)])
+
+    def test_check_moves_left(self):
+        """Test move detection for a blocked player."""
+        self.game.place_piece(1, 1, 2, "human_vs_human")
+        self.game.place_piece(1, 4, 1, "human_vs_human")
+        self.game.place_piece(4, 1, 1, "human_vs_human")
+        self.assertFalse(self.game.check_moves_left(2))
+        self.assertTrue(self.game.check_moves_left(1))
+
+    def test_make_unmake_move(self):
+        """Test that make_move/unmake_move round trip for every kind of move."""
+        a1, d1, g1, a4 = (POINT_INDEX[p] for p in ((1, 1), (1, 4), (1, 7), (4, 1)))
+        position = Position(white=1 << a1 | 1 << d1, black=1 << a4, turn=1, white_in_hand=1, black_in_hand=0)
+        before = position.copy()
+        moves = [
+            (None, g1, a4),  # placement closing a mill and taking a piece
+            (a1, a4, None),  # sliding move
+        ]
+        for move in moves:
+            token = position.make_move(move)
+            self.assertEqual(position.turn, 2)
+            self.assertNotEqual(position, before)
+            position.unmake_move(token)
+            self.assertEqual(position, before)
+
+        position = Position(white=1 << a1 | 1 << d1 | 1 << g1, black=0b111 << 9 | 1 << 20, turn=1)
+        before = position.copy()
+        self.assertEqual(position.phase(), FLYING)
+        self.assertEqual(len(position.generate_moves()), 3 * 17)
+        token = position.make_move((a1, 23, 20))  # flying move with a removal
+        self.assertEqual(position.count(2), 3)
+        position.unmake_move(token)
+        self.assertEqual(position, before)
+
+    def test_state_children(self):
+        """Test that State expands children without touching the parent position."""
+        position = self.game.get_position(1)
+        state = State(position, self.game, None, 1)
+        state.next_states_place()
+        self.assertEqual(len(state.nextstate), 24)
+        self.assertEqual(position, self.game.get_position(1))
+        self.assertTrue(all(child.board.count(1) == 1 and child.board.turn == 2 for child in state.nextstate))
+
+    def test_ai_reads_searched_position(self):
+        """Test that the AI helpers only look at the position they are given."""
+        a1, d1, g1 = (POINT_INDEX[p] for p in ((1, 1), (1, 4), (1, 7)))
+        position = Position(white=1 << a1 | 1 << d1 | 1 << g1, black=0b111 << 9 | 1 << 20, turn=1)
+        # the live game is still empty, the position is in the moving/flying phase
+        moves = self.ai.generate_moves(position, player=1, placing=True)
+        self.assertEqual(len(moves), 3 * 17)
+        self.assertEqual(self.ai.calculate_mobility(position, 1), 10 * 2)
+        self.assertFalse(self.ai.is_terminal_state(position))
+        position.remove(a1, 1)
+        self.assertTrue(self.ai.is_terminal_state(position))
+
+    def test_zobrist_key_is_incremental(self):
+        """Test that the key kept by make/unmake matches a key computed from scratch."""
+        position = Position(turn=1, white_in_hand=9, black_in_hand=9)
+        tokens = []
+        for ply in range(30):
+            moves = position.generate_moves()
+            move = moves[(ply * 7) % len(moves)]
+            if position.closes_mill(move[0], move[1], position.turn) and position.masks[3 - position.turn]:
+                removed = (position.masks[3 - position.turn] & -position.masks[3 - position.turn]).bit_length() - 1
+                move = (move[0], move[1], removed)
+            tokens.append(position.make_move(move))
+            self.assertEqual(position.key, zobrist_key(position.masks, position.in_hand, position.turn))
+        for token in reversed(tokens):
+            position.unmake_move(token)
+        self.assertEqual(position.key, Position(turn=1, white_in_hand=9, black_in_hand=9).key)
+
+    def test_transposition_table(self):
+        """Test storing, probing and depth-preferred replacement."""
+        table = TranspositionTable(size_mb=1)
+        self.assertIsNone(table.probe(42))
+        table.store(42, 3, -120, LOWER, (None, 5, 7))
+        self.assertEqual(table.probe(42), (3, -120, LOWER, (None, 5, 7)))
+        colliding = 42 + table.size
+        table.store(colliding, 2, 10, EXACT)  # shallower, the deeper entry stays
+        self.assertIsNone(table.probe(colliding))
+        table.store(colliding, 4, 10, EXACT, (1, 2, None))
+        self.assertEqual(table.probe(colliding), (4, 10, EXACT, (1, 2, None)))
+        self.assertEqual((table.hits, table.misses), (2, 2))
+
+    def test_ai_uses_transposition_table(self):
+        """Test that the AI search fills and hits its transposition table."""
+        ai = AIPLayer(self.game, graphic="gui", hash_size_mb=1)
+        ai.place_on_board()
+        stats = ai.transposition_table.stats()
+        self.assertGreater(stats["stores"], 0)
+        self.assertGreater(stats["hits"], 0)
+
+    def test_ai_iterative_deepening(self):
+        """Test that the AI deepens up to max_depth and stops early on a node budget."""
+        ai = AIPLayer(self.game, graphic="gui", hash_size_mb=1, max_depth=2)
+        move = ai.minimax_decision(True)
+        self.assertIn(move, POINTS)
+        self.assertEqual(ai.depth_reached, 2)
+
+        ai = AIPLayer(self.game, graphic="gui", hash_size_mb=1, node_limit=300)
+        move = ai.minimax_decision(True)
+        self.assertIn(move, POINTS)
+        self.assertGreaterEqual(ai.depth_reached, 1)
+        self.assertLess(ai.depth_reached, ai.max_depth)
+        self.assertLess(ai.nodes, 300 + 256)
+
+    def test_move_ordering(self):
+        """Test the order of the move ordering stages and the cutoff statistics."""
+        # black has 0 and 1 (closing at 2), white has 9 and 10 (closing at 11)
+        position = Position(white=1 << 9 | 1 << 10, black=1 << 0 | 1 << 1, turn=2, white_in_hand=5, black_in_hand=5)
+        orderer = MoveOrderer()
+        orderer.cutoff((None, 20, None), 2, 0, 3, 1)
+        orderer.history[2][24][23] = 1
+        moves = [(None, index, None) for index in (23, 20, 11, 2, 5)]
+        ordered = orderer.order(position, moves, 2, 0, tt_move=(None, 5, None))
+        self.assertEqual(ordered, [(None, 5, None), (None, 2, None), (None, 11, None),
+                                   (None, 20, None), (None, 23, None)])
+        self.assertEqual(orderer.stats()["cutoff_index"], [0, 1])
+
+        ai = AIPLayer(self.game, graphic="gui", hash_size_mb=1)
+        ai.place_on_board()
+        stats = ai.move_orderer.stats()
+        self.assertGreater(stats["cutoffs"], 0)
+        self.assertGreater(stats["first_move_rate"], 0.5)
+
+    def test_capture_moves(self):
+        """Test that a move closing a mill is generated once per piece it may take."""
+        # black closes 0-1-2 by placing on 2; white has the mill 21-22-23 and a loose piece on 9
+        position = Position(white=0b111 << 21 | 1 << 9, black=0b11, turn=2, white_in_hand=3, black_in_hand=3)
+        moves = position.generate_moves(captures=True)
+        self.assertIn((None, 2, 9), moves)
+        self.assertNotIn((None, 2, None), moves)
+        self.assertNotIn((None, 2, 21), moves)
+        self.assertEqual(len(moves), len(position.generate_moves()))
+        position.remove(9, 1)
+        moves = position.generate_moves(captures=True)
+        self.assertEqual([move for move in moves if move[1] == 2], [(None, 2, 21), (None, 2, 22), (None, 2, 23)])
+
+    def test_ai_plays_searched_capture(self):
+        """Test that the AI takes the piece its search chose when it closes a mill while placing."""
+        for row, col, player in ((1, 1, 2), (1, 4, 2), (4, 1, 1), (7, 4, 1)):
+            self.board.update(row, col, player)
+            self.game._placed[player] += 1
+            (self.game._white_pieces if player == 1 else self.game._black_pieces).append((row, col))
+        # one ply deep closing the mill is the only way to win a piece
+        ai = AIPLayer(self.game, graphic="gui", hash_size_mb=1, max_depth=1)
+        self.assertEqual(ai.minimax_decision(True), (1, 7))
+        self.assertIn(ai.best_piece_to_remove(2), [(4, 1), (7, 4)])
+
+    def test_console_game_takes_searched_capture(self):
+        """Test that the console game takes the piece chosen by the search of the AI it was given."""
+        game = Game(self.board, graphic_mode=self.mock_graphic_mode, graphic="ui")
+        for row, col, player in ((1, 1, 2), (1, 4, 2), (2, 2, 2), (5, 5, 2),
+                                 (7, 4, 1), (6, 4, 1), (3, 4, 1), (4, 5, 1)):
+            self.board.update(row, col, player)
+            game._placed[player] += 1
+            (game._white_pieces if player == 1 else game._black_pieces).append((row, col))
+        # the greedy choice of an AI that never searched differs from the searched one here
+        self.assertEqual(game.ai_player.best_piece_to_remove(2), (3, 4))
+        ai = AIPLayer(game, graphic="ui", hash_size_mb=1, max_depth=2)
+        game.ai_player = ai
+        white = set(game.white_pieces)
+        ai.place_on_board()
+        self.assertEqual(white - set(game.white_pieces), {POINTS[ai.last_search_move[2]]})
+
+    def test_features_are_incremental(self):
+        """Test that the feature counts kept by make/unmake match counts from scratch."""
+        position = Position.from_string("WW.B..W..B...B.W....B... 2 5 5")
+        tokens = []
+        for ply in range(40):
+            moves = position.generate_moves(captures=True)
+            if not moves or position.is_lost(position.turn):
+                break
+            tokens.append(position.make_move(moves[(ply * 11) % len(moves)]))
+            self.assertEqual(position.features, features(position.masks[1], position.masks[2]))
+        for token in reversed(tokens):
+            position.unmake_move(token)
+        self.assertEqual(position, Position.from_string("WW.B..W..B...B.W....B... 2 5 5"))
+        self.assertEqual(position.features, features(position.masks[1], position.masks[2]))
+
+        # white: the mill 0-1-2 and 9-10 with 11 free; black: 21-22 with 23 free
+        # 0 and 9 of white and 21 of black have no free neighbour
+        counts = features(0b111 | 1 << 9 | 1 << 10, 1 << 21 | 1 << 22)
+        self.assertEqual((counts[MILLS], counts[MILLS + 1]), (1, 0))
+        self.assertEqual((counts[TWOS], counts[TWOS + 1]), (1, 1))
+        self.assertEqual((counts[BLOCKED], counts[BLOCKED + 1]), (2, 1))
+        self.assertEqual(counts[MOBILITY], self.ai.calculate_mobility(
+            Position(white=0b111 | 1 << 9 | 1 << 10, black=1 << 21 | 1 << 22), 1) // 10)
+
+    def test_batch_evaluation(self):
+        """Test that the NumPy batch gives the same features and values as one position at a time."""
+        positions = []
+        for seed in range(200):
+            points = [(seed * 7 + step * 5) % 24 for step in range(seed % 15)]
+            white = sum(1 << point for point in points[::2])
+            black = sum(1 << point for point in points[1::2]) & ~white
+            positions.append(Position(white, black, 1 + seed % 2, seed % 4, seed % 3))
+        boards, in_hand = encode(positions)
+        self.assertEqual(boards.shape, (200, 24))
+        self.assertEqual(batch_features(boards).tolist(), [position.features for position in positions])
+        for placing in (True, False):
+            values = self.ai.evaluate_batch(positions, placing)
+            self.assertEqual(values.tolist(), [self.ai.evaluate_board(position, placing) for position in positions])
+
+        # evaluating the last ply in one batch does not change the value of the search
+        ai = AIPLayer(self.game, graphic="gui", hash_size_mb=1, max_depth=2)
+        batched = AIPLayer(self.game, graphic="gui", hash_size_mb=1, max_depth=2, batch_leaves=True)
+        ai.minimax_decision(True)
+        batched.minimax_decision(True)
+        self.assertEqual(batched.best_value, ai.best_value)
+
+    def test_parallel_search(self):
+        """Test that splitting the root over worker processes finds the value of the sequential search."""
+        for row, col, player in ((1, 1, 2), (1, 4, 1), (4, 1, 1), (7, 4, 2)):
+            self.board.update(row, col, player)
+            self.game._placed[player] += 1
+        ai = AIPLayer(self.game, graphic="gui", hash_size_mb=1, max_depth=3)
+        parallel = AIPLayer(self.game, graphic="gui", hash_size_mb=1, max_depth=3, workers=2)
+        try:
+            move = parallel.minimax_decision(True)
+        finally:
+            parallel.close()
+        ai.minimax_decision(True)
+        self.assertIn(move, POINTS)
+        self.assertEqual(parallel.depth_reached, 3)
+        self.assertEqual(parallel.best_value, ai.best_value)
+
+        # a stop of the caller reaches the workers in the middle of an iteration
+        stop = threading.Event()
+        stop.set()
+        search = ParallelSearch(2, parallel.process_options())
+        try:
+            root = self.game.get_position(2)
+            self.assertIsNone(search.search_root(root, root.generate_moves(captures=True), 12, True, stop=stop))
+        finally:
+            search.close()
+
+    def test_lazy_smp(self):
+        """Test that tables on one shared memory block see each other and that helpers can join a search."""
+        memory = SharedMemory(create=True, size=table_bytes(1))
+        other = SharedMemory(name=memory.name)
+        try:
+            table, view = TranspositionTable(1, buffer=memory.buf), TranspositionTable(1, buffer=other.buf)
+            table.store(0xC0FFEE, 4, -25, LOWER, (None, 3, None))
+            self.assertEqual(view.probe(0xC0FFEE), (4, -25, LOWER, (None, 3, None)))
+            table.release()
+            view.release()
+        finally:
+            other.close()
+            memory.close()
+            memory.unlink()
+
+        ai = AIPLayer(self.game, graphic="gui", hash_size_mb=1, max_depth=3, smp_helpers=2)
+        try:
+            move = ai.minimax_decision(True)
+        finally:
+            ai.close()
+        self.assertIn(move, POINTS)
+        self.assertEqual(ai.depth_reached, 3)
+
+        # helpers of an AI with a symmetric table store their entries under the canonical keys too
+        root = Position(white=1 << 8, black=1 << 3, turn=2, white_in_hand=8, black_in_hand=8)
+        key, symmetry = canonical_key(root)
+        self.assertNotEqual(symmetry, 0)
+        smp = LazySMP(1, AIPLayer(None, "gui", hash_size_mb=1, symmetric_table=True).process_options())
+        try:
+            smp.start(root, True)
+            for _ in range(6000):
+                if smp.table.probe(key) is not None:
+                    break
+                time.sleep(0.01)
+            smp.stop()
+            self.assertIsNotNone(smp.table.probe(key))
+            self.assertIsNone(smp.table.probe(root.key))
+        finally:
+            smp.close()
+
+    def test_tablebase(self):
+        """Test the tablebase indexing and that the AI plays and searches with a table instead of its evaluation."""
+        self.assertEqual(rank(0b111), 0)
+        self.assertEqual(rank(0b111 << 21), BINOMIAL[24][3] - 1)
+        self.assertEqual(table_size(3, 3), 2024 * 2024)
+        self.assertEqual([decode(entry) for entry in (0, 1, 2, 3)], [(DRAW, 0), (LOSS, 0), (WIN, 1), (LOSS, 2)])
+        self.assertEqual(Tablebase(os.path.join(tempfile.gettempdir(), "no such tablebase")).tables, {})
+
+        # black flies to 2, closes the mill 0-1-2 and wins; the table only knows this position and its images
+        position = Position(white=1 << 8 | 1 << 12 | 1 << 16, black=0b11 | 1 << 5, turn=2)
+        entries = np.zeros(table_size(3, 3), dtype=np.uint8)
+        for symmetry in range(SYMMETRY_COUNT):
+            black, white = transform_mask(position.masks[2], symmetry), transform_mask(position.masks[1], symmetry)
+            entries[rank(black) * BINOMIAL[24][3] + rank(white)] = 2
+        self.assertEqual(reduced_index(position.masks[2], position.masks[1]),
+                         reduced_index(transform_mask(position.masks[2], 5), transform_mask(position.masks[1], 5)))
+        self.assertLess(reduced_size(3, 3), table_size(3, 3) // 16)
+        with tempfile.TemporaryDirectory() as directory:
+            write_table(directory, 3, 3, entries)
+            tablebase = Tablebase(directory)
+            self.assertTrue(tablebase.covers(position, distances=True))
+            self.assertEqual(tablebase.probe(position), (WIN, 1))
+            self.assertEqual(tablebase.probe(Position(white=0b111 << 9, black=0b111 << 18)), (DRAW, 0))
+            self.assertFalse(tablebase.covers(Position(white=0b111, black=0b111 << 3, white_in_hand=1)))
+
+            class _Game:
+                def get_position(self, turn):
+                    return position.copy()
+
+            ai = AIPLayer(_Game(), graphic="gui", hash_size_mb=1, tablebase=tablebase)
+            self.assertEqual(ai.minimax_decision(False), (POINTS[5], POINTS[2]))
+            self.assertEqual((ai.nodes, ai.best_value), (0, 1000000 - 1))
+            # below the root the table answers without searching further
+            self.assertEqual(ai.search_subtree(position, 3, False, float("-inf"), float("inf")), 1000000 - 1)
+            self.assertEqual(ai.nodes, 1)
+            # the workers of the parallel search open the same table
+            move = next(move for move in position.generate_moves(captures=True) if move[2] is None)
+            search = ParallelSearch(1, AIPLayer(None, "gui", hash_size_mb=1, tablebase=tablebase).process_options())
+            try:
+                self.assertEqual(search.search_root(position, [move], 4, False), (0, move, 1))
+            finally:
+                search.close()
+            # the table files are memory mapped, close them before the directory is removed
+            tablebase.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            write_table(directory, 3, 3, entries, distances=False)
+            tablebase = Tablebase(directory)
+            self.assertFalse(tablebase.covers(position, distances=True))
+            self.assertEqual(tablebase.probe(position), (WIN, None))
+            self.assertEqual(AIPLayer(None, "gui", tablebase=tablebase).tablebase_value(position),
+                             1000000 - MAX_PLIES)
+            tablebase.close()
+            with open(os.path.join(directory, "3_3.wdl"), "r+b") as file:
+                file.write(b"XXXX")
+            with self.assertRaises(ValueError):
+                Tablebase(directory)
+
+    def test_tablebase_generation(self):
+        """Test every solved 3v3 result sampled against the results one ply later (solving takes about a minute)."""
+        with tempfile.TemporaryDirectory() as directory:
+            entries = generate(3, directory, log=lambda text: None)[3, 3]
+            tablebase = Tablebase(directory)
+
+            def solved(position):
+                mover = position.turn
+                index = rank(position.masks[mover]) * BINOMIAL[24][3] + rank(position.masks[3 - mover])
+                return decode(entries[index])
+
+            sample = np.random.default_rng(0)
+            seen = set()
+            for _ in range(2000):
+                points = [int(point) for point in sample.choice(24, 6, replace=False)]
+                position = Position(white=sum(1 << point for point in points[:3]),
+                                    black=sum(1 << point for point in points[3:]), turn=int(sample.integers(1, 3)))
+                result, plies = solved(position)
+                seen.add(result)
+                # the files answer like the solver, through the reduced index
+                self.assertEqual(tablebase.probe(position), (result, plies))
+                children = []
+                for move in position.generate_moves(captures=True):
+                    token = position.make_move(move)
+                    # a capture leaves two pieces, lost at once for the side to move
+                    children.append((LOSS, 0) if position.is_lost(position.turn) else solved(position))
+                    position.unmake_move(token)
+                losses = [child_plies for child_result, child_plies in children if child_result == LOSS]
+                if result == WIN:
+                    self.assertEqual(plies, 1 + min(losses))
+                elif result == DRAW:
+                    self.assertEqual(losses, [])
+                    self.assertIn(DRAW, [child_result for child_result, _ in children])
+                else:
+                    self.assertTrue(all(child_result == WIN for child_result, _ in children))
+                    self.assertEqual(plies, 1 + max(child_plies for _, child_plies in children))
+            self.assertEqual(seen, {WIN, LOSS, DRAW})
+            tablebase.close()
+
+    def test_symmetries(self):
+        """Test the 16 board symmetries and the canonical form of positions."""
+        self.assertEqual(len(set(PERMUTATIONS)), SYMMETRY_COUNT)
+        self.assertEqual(PERMUTATIONS[0], tuple(range(24)))
+        mills = set(MILL_MASKS)
+        for symmetry in range(SYMMETRY_COUNT):
+            for index in range(24):
+                self.assertEqual(transform_mask(ADJACENT_MASKS[index], symmetry),
+                                 ADJACENT_MASKS[PERMUTATIONS[symmetry][index]])
+            self.assertEqual({transform_mask(mill, symmetry) for mill in MILL_MASKS}, mills)
+            self.assertEqual(transform_mask(transform_mask(0xABCDEF, symmetry), INVERSES[symmetry]), 0xABCDEF)
+
+        # every image has the same canonical key and the moves of the image are the images of the moves
+        position = Position.from_string("WW.B..W..B...B.W....B... 2 5 5")
+        key, symmetry = canonical_key(position)
+        moves = position.generate_moves(captures=True)
+        for symmetry in range(SYMMETRY_COUNT):
+            image = transform_position(position, symmetry)
+            self.assertEqual(canonical_key(image)[0], key)
+            self.assertEqual(image.features, features(image.masks[1], image.masks[2]))
+            self.assertEqual(sorted(image.generate_moves(captures=True)),
+                             sorted(transform_move(move, symmetry) for move in moves))
+
+        # sharing table entries between images does not change the value of the search
+        for row, col, player in ((1, 1, 2), (1, 4, 1), (4, 1, 1), (7, 4, 2)):
+            self.board.update(row, col, player)
+            self.game._placed[player] += 1
+        ai = AIPLayer(self.game, graphic="gui", hash_size_mb=1, max_depth=3)
+        symmetric = AIPLayer(self.game, graphic="gui", hash_size_mb=1, max_depth=3, symmetric_table=True)
+        self.assertIn(symmetric.minimax_decision(True), POINTS)
+        ai.minimax_decision(True)
+        self.assertEqual(symmetric.best_value, ai.best_value)
+
+    def test_opening_book(self):
+        """Test that the book answers every image of a position and that the AI places the book move without searching."""
+        book = build(1, 2, log=lambda line: None)
+        self.assertEqual(len(book), 4)
+        self.game.place_piece(1, 1, 1, "human_vs_ai")
+        position = self.game.get_position(2)
+        move = book.probe(position)
+        self.assertIn(move, position.generate_moves(captures=True))
+        after = position.copy()
+        after.make_move(move)
+        for symmetry in range(SYMMETRY_COUNT):
+            # the move may differ on an image the position is symmetric to, the position it leads to may not
+            image = transform_position(position, symmetry)
+            image.make_move(book.probe(image))
+            self.assertEqual(canonical_key(image)[0], canonical_key(after)[0])
+        self.assertIsNone(book.probe(Position.from_string("W.......B............... 1 8 8")))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "opening.book")
+            book.save(path)
+            self.assertEqual(OpeningBook.load(path).entries, book.entries)
+            self.assertEqual(len(OpeningBook.load(os.path.join(directory, "missing.book"))), 0)
+
+        ai = AIPLayer(self.game, graphic="gui", hash_size_mb=1, opening_book=book)
+        self.assertEqual(ai.place_on_board(), POINTS[move[1]])
+        self.assertEqual(ai.nodes, 0)
+        self.assertEqual(self.game._placed[2], 1)
+
+    def test_arena(self):
+        """Test that headless games between the engines finish and that the match report adds up."""
+        self.assertEqual(parse_engine("minimax:max_depth=2,symmetric_table=True"),
+                         ("minimax", {"max_depth": 2, "symmetric_table": True}))
+        with self.assertRaises(ValueError):
+            parse_engine("stockfish")
+        self.assertEqual(elo_difference(1, 0, 1)[0], 0)
+        elo, low, high = elo_difference(30, 10, 10)
+        self.assertAlmostEqual(elo, 147.2, places=1)
+        self.assertLess(low, elo)
+        self.assertLess(elo, high)
+
+        result = play_game(parse_engine("smart"), parse_engine("minimax:max_depth=1"), seed=3)
+        self.assertIn(result["winner"], (0, 1, 2))
+        self.assertGreater(result["moves"][1], 0)
+        self.assertEqual(result["fallbacks"][1], 0)
+        # a bug in an engine is not played over with a random move
+        with self.assertRaises(AttributeError):
+            play_game(("minimax", {"opening_book": "no book"}), parse_engine("random"), opening_plies=0)
+
+        match = run_match(parse_engine("minimax:max_depth=1"), parse_engine("random"), 4)
+        self.assertEqual(match["wins"] + match["draws"] + match["losses"], 4)
+        self.assertGreater(match["wins"], match["losses"])
+        self.assertEqual(match["fallbacks"], [0, 0])
+
+    def test_game_driver(self):
+        """Test that the driver advances a game from actions, asks for a removal after a mill and ends it."""
+        driver = GameDriver()
+        self.assertEqual(len(driver.legal_actions()), 24)
+        for white, black in (((1, 1), (7, 7)), ((1, 4), (7, 4))):
+            self.assertEqual(driver.place(white, player=1), [Event(PLACED, 1, (white,)), Event(TURN, 2, ())])
+            driver.place(black)
+        with self.assertRaises(PlayerError):
+            driver.place((4, 1), player=2)
+        with self.assertRaises(ValueError):
+            driver.place((1, 1))
+        with self.assertRaises(PlayerError):
+            driver.move((1, 1), (4, 1))
+
+        self.assertEqual(driver.place((1, 7)), [Event(PLACED, 1, ((1, 7),)), Event(MILL, 1, ()), Event(TURN, 1, ())])
+        self.assertTrue(driver.awaiting_removal)
+        self.assertEqual(driver.legal_actions(), [("remove", (7, 4)), ("remove", (7, 7))])
+        with self.assertRaises(PlayerError):
+            driver.place((4, 1))
+        self.assertEqual(driver.remove((7, 7)), [Event(REMOVED, 1, ((7, 7),)), Event(TURN, 2, ())])
+        self.assertEqual(driver.position.to_string(), "WWW...................B. 2 6 7")
+
+        # white flies into a mill and takes the third black piece
+        driver = GameDriver(Position.from_string("WW......W.....B......BB. 1 0 0"))
+        events = driver.play((8, 2, 14))
+        self.assertEqual([event.kind for event in events], [MOVED, MILL, TURN, REMOVED, GAME_OVER])
+        self.assertEqual((driver.winner, driver.over, driver.legal_actions()), (1, True, []))
+
+        # the AI search decides on a worker thread and stops when asked
+        ai = AIPLayer(self.game, graphic="gui", hash_size_mb=1, max_depth=30)
+        worker = SearchWorker(ai)
+        try:
+            future = worker.start(True)
+            with self.assertRaises(RuntimeError):
+                worker.start(True)
+            worker.cancel()
+            move = future.result(timeout=60)
+            self.assertIn(move, POINTS)
+            self.assertLess(worker.progress()[0], 30)
+            # the decided move is played as it is, without another search
+            nodes = ai.nodes
+            self.assertEqual(ai.play_placement(move), move)
+            self.assertEqual(ai.nodes, nodes)
+
+        finally:
+            worker.close()
+
+        # a blocked AI has no move, and the caller is told so instead of a search starting again
+        board = Board()
+        game = Game(board, graphic_mode=self.mock_graphic_mode, graphic="gui")
+        for row, col, player in ((1, 1, 2), (1, 4, 1), (4, 1, 1), (7, 7, 1)):
+            board.update(row, col, player)
+        game._placed = [0, 9, 9]
+        worker = SearchWorker(AIPLayer(game, graphic="gui", hash_size_mb=1))
+        try:
+            self.assertIsNone(worker.start(False).result(timeout=60))
+        finally:
+            worker.close()
+
+    def test_pondering(self):
+        """Test that the AI searches the expected reply on the human's time and answers it at once."""
+        ai = AIPLayer(self.game, graphic="gui", hash_size_mb=1)
+        worker = SearchWorker(ai)
+        try:
+            self.assertIsNone(worker.ponder())  # nothing searched yet, nothing to predict
+            self.game.place_piece(1, 1, 1, "human_vs_ai")
+            ai.place_on_board()
+            before = self.game.get_position(1)
+            predicted = ai.ponder_position()
+            self.assertEqual(predicted.turn, 2)
+            reply = (predicted.masks[1] & ~before.masks[1]).bit_length() - 1
+
+            ai.depth_reached = 0
+            future = worker.ponder()
+            for _ in range(6000):
+                if worker.progress()[0] >= ai.max_depth:
+                    break
+                time.sleep(0.01)
+            self.game.place_piece(*POINTS[reply], 1, "human_vs_ai")
+            worker.stop_pondering()
+            self.assertFalse(worker.pondering)
+            row, col = ai.place_on_board()
+            # the ponder move, without a new search
+            self.assertEqual(ai.last_search_move, future.result())
+            self.assertEqual(POINTS[future.result()[1]], (row, col))
+            self.assertEqual(ai.search_time, 0.0)
+            self.assertGreaterEqual(ai.depth_reached, ai.max_depth)
+
+            # another reply is searched, and the search stops pondering first
+            before = self.game.get_position(1)
+            predicted = ai.ponder_position()
+            worker.ponder()
+            other = next(index for index in range(24)
+                         if not (before.occupied | predicted.masks[1]) >> index & 1)
+            self.game.place_piece(*POINTS[other], 1, "human_vs_ai")
+            self.assertIn(worker.start(True).result(timeout=60), POINTS)
+            self.assertFalse(worker.pondering)
+            self.assertGreater(ai.search_time, 0.0)
+        finally:
+            worker.close()
+
+    def test_game_server(self):
+        """Test the line protocol of the game server and a small load test against it."""
+        self.assertEqual(parse_point("d7"), (7, 4))
+        self.assertEqual(format_point((7, 4)), "d7")
+        with self.assertRaises(ValueError):
+            parse_point("h1")
+
+        async def session():
+            server = GameServer(workers=1, ai_options={"max_depth": 1, "book": False})
+            await server.start("127.0.0.1", 0)
+            try:
+                reader, writer = await asyncio.open_connection(*server.address)
+
+                async def request(line):
+                    writer.write(line.encode() + b"\n")
+                    await writer.drain()
+                    return (await reader.readline()).decode().split()
+
+                self.assertEqual(await request("a new human"), ["a", "ok", "1"] + "........................ 1 9 9 1 0 -".split())
+                answer = await request("b place 1 a1")
+                self.assertEqual(answer[2:11], ["1", "W.......................", "2", "8", "9", "2", "0", "-", "placed:1:a1"])
+                self.assertEqual((await request("c place 1 a1"))[:2], ["c", "error"])
+                self.assertEqual((await request("d move 9 a1 a4"))[1:], ["error", "Unknown", "game"])
+
+                # against the AI, the answer carries its reply
+                answer = await request("e new")
+                answer = await request(f"f place {answer[2]} g7")
+                self.assertEqual(answer[1], "ok")
+                self.assertEqual([event.split(":")[:2] for event in answer[10:]], [["placed", "1"], ["turn", "2"],
+                                                                                   ["placed", "2"], ["turn", "1"]])
+                self.assertEqual(answer[5:7], ["8", "8"])
+                self.assertIn("ai_moves=1", await request("g stats"))
+                writer.close()
+
+                result = await run_load_test(*server.address, games=4, connections=2)
+                self.assertEqual((result["games"], result["errors"]), (4, 0))
+                self.assertGreater(result["moves"], 0)
+                self.assertLessEqual(result["latency"][0], result["latency"][1])
+            finally:
+                await server.close()
+
+        asyncio.run(session())
+
+        async def failing_session():
+            # a search that fails in the worker: the request is answered and its game ended
+            server = GameServer(workers=1, ai_options={"max_depth": "deep", "book": False})
+            await server.start("127.0.0.1", 0)
+            try:
+                reader, writer = await asyncio.open_connection(*server.address)
+                writer.write(b"a new\nb place 1 g7\nc show 1\n")
+                await writer.drain()
+                answers = [(await reader.readline()).decode().split() for _ in range(3)]
+                self.assertEqual(answers[1], ["b", "error", "internal", "TypeError"])
+                self.assertEqual(answers[2], ["c", "error", "Unknown", "game"])
+                writer.close()
+            finally:
+                await server.close()
+
+        with self.assertLogs("services.server", "ERROR"):
+            asyncio.run(failing_session())
+
+    def test_engine_protocol(self):
+        """Test the text protocol of the engine: positions, searches with info lines, stop and ponderhit."""
+        self.assertEqual(parse_move("d7d6xa1"), (POINT_INDEX[(7, 4)], POINT_INDEX[(6, 4)], POINT_INDEX[(1, 1)]))
+        self.assertEqual(format_move((None, POINT_INDEX[(1, 1)], None)), "a1")
+        output = io.StringIO()
+        engine = Engine(output)
+
+        def answer(command, until="bestmove"):
+            start = len(output.getvalue())
+            engine.handle(command)
+            for _ in range(6000):
+                lines = output.getvalue()[start:].splitlines()
+                if any(line.startswith(until) for line in lines):
+                    return lines
+                time.sleep(0.01)
+            self.fail(f"no {until} after {command}")
+
+        try:
+            self.assertEqual(answer("uci", "uciok")[-1], "uciok")
+            engine.handle("setoption name OwnBook value false")
+            engine.handle("position startpos moves a1 d7 g1")
+            lines = answer("go depth 3")
+            infos = [line.split() for line in lines if line.startswith("info depth")]
+            self.assertEqual([int(info[2]) for info in infos], [1, 2, 3])
+            for name in ("score", "nodes", "nps", "time", "pv"):
+                self.assertIn(name, infos[-1])
+            best = lines[-1].split()
+            self.assertEqual((best[0], best[1]), ("bestmove", infos[-1][infos[-1].index("pv") + 1]))
+            self.assertIn(parse_move(best[1]), engine.position.generate_moves(captures=True))
+
+            # white to move is searched with the colors swapped
+            engine.handle("position fen WW......W.....B......BB. 1 0 0")
+            lines = answer("go depth 2")
+            self.assertIn("score mate 1", lines[-2])
+            self.assertEqual(parse_move(lines[-1].split()[1])[:2], (8, 2))
+            engine.handle(f"position fen WW......W.....B......BB. 1 0 0 moves {lines[-1].split()[1]}")
+            self.assertEqual(answer("go depth 2")[-1], "bestmove (none)")
+
+            # a pondering search answers only after ponderhit or stop
+            engine.handle("position startpos")
+            engine.handle("go ponder")
+            time.sleep(0.2)
+            self.assertNotIn("bestmove", output.getvalue().splitlines()[-1])
+            engine.handle("ponderhit")
+            self.assertTrue(answer("stop")[-1].startswith("bestmove "))
+            self.assertEqual(answer("position startpos moves zz", "info string")[-1], "info string Invalid move 'zz'")
+        finally:
+            engine.quit()
+
+    def test_position_string(self):
+        """Test that a position survives writing and reading it as text."""
+        position = Position(white=0b11, black=1 << 23, turn=2, white_in_hand=7, black_in_hand=8)
+        self.assertEqual(position.to_string(), "WW.....................B 2 7 8")
+        self.assertEqual(Position.from_string(position.to_string()), position)
+        with self.assertRaises(ValueError):
+            Position.from_string("WW.. 1 0 0")
+
+    def test_perft(self):
+        """Test the move generator against the reference leaf counts of tests/fixtures/perft.json."""
+        with open(os.path.join(os.path.dirname(__file__), "fixtures", "perft.json")) as file:
+            fixtures = json.load(file)
+        for fixture in fixtures:
+            position = Position.from_string(fixture["position"])
+            for captures, counts in ((True, fixture["captures"]), (False, fixture["no_captures"])):
+                for depth, count in enumerate(counts, 1):
+                    self.assertEqual(perft(position, depth, captures), count, (fixture["name"], depth, captures))
+            self.assertEqual(position.to_string(), fixture["position"])
+            self.assertEqual(sum(divide(position, 2).values()), fixture["captures"][1])
+            # the legacy generator of the AI agrees with the one perft counts
+            moves = self.ai.generate_moves(position, player=position.turn, placing=True)
+            self.assertEqual(len(moves), len(position.generate_moves()))
+
 if __name__ == "__main__":
     unittest.main()
@@ -5,6 +5,8 @@ import sys
 import time
 
 from services.ai import AIPLayer
+from services.opening_book import OpeningBook
+from services.search_worker import SearchWorker
 from domain.board import Board
 from services.computer_player import SmartComputer
 from services.game import Game, ComputerPlayer
@@ -33,19 +35,30 @@ MISTY = (24, 84, 115)
 
 # Screen dimensions
 SCREEN_WIDTH, SCREEN_HEIGHT = 800, 800
+PIECE_RADIUS = 20
+# a click this many pixels from an intersection, on both axes, hits it
+HIT_RADIUS = 25
+# the status strips at the top (whose turn) and the bottom (pieces left)
+TURN_STRIP = pygame.Rect(0, 10, SCREEN_WIDTH, 50)
+PIECES_STRIP = pygame.Rect(0, 750, SCREEN_WIDTH, 50)
+# rendered status texts kept at most, they only differ in the counts
+TEXT_CACHE_SIZE = 256
 
 class GUI:
     def __init__(self):
         self.board = Board()
         self.__game = Game(self.board, self, "gui")
         self.__computer_player = ComputerPlayer(self.__game, "gui")
-        self.__ai_player = AIPLayer(self.__game, "gui")
+        self.__ai_player = AIPLayer(self.__game, "gui", opening_book=OpeningBook.load())
+        # the AI searches on a worker thread so the window keeps handling events
+        self.__search_worker = SearchWorker(self.__ai_player)
         self.__smart_computer = SmartComputer(self.__game, "gui")
         self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         pygame.display.set_caption("Nine Men's Morris")
         self.TITLE_FONT = pygame.font.SysFont('cambria', 72)
         self.BUTTON_FONT = pygame.font.SysFont('cambria', 36)
         self.TEXT_FONT = pygame.font.SysFont('georgia', 28)
+        self.STATUS_FONT = pygame.font.SysFont('georgia', 20)
         self.game_mode = {
             "human_vs_human": self.human_vs_human,
             "human_vs_computer": self.human_vs_easy_computer,
@@ -103,6 +116,35 @@ class GUI:
         }
         self.black_positions = set()
         self.white_positions = set()
+        # pixel -> board line tables for hit testing, and (row, col) -> intersection, built once (see intersection_at)
+        self.__line_at_x, self.__line_at_y = self.hit_test_tables(self.valid_intersections, HIT_RADIUS)
+        self.__coords_to_intersection = {(int(coords[1]), int(coords[0])): intersection
+                                         for intersection, coords in self.intersection_to_coords.items()}
+        # the empty board, drawn once; pieces are drawn over copies of it (see redraw_points)
+        self.__board_surface = None
+        self.__text_cache = {}
+
+    @staticmethod
+    def hit_test_tables(intersections, radius):
+        """
+        Per axis, the coordinate of the board line each pixel is within radius of, None between the lines.
+        The intersections lie where a vertical and a horizontal line cross, so a click needs two lookups.
+        """
+        line_at_x = [None] * SCREEN_WIDTH
+        line_at_y = [None] * SCREEN_HEIGHT
+        for x, y in intersections:
+            for pixel in range(max(x - radius, 0), min(x + radius + 1, SCREEN_WIDTH)):
+                line_at_x[pixel] = x
+            for pixel in range(max(y - radius, 0), min(y + radius + 1, SCREEN_HEIGHT)):
+                line_at_y[pixel] = y
+        return line_at_x, line_at_y
+
+    def intersection_at(self, x, y):
+        """The intersection (ix, iy) a mouse position is on, None if it is on none."""
+        if not (0 <= x < SCREEN_WIDTH and 0 <= y < SCREEN_HEIGHT):
+            return None
+        intersection = (self.__line_at_x[x], self.__line_at_y[y])
+        return intersection if intersection in self.intersection_to_coords else None
 
     def draw_text(self, surface, text, font, color, x, y, center=False):
         """Helper function to draw text on the screen."""
@@ -216,13 +258,18 @@ class GUI:
         pygame.display.flip()
         return buttons
 
+    def quit(self):
+        """Stops the AI worker, pondering included, and closes the window; every exit goes through here."""
+        self.__search_worker.close()
+        pygame.quit()
+        sys.exit()
+
     def wait_for_button_click(self, buttons):
         """Wait for the user to click one of the buttons."""
         while True:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
+                    self.quit()
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     x, y = event.pos
                     for button in buttons:
@@ -234,52 +281,65 @@ class GUI:
                                 button_y - button_height // 2 < y < button_y + button_height // 2:
                             return button["mode"]
 
+    def board_surface(self):
+        """The board without pieces or status text, rendered on first use."""
+        if self.__board_surface is None:
+            surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+            surface.fill(BEIGE)
+            pygame.draw.rect(surface, BLACK, (100, 100, 600, 600), 2)
+            pygame.draw.rect(surface, BLACK, (200, 200, 400, 400), 2)
+            pygame.draw.rect(surface, BLACK, (300, 300, 200, 200), 2)
+            pygame.draw.line(surface, BLACK, (400, 100), (400, 300), 2)
+            pygame.draw.line(surface, BLACK, (400, 500), (400, 700), 2)
+            pygame.draw.line(surface, BLACK, (100, 400), (300, 400), 2)
+            pygame.draw.line(surface, BLACK, (500, 400), (700, 400), 2)
+            self.__board_surface = surface.convert()
+        return self.__board_surface
+
+    def text_surface(self, text, font, color):
+        """The rendered text, cached since the status texts repeat."""
+        key = (text, id(font), color)
+        surface = self.__text_cache.get(key)
+        if surface is None:
+            if len(self.__text_cache) >= TEXT_CACHE_SIZE:
+                self.__text_cache.clear()
+            surface = self.__text_cache[key] = font.render(text, True, color)
+        return surface
+
     def display_board(self):
         """Display the game board."""
-        self.screen.fill(BEIGE)
-        pygame.draw.rect(self.screen, BLACK, (100, 100, 600, 600), 2)
-        pygame.draw.rect(self.screen, BLACK, (200, 200, 400, 400), 2)
-        pygame.draw.rect(self.screen, BLACK, (300, 300, 200, 200), 2)
-        pygame.draw.line(self.screen, BLACK, (400, 100), (400, 300), 2)
-        pygame.draw.line(self.screen, BLACK, (400, 500), (400, 700), 2)
-        pygame.draw.line(self.screen, BLACK, (100, 400), (300, 400), 2)
-        pygame.draw.line(self.screen, BLACK, (500, 400), (700, 400), 2)
-
-        turn_text = "Player 1's Turn"
-        self.draw_text(self.screen, turn_text, self.TEXT_FONT, BLACK, SCREEN_WIDTH // 2, 20, center=True)
-        pygame.draw.circle(self.screen, WHITE, (SCREEN_WIDTH // 2 + 110, 20), 15)
-
-        pieces_left_text = "Player 1 - 9     Player 2 - 9"
-        self.draw_text(self.screen, pieces_left_text, self.TEXT_FONT, BLACK, SCREEN_WIDTH // 2, 760, center=True)
-        pygame.draw.circle(self.screen, WHITE, (SCREEN_WIDTH // 2 - 200, 760), 15)
-        pygame.draw.circle(self.screen, BLACK, (SCREEN_WIDTH // 2 + 200, 760), 15)
+        self.screen.blit(self.board_surface(), (0, 0))
+        self.draw_status_text(1, 9, 9)
         pygame.display.flip()
 
-    def update_status_text(self, player, whites_left, blacks_left):
-        """Update the status text with the current player's turn and pieces left."""
-        # Clear the previous text
-        self.screen.fill(BEIGE, (0, 10, SCREEN_WIDTH, 50))  # Top part for player's turn
-        self.screen.fill(BEIGE, (0, 750, SCREEN_WIDTH, 50))  # Bottom part for pieces left
+    def draw_status_text(self, player, whites_left, blacks_left):
+        """Draw the current player's turn and the pieces left, without updating the display."""
+        self.screen.fill(BEIGE, TURN_STRIP)
+        self.screen.fill(BEIGE, PIECES_STRIP)
 
         # Display player's turn at the top
-        turn_text = f"Player {player}'s Turn"
+        turn_text = self.text_surface(f"Player {player}'s Turn", self.TEXT_FONT, BLACK)
+        self.screen.blit(turn_text, turn_text.get_rect(center=(SCREEN_WIDTH // 2, 20)))
         color = WHITE if player == 1 else BLACK
-        self.draw_text(self.screen, turn_text, self.TEXT_FONT, BLACK, SCREEN_WIDTH // 2, 20, center=True)
         pygame.draw.circle(self.screen, color, (SCREEN_WIDTH // 2 + 110, 20), 15)
 
         # Display pieces left at the bottom
-        pieces_left_text = f"Player 1 - {whites_left}     Player 2 - {blacks_left}"
-        self.draw_text(self.screen, pieces_left_text, self.TEXT_FONT, BLACK, SCREEN_WIDTH // 2, 760, center=True)
+        pieces_left_text = self.text_surface(f"Player 1 - {whites_left}     Player 2 - {blacks_left}",
+                                             self.TEXT_FONT, BLACK)
+        self.screen.blit(pieces_left_text, pieces_left_text.get_rect(center=(SCREEN_WIDTH // 2, 760)))
         pygame.draw.circle(self.screen, WHITE, (SCREEN_WIDTH // 2 - 200, 760), 15)
         pygame.draw.circle(self.screen, BLACK, (SCREEN_WIDTH // 2 + 200, 760), 15)
 
-        pygame.display.flip()
+    def update_status_text(self, player, whites_left, blacks_left):
+        """Update the status text with the current player's turn and pieces left."""
+        self.draw_status_text(player, whites_left, blacks_left)
+        # the turn circle reaches above the strip
+        pygame.display.update([TURN_STRIP.union((0, 0, SCREEN_WIDTH, 10)), PIECES_STRIP])
 
     def draw_placement(self, ix, iy, whites_left, blacks_left, player, game_mode):
         # Place the piece on the board
         color = WHITE if player == 1 else BLACK
-        pygame.draw.circle(self.screen, color, (ix, iy), 20)
-        pygame.display.flip()
+        pygame.display.update(pygame.draw.circle(self.screen, color, (ix, iy), PIECE_RADIUS))
         self.occupied_positions.add((ix, iy))
         game_coord = self.intersection_to_coords[(ix, iy)]
         row = int(game_coord[1])
@@ -294,24 +354,26 @@ class GUI:
         # color = WHITE if player == 1 else BLACK
 
         if game_mode == "human_vs_human" or player == 1:
+            if game_mode == "human_vs_ai":
+                # the AI searches the reply it expects while the human thinks
+                self.__search_worker.ponder()
             while True:
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
-                        pygame.quit()
-                        sys.exit()
+                        self.quit()
                     if event.type == pygame.MOUSEBUTTONDOWN:
-                        x, y = event.pos
-                        # Check if the click is within the board boundaries
-                        for ix, iy in self.valid_intersections:
-                            if ix - 25 <= x <= ix + 25 and iy - 25 <= y <= iy + 25 and (ix, iy) not in self.occupied_positions:
-                                if player == 1:
-                                    self.white_positions.add((ix, iy))
-                                    # self.__game._white_pieces.append((ix, iy))
-                                else:
-                                    self.black_positions.add((ix, iy))
-
-                                self.draw_placement(ix, iy, whites_left, blacks_left, player, game_mode)
-                                return
+                        # Check if the click is on a free intersection
+                        intersection = self.intersection_at(*event.pos)
+                        if intersection is not None and intersection not in self.occupied_positions:
+                            ix, iy = intersection
+                            if player == 1:
+                                self.white_positions.add((ix, iy))
+                                # self.__game._white_pieces.append((ix, iy))
+                            else:
+                                self.black_positions.add((ix, iy))
+
+                            self.draw_placement(ix, iy, whites_left, blacks_left, player, game_mode)
+                            return
 
         else:
             if game_mode == "human_vs_computer":
@@ -322,7 +384,12 @@ class GUI:
                 print(ix, iy)
 
             elif game_mode == "human_vs_ai":
-                ix, iy = self.__ai_player.place_on_board()
+                best_move = self.wait_for_ai(placing=True)
+                if best_move is None:
+                    # the AI has nowhere to place, it lost
+                    self.display_winner(1)
+                    return
+                ix, iy = self.__ai_player.play_placement(best_move)
 
             coords = self.board_to_gui_coords([(ix, iy)])
             ix = int(coords[0])
@@ -331,6 +398,30 @@ class GUI:
             self.black_positions.add((ix, iy))
             self.draw_placement(ix, iy, whites_left, blacks_left, player, game_mode)
 
+    def wait_for_ai(self, placing):
+        """
+        Runs the AI search in the background, showing its progress, and returns its move; Esc plays at once.
+        The move is None when the AI has none.
+        """
+        future = self.__search_worker.start(placing)
+        strip = (0, 722, SCREEN_WIDTH, 26)
+        clock = pygame.time.Clock()
+        while not future.done():
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.quit()
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                    self.__search_worker.cancel()
+            depth, nodes = self.__search_worker.progress()
+            self.screen.fill(BEIGE, strip)
+            self.draw_text(self.screen, f"AI thinking... depth {depth}, {nodes} positions (Esc to move now)",
+                           self.STATUS_FONT, BLACK, SCREEN_WIDTH // 2, 735, center=True)
+            pygame.display.update(strip)
+            clock.tick(30)
+        self.screen.fill(BEIGE, strip)
+        pygame.display.update(strip)
+        return future.result()
+
     def display_move(self, initial_x, initial_y, final_x, final_y, player):
         selected_piece = (initial_x, initial_y)
         self.occupied_positions.remove(selected_piece)
@@ -341,7 +432,7 @@ class GUI:
         else:
             self.black_positions.remove(selected_piece)
             self.black_positions.add((final_x, final_y))
-        self.redraw_board()
+        self.redraw_points([selected_piece, (final_x, final_y)])
         # self.__game.move_piece(initial_x, initial_y, final_x, final_y, player, self.game_mode)
         self.update_status_text(2 if player == 1 else 1, len(self.__game.white_pieces), len(self.__game.black_pieces))
         self.screen.fill(BEIGE, (0, 720, SCREEN_WIDTH, 100))  # Clear the previous text
@@ -353,36 +444,34 @@ class GUI:
         initial_pos = None
 
         if game_mode == "human_vs_human" or player == 1:
+            if game_mode == "human_vs_ai":
+                self.__search_worker.ponder()
             while True:
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
-                        pygame.quit()
-                        sys.exit()
+                        self.quit()
                     if event.type == pygame.MOUSEBUTTONDOWN:
-                        x, y = event.pos
                         # Check if the click is on one of the player's pieces
-                        for ix, iy in self.occupied_positions:
-                            if ix - 25 <= x <= ix + 25 and iy - 25 <= y <= iy + 25:
-                                if (ix, iy) in (self.white_positions if player == 1 else self.black_positions):
-                                    selected_piece = (ix, iy)
-                                    initial_pos = (int(self.intersection_to_coords[(ix, iy)][0]), int(self.intersection_to_coords[(ix, iy)][1]))
-                                    break
+                        intersection = self.intersection_at(*event.pos)
+                        if intersection in (self.white_positions if player == 1 else self.black_positions):
+                            selected_piece = intersection
+                            initial_pos = (int(self.intersection_to_coords[intersection][0]), int(self.intersection_to_coords[intersection][1]))
                     if event.type == pygame.MOUSEBUTTONUP and selected_piece:
-                        x, y = event.pos
-                        # Check if the release is within the board boundaries
-                        for ix, iy in self.valid_intersections:
-                            if ix - 25 <= x <= ix + 25 and iy - 25 <= y <= iy + 25:
-                                final_pos = (int(self.intersection_to_coords[(ix, iy)][0]), int(self.intersection_to_coords[(ix, iy)][1]))
-                                try:
-                                    can_fly = True if len(self.white_positions) == 3 and player == 1 or len(self.black_positions) == 3 and player == 2 else False
-                                    self.__game.valid_move(initial_pos[1], initial_pos[0], final_pos[1], final_pos[0], player, can_fly)
-
-                                    self.display_move(selected_piece[0], selected_piece[1], ix, iy, player)
-                                    self.__game.move_piece(initial_pos[1], initial_pos[0], final_pos[1], final_pos[0], player, game_mode)
-
-                                    return  # Exit the function after moving the piece
-                                except (ValueError, AdjError, PlayerError):
-                                    pass
+                        # Check if the release is on an intersection
+                        intersection = self.intersection_at(*event.pos)
+                        if intersection is not None:
+                            ix, iy = intersection
+                            final_pos = (int(self.intersection_to_coords[(ix, iy)][0]), int(self.intersection_to_coords[(ix, iy)][1]))
+                            try:
+                                can_fly = True if len(self.white_positions) == 3 and player == 1 or len(self.black_positions) == 3 and player == 2 else False
+                                self.__game.valid_move(initial_pos[1], initial_pos[0], final_pos[1], final_pos[0], player, can_fly)
+
+                                self.display_move(selected_piece[0], selected_piece[1], ix, iy, player)
+                                self.__game.move_piece(initial_pos[1], initial_pos[0], final_pos[1], final_pos[0], player, game_mode)
+
+                                return  # Exit the function after moving the piece
+                            except (ValueError, AdjError, PlayerError):
+                                pass
 
         else:
             if game_mode == "human_vs_computer":
@@ -399,7 +488,12 @@ class GUI:
                 self.__game.move_piece(initial_x, initial_y, final_x, final_y, player, game_mode)
 
             elif game_mode == "human_vs_ai":
-                initial, final = self.__ai_player.move_piece()
+                best_move = self.wait_for_ai(placing=False)
+                if best_move is None:
+                    # the AI has no legal move, it lost
+                    self.display_winner(1)
+                    return
+                initial, final = self.__ai_player.play_move(best_move)
                 initial_x = int(initial[0])
                 initial_y = int(initial[1])
                 final_x = int(final[0])
@@ -411,38 +505,26 @@ class GUI:
 
 
     def redraw_board(self):
-        """Redraw the entire board, including all pieces except the removed one."""
-        # Clear the screen
-        self.screen.fill(BEIGE)
-
-        # Draw the board (lines and intersections)
-        self.display_board()
-
-        # Re-draw all remaining pieces
-        for (x, y) in self.occupied_positions:
-            piece_color = BLACK if (x, y) in self.black_positions else WHITE
-            pygame.draw.circle(self.screen, piece_color, (x, y), 20)
-
-        # Update the display
-        pygame.display.flip()
+        """Redraw every intersection of the board with its piece, if any."""
+        self.redraw_points(self.valid_intersections)
+
+    def redraw_points(self, points):
+        """Redraw the given intersections from the empty board and update only their part of the display."""
+        board = self.board_surface()
+        rects = []
+        for (x, y) in points:
+            # the square around the piece, with the board lines running through it
+            rect = pygame.Rect(x - PIECE_RADIUS - 1, y - PIECE_RADIUS - 1, 2 * PIECE_RADIUS + 3, 2 * PIECE_RADIUS + 3)
+            self.screen.blit(board, rect, rect)
+            if (x, y) in self.occupied_positions:
+                piece_color = BLACK if (x, y) in self.black_positions else WHITE
+                pygame.draw.circle(self.screen, piece_color, (x, y), PIECE_RADIUS)
+            rects.append(rect)
+        pygame.display.update(rects)
 
     def board_to_gui_coords(self, board_coords):
-        """Convert board coordinates (e.g., A1) to GUI coordinates (x, y)."""
-        gui_coords = []
-
-        for board_coord in board_coords:
-            # print(board_coord)
-            col = board_coord[1]
-            row = board_coord[0]
-
-            mapping = {1: 100, 2: 200, 3: 300, 4: 400, 5: 500, 6: 600, 7: 700}
-
-            x = mapping[col]
-            y = mapping[row]
-
-            gui_coords.append((x, y))
-
-        # print(gui_coords)
+        """Convert board coordinates (row, col) to GUI coordinates (x, y)."""
+        gui_coords = [self.__coords_to_intersection[board_coord] for board_coord in board_coords]
         if len(gui_coords) == 1:
             return gui_coords[0]
 
@@ -459,9 +541,8 @@ class GUI:
         self.occupied_positions.remove((ix, iy))
         self.white_positions.remove((ix, iy)) if player == 2 else self.black_positions.remove((ix, iy))
 
-        # Redraw the board and pieces
-        self.redraw_board()
-        pygame.display.flip()
+        # Redraw the emptied point
+        self.redraw_points([(ix, iy)])
 
         return row, col  # Exit the function after removing the piece
 
@@ -474,10 +555,9 @@ class GUI:
         self.screen.fill(BEIGE, (0, 0, SCREEN_WIDTH, 70))  # Top part for player's turn
         remove_text = f"Player {player}, remove a piece"
         self.draw_text(self.screen, remove_text, self.TEXT_FONT, BLACK, SCREEN_WIDTH // 2, 20, center=True)
-        pygame.display.flip()
+        pygame.display.update((0, 0, SCREEN_WIDTH, 70))
 
-        valid_pieces = self.__game.valid_remove_piece(player)
-        valid_pieces = self.board_to_gui_coords(valid_pieces)
+        valid_pieces = {self.__coords_to_intersection[piece] for piece in self.__game.valid_remove_piece(player)}
 
         # print("these are the valid_pieces", valid_pieces)
 
@@ -485,16 +565,14 @@ class GUI:
             while True:
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
-                        pygame.quit()
-                        sys.exit()
+                        self.quit()
                     if event.type == pygame.MOUSEBUTTONDOWN:
-                        x, y = event.pos
                         # Check if the click is on an opponent's piece
-                        for ix, iy in self.valid_intersections:
-                            if ix - 25 <= x <= ix + 25 and iy - 25 <= y <= iy + 25 and ((ix, iy) in valid_pieces or (ix, iy) == valid_pieces):
-                                row, col = self.draw_remove(ix, iy, player)
-                                # print(row, col)
-                                return row, col  # Exit the function after removing the piece
+                        intersection = self.intersection_at(*event.pos)
+                        if intersection in valid_pieces:
+                            row, col = self.draw_remove(*intersection, player)
+                            # print(row, col)
+                            return row, col  # Exit the function after removing the piece
 
         else:
             if game_mode == "human_vs_computer":
@@ -517,8 +595,7 @@ class GUI:
         while True:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
+                    self.quit()
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     x, y = event.pos
                     if play_again_button["x"] <= x <= play_again_button["x"] + play_again_button["width"] and play_again_button["y"] <= y <= play_again_button["y"] + play_again_button["height"]:
@@ -528,8 +605,7 @@ class GUI:
                         self.game_mode[game_mode]()
                         return
                     if exit_button["x"] <= x <= exit_button["x"] + exit_button["width"] and exit_button["y"] <= y <= exit_button["y"] + exit_button["height"]:
-                        pygame.quit()
-                        sys.exit()
+                        self.quit()
 
     def display_winner(self, player):
         self.screen.fill(BEIGE, (0, 0, SCREEN_WIDTH, 70))
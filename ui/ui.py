@@ -1,6 +1,8 @@
 import pyfiglet
 
 from services.ai import AIPLayer
+from services.opening_book import OpeningBook
+from services.search_worker import SearchWorker
 from domain.board import Board
 from domain.color import Color
 from services.computer_player import SmartComputer
@@ -11,7 +13,11 @@ class UI:
         self.board = Board()
         self.__game = Game(self.board, self, "ui")
         self.__computer_player = ComputerPlayer(self.__game, "ui")
-        self.__ai_player = AIPLayer(self.__game, "ui")
+        self.__ai_player = AIPLayer(self.__game, "ui", opening_book=OpeningBook.load())
+        # the game asks this AI which piece to take, the one its search chose with the move
+        self.__game.ai_player = self.__ai_player
+        # ponders for the AI while the human types a move
+        self.__search_worker = SearchWorker(self.__ai_player)
         self.__smart_computer = SmartComputer(self.__game, "ui")
         self.__commands = {
             "1": self.human_vs_human,
@@ -284,10 +290,12 @@ class UI:
 
             # TODO implement validations for the input datas
             if whites > 0:
+                self.__search_worker.ponder()
                 self.piece_to_place(1, game_mode)
                 whites -= 1
 
             if blacks > 0:
+                self.__search_worker.stop_pondering()
                 self.__ai_player.place_on_board()
                 blacks -= 1
 
@@ -304,6 +312,7 @@ class UI:
             # white moves
 
             if self.__game.check_moves_left(1):
+                self.__search_worker.ponder()
                 self.make_moves(1, game_mode)
             else:
                 print("You have no moves left! Computer wins!")
@@ -312,6 +321,7 @@ class UI:
             # black moves
 
             if self.__game.check_moves_left(2):
+                self.__search_worker.stop_pondering()
                 self.__ai_player.move_piece()
 
                 print('\n')
@@ -338,7 +348,11 @@ class UI:
         while True:
             option = input(">>>")
             if option in self.__commands:
-                self.__commands[option]()
+                try:
+                    self.__commands[option]()
+                finally:
+                    # a ponder search left running would keep the program from exiting
+                    self.__search_worker.close()
                 break
             else:
                 print("Invalid option!!")